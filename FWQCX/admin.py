@@ -0,0 +1,261 @@
+"""
+管理员接口 API 文档
+
+所有管理员接口都要在请求头里带 X-Admin-Token，和环境变量 ADMIN_TOKEN 一致才放行；
+服务器没有配置 ADMIN_TOKEN 时，管理员接口全部关闭。
+
+======================= 批量导入用户 =======================
+URL: POST /api/admin/users/import?workers=0
+
+请求体（直接上传文件内容，不是JSON）：
+    CSV    Content-Type: text/csv              两列 email,password，可以有表头
+    NDJSON Content-Type: application/x-ndjson  每行 {"email": "...", "password": "..."}
+
+响应（NDJSON，每条记录一行，最后一行是汇总）：
+    {"line": 2, "email": "123456789@qq.com", "success": true, "user_id": 101, "verification_key": "A1B2C3"}
+    {"line": 3, "email": "987654321@qq.com", "success": false, "message": "该邮箱已注册"}
+    {"summary": {"total": 2, "created": 1, "failed": 1, "elapsed_ms": 35}}
+
+几万条以内用这个接口；几十万条以上用命令行（python provisioning.py），不受请求超时限制。
+
+======================= 卡密列表 / 导出 =======================
+URL: GET /api/admin/card-keys?status=未激活&limit=100&cursor=...
+    按id顺序，每页最多1000条；响应里的 next_cursor 原样传回来就是下一页，为null表示没有了
+{
+    "success": true,
+    "items": [{"id": 1, "card_key": "VIP-...", "status": "未激活", ...}],
+    "count": 100,
+    "next_cursor": "WzEwMF0"
+}
+
+URL: GET /api/admin/card-keys/export?status=未激活
+    全量导出（NDJSON，每行一张卡密），边查边发，多大的表都不会占满内存
+
+======================= 会员列表 / 导出 =======================
+URL: GET /api/admin/members?expires_from=2024-12-01&expires_to=2025-01-01&active=1&limit=100&cursor=...
+    按到期时间排序（先到期的在前），参数都可以不传
+URL: GET /api/admin/members/export?expires_to=2025-01-01
+
+======================= 卡密批量操作 =======================
+URL: POST /api/admin/card-keys/jobs
+{
+    "action": "freeze",                  # freeze冻结 / unfreeze解冻 / revoke作废 / expire过期
+    "batch_id": "20240101120000-AB12",   # 筛选条件至少一个：batch_id、vip_level、
+    "vip_level": 2,                      #   created_after、created_before（生成时间）
+    "created_before": "2024-02-01"
+}
+    只创建任务、统计张数，立即返回；后台分块执行（每块一个短事务，不长时间锁住卡密）
+
+URL: GET /api/admin/card-keys/jobs/<任务ID>            查看进度
+URL: POST /api/admin/card-keys/jobs/<任务ID>/cancel    取消（已经改掉的卡密不恢复）
+{
+    "success": true,
+    "job": {"id": 3, "action": "freeze", "status": "running", "total": 5000,
+            "processed": 1500, "progress": 30.0, ...}
+}
+
+======================= CPU采样 =======================
+URL: POST /api/admin/profiler
+{
+    "rate": 0.1,        # 被采样的请求比例（0~1），默认1
+    "seconds": 60       # 多少秒后自动停止，默认60，最多600
+}
+URL: POST /api/admin/profiler/stop     提前停止
+URL: GET  /api/admin/profiler          状态：被采样的请求数、样本数、采样开销、每个接口的样本数
+{
+    "success": true,
+    "profiler": {"running": true, "rate": 0.1, "remaining_seconds": 42.5, "samples": 1830,
+                 "overhead_ms": 96.4, "endpoints": {"login": 1210, "check_membership": 620}, ...}
+}
+
+URL: GET /api/admin/profiler/flamegraph?endpoint=login
+    折叠格式的调用栈（text/plain），不带endpoint时是所有接口；
+    保存成文件后用 flamegraph.pl 或 https://www.speedscope.app 打开
+"""
+
+# admin.py - 管理员接口
+import hmac
+import io
+import os
+import tempfile
+from functools import wraps
+
+from datetime import datetime
+
+from flask import Response, request, send_file, stream_with_context
+from serialize import dumps, json_response
+
+from services import db
+from provisioning import UserImporter, detect_format, read_records
+from listing import listing_service
+from card_jobs import card_key_jobs
+from cpuprofile import cpu_profiler
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+if not ADMIN_TOKEN:
+    print("⚠️ 没有配置ADMIN_TOKEN，管理员接口已关闭")
+
+# 接口里校验/哈希用的进程数：默认不开子进程，Web进程里不随便起进程池
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', '0'))
+
+
+def require_admin(view):
+    """管理员接口装饰器：X-Admin-Token 不对就返回403"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return json_response({'success': False, 'message': '需要管理员权限'}, status=403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class AdminAPI:
+    """管理员API类"""
+
+    @staticmethod
+    def import_users():
+        """批量导入用户 - 边读上传内容边处理，每条记录的结果先写到临时文件，最后一起返回"""
+        fmt = request.args.get('format') or detect_format(request.content_type)
+        if fmt not in ('csv', 'ndjson'):
+            return json_response({'success': False, 'message': 'format只支持csv或ndjson'})
+
+        try:
+            workers = int(request.args.get('workers', IMPORT_WORKERS))
+        except ValueError:
+            return json_response({'success': False, 'message': 'workers必须是整数'})
+
+        print(f"📥 批量导入用户：格式={fmt}，进程数={workers}")
+
+        # 结果可能有几万行，写临时文件而不是攒在内存里
+        results = tempfile.TemporaryFile()
+
+        def on_result(result):
+            results.write(dumps(result) + b'\n')
+
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        report = UserImporter(db).run(read_records(lines, fmt), workers, on_result=on_result)
+
+        results.write(dumps({'summary': report}) + b'\n')
+        results.seek(0)
+        return send_file(results, mimetype='application/x-ndjson')
+
+    # ---------- 列表 / 导出 ----------
+
+    @staticmethod
+    def _list_args():
+        """解析列表接口的公共参数：limit、cursor"""
+        limit = request.args.get('limit')
+        return (int(limit) if limit else None), request.args.get('cursor') or None
+
+    @staticmethod
+    def _member_filters():
+        """解析会员筛选参数：expires_from/expires_to（YYYY-MM-DD或带时间）、active（1/0）"""
+        filters = {}
+        for name in ('expires_from', 'expires_to'):
+            value = request.args.get(name)
+            filters[name] = datetime.fromisoformat(value) if value else None
+        active = request.args.get('active')
+        filters['active'] = None if active in (None, '') else active in ('1', 'true')
+        return filters
+
+    @staticmethod
+    def list_card_keys():
+        """卡密分页列表"""
+        try:
+            limit, cursor = AdminAPI._list_args()
+        except ValueError:
+            return json_response({'success': False, 'message': 'limit必须是正整数'})
+
+        result = listing_service.list_card_keys(request.args.get('status') or None, limit, cursor)
+        return json_response(result.to_dict())
+
+    @staticmethod
+    def export_card_keys():
+        """卡密全量导出（NDJSON流）"""
+        lines = listing_service.export_card_keys(request.args.get('status') or None)
+        return AdminAPI._ndjson_stream(lines)
+
+    @staticmethod
+    def list_members():
+        """会员分页列表"""
+        try:
+            limit, cursor = AdminAPI._list_args()
+            filters = AdminAPI._member_filters()
+        except ValueError:
+            return json_response({'success': False, 'message': 'limit必须是正整数，时间格式为YYYY-MM-DD'})
+
+        result = listing_service.list_members(limit=limit, cursor=cursor, **filters)
+        return json_response(result.to_dict())
+
+    @staticmethod
+    def export_members():
+        """会员全量导出（NDJSON流）"""
+        try:
+            filters = AdminAPI._member_filters()
+        except ValueError:
+            return json_response({'success': False, 'message': '时间格式为YYYY-MM-DD'})
+
+        return AdminAPI._ndjson_stream(listing_service.export_members(**filters))
+
+    @staticmethod
+    def _ndjson_stream(lines):
+        """
+        NDJSON流式响应
+
+        生成器在视图函数返回以后才被逐行取走；stream_with_context 让请求上下文保持到最后一行发完，
+        teardown_request 也推迟到那时才执行：优雅退出会等导出做完（lifecycle.py），
+        准入名额也一直占着（admission.py）
+        """
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+    # ---------- 卡密批量操作 ----------
+
+    @staticmethod
+    def create_card_key_job():
+        """创建卡密批量操作任务"""
+        data = request.json
+        if not data:
+            return json_response({'success': False, 'message': '请提供操作和筛选条件'})
+
+        result = card_key_jobs.create(data.get('action', ''), data)
+        return json_response(result.to_dict())
+
+    @staticmethod
+    def card_key_job(job_id):
+        """查看卡密批量操作任务的进度"""
+        return json_response(card_key_jobs.get(job_id).to_dict())
+
+    @staticmethod
+    def cancel_card_key_job(job_id):
+        """取消卡密批量操作任务"""
+        return json_response(card_key_jobs.cancel(job_id).to_dict())
+
+    # ---------- CPU采样 ----------
+
+    @staticmethod
+    def start_profiler():
+        """打开CPU采样"""
+        data = request.get_json(silent=True) or {}
+        try:
+            cpu_profiler.start(data.get('rate', 1.0), data.get('seconds', 60))
+        except (TypeError, ValueError):
+            return json_response({'success': False, 'message': 'rate和seconds必须是数字'})
+        return json_response({'success': True, 'message': 'CPU采样已打开', 'profiler': cpu_profiler.stats()})
+
+    @staticmethod
+    def stop_profiler():
+        """提前停止CPU采样"""
+        cpu_profiler.stop()
+        return json_response({'success': True, 'message': 'CPU采样已停止', 'profiler': cpu_profiler.stats()})
+
+    @staticmethod
+    def profiler_status():
+        """CPU采样状态"""
+        return json_response({'success': True, 'profiler': cpu_profiler.stats()})
+
+    @staticmethod
+    def flamegraph():
+        """折叠格式的调用栈（火焰图的输入）"""
+        text = cpu_profiler.collapsed(request.args.get('endpoint') or None)
+        return Response(text, mimetype='text/plain')
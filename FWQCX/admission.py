@@ -0,0 +1,269 @@
+"""
+请求截止时间 + 过载保护 - 数据库变慢时快速返回503，而不是所有线程一起卡死
+文件名：admission.py
+
+Postgres 卡住时，原来的情况是：每个请求都在等数据库，线程一个个被占满，
+新请求继续排队，最后整个服务没有响应。这里分三层：
+
+1. 截止时间（deadline）：每个请求开始时按接口定一个截止时间（ENDPOINT_DEADLINES，
+   默认 REQUEST_DEADLINE 秒），排队的时间也算在里面
+   - 借数据库连接时把剩下的时间设成这个连接的 statement_timeout（database.py），
+     数据库那边到点自动取消查询；按 STATEMENT_TIMEOUT_STEP 向上取整，
+     同一个接口连续借同一个连接时值不变，不用每次都发SET
+   - 已经过了截止时间就不再查数据库，直接抛 DeadlineExceeded
+2. 借连接超时：连接池满了最多等 DATABASE_POOL_TIMEOUT 秒（也不超过截止时间），
+   等不到抛 PoolTimeout（database.py）
+3. 准入控制：同时处理的请求超过 MAX_IN_FLIGHT 就排队，出现下面的情况直接返回503：
+   - 排队的请求已经有 MAX_QUEUE 个（queue_full）
+   - 排队超过 QUEUE_TIMEOUT 秒（queue_timeout）
+   - 最近 POOL_WAIT_WINDOW 秒内借连接平均要等 POOL_WAIT_SHED_MS 毫秒以上（pool_slow）：
+     数据库已经处理不过来了，再放请求进来只会排更长的队；
+     过了这个时间窗口没有新的样本就自动恢复放行
+
+/api/status 的 admission 里可以看到放行/拒绝的次数（按原因、按接口）、借连接的平均等待、
+查询超时和截止时间超时的次数。
+
+gunicorn 默认的同步worker一次只处理一个请求，准入控制要在多线程（--threads）
+或 Flask 自带的服务器下才起作用；截止时间和 statement_timeout 在哪种模式下都有效。
+异步版本（async_app.py）没有接入。
+"""
+
+import math
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+# 默认的请求截止时间（秒）
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '5'))
+# 借数据库连接最多等几秒
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', '2'))
+# statement_timeout 向上取整的粒度（毫秒）
+STATEMENT_TIMEOUT_STEP = int(os.getenv('STATEMENT_TIMEOUT_STEP', '1000'))
+# 不在请求里（后台任务、命令行）时的 statement_timeout（毫秒），0 表示不限制
+STATEMENT_TIMEOUT = int(os.getenv('STATEMENT_TIMEOUT', '0'))
+
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '32'))
+MAX_QUEUE = int(os.getenv('MAX_QUEUE', '64'))
+QUEUE_TIMEOUT = float(os.getenv('QUEUE_TIMEOUT', '1'))
+POOL_WAIT_SHED_MS = float(os.getenv('POOL_WAIT_SHED_MS', '500'))
+POOL_WAIT_WINDOW = 1.0
+
+# 接口 → 截止时间（秒），None 表示不限制（批量导入、全量导出本来就要跑很久）
+# 全量导出的准入名额一直占到最后一行发完（admin.py 用 stream_with_context，teardown_request 推迟执行）
+ENDPOINT_DEADLINES = {
+    'import_users': None,
+    'export_card_keys': None,
+    'export_members': None,
+    'db_check': 30,
+    'readyz': 2,
+}
+# 环境变量覆盖，例如 REQUEST_DEADLINES="login=2,check_vip=1"
+for _item in os.getenv('REQUEST_DEADLINES', '').split(','):
+    if '=' in _item:
+        _name, _seconds = _item.split('=', 1)
+        ENDPOINT_DEADLINES[_name.strip()] = float(_seconds) if _seconds.strip() else None
+
+# 不做准入控制的接口：服务器过载时也要能看状态
+EXEMPT_ENDPOINTS = {'home', 'test_api', 'status_api', 'profiler_status', 'stop_profiler', 'healthz', 'readyz'}
+
+# 当前请求的截止时间（time.monotonic()），None 表示没有
+_deadline = ContextVar('request_deadline', default=None)
+# 当前请求是否占着一个准入名额
+_admitted = ContextVar('request_admitted', default=False)
+
+
+class Overloaded(Exception):
+    """服务器处理不过来了（接口返回503）"""
+
+
+class DeadlineExceeded(Overloaded):
+    """已经过了请求的截止时间"""
+
+
+def remaining():
+    """当前请求还剩几秒，没有截止时间时返回None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline():
+    """过了截止时间就抛 DeadlineExceeded，返回还剩几秒（没有截止时间时返回None）"""
+    left = remaining()
+    if left is not None and left <= 0:
+        admission.note('deadline_exceeded')
+        raise DeadlineExceeded('请求处理超时')
+    return left
+
+
+def statement_timeout_ms():
+    """借连接时要设置的 statement_timeout（毫秒）：剩下的时间向上取整"""
+    left = check_deadline()
+    if left is None:
+        return STATEMENT_TIMEOUT
+    return max(1, math.ceil(left * 1000 / STATEMENT_TIMEOUT_STEP)) * STATEMENT_TIMEOUT_STEP
+
+
+def checkout_timeout():
+    """借连接最多等几秒：DATABASE_POOL_TIMEOUT，但不超过截止时间"""
+    left = check_deadline()
+    return DATABASE_POOL_TIMEOUT if left is None else min(DATABASE_POOL_TIMEOUT, left)
+
+
+class AdmissionController:
+    """限制同时处理的请求数，排不上队、等太久、数据库太慢时直接拒绝"""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE,
+                 queue_timeout=QUEUE_TIMEOUT, pool_wait_shed_ms=POOL_WAIT_SHED_MS):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.pool_wait_shed_ms = pool_wait_shed_ms
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        # 最近 POOL_WAIT_WINDOW 秒内借连接的等待时间：[窗口开始时间, 次数, 总毫秒]
+        self._pool_window = [0.0, 0, 0.0]
+        self._last_shed_print = 0.0
+        self.stats_counter = {
+            'admitted': 0,
+            'shed': 0,
+            'shed_queue_full': 0,
+            'shed_queue_timeout': 0,
+            'shed_pool_slow': 0,
+            'deadline_exceeded': 0,
+            'pool_timeouts': 0,
+            'statement_timeouts': 0,
+        }
+        self.shed_by_endpoint = {}
+
+    def note(self, event):
+        with self._lock:
+            self.stats_counter[event] += 1
+
+    # ---------- 借连接的等待时间 ----------
+
+    def note_pool_wait(self, seconds):
+        now = time.monotonic()
+        with self._lock:
+            window = self._pool_window
+            if now - window[0] > POOL_WAIT_WINDOW:
+                window[:] = [now, 0, 0.0]
+            window[1] += 1
+            window[2] += seconds * 1000
+
+    def pool_wait_ms(self):
+        """最近一个窗口里借连接的平均等待（毫秒），窗口过期算0"""
+        started, count, total = self._pool_window
+        if not count or time.monotonic() - started > POOL_WAIT_WINDOW:
+            return 0.0
+        return total / count
+
+    # ---------- 准入 ----------
+
+    def admit(self, name):
+        """占一个名额，返回None；拒绝时返回原因"""
+        if self.pool_wait_ms() > self.pool_wait_shed_ms:
+            return self._shed(name, 'pool_slow')
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.queued >= self.max_queue:
+                    full = True
+                else:
+                    full = False
+                    self.queued += 1
+            if full:
+                return self._shed(name, 'queue_full')
+
+            left = remaining()
+            timeout = self.queue_timeout if left is None else max(0.0, min(self.queue_timeout, left))
+            try:
+                acquired = self._slots.acquire(timeout=timeout)
+            finally:
+                with self._lock:
+                    self.queued -= 1
+            if not acquired:
+                return self._shed(name, 'queue_timeout')
+
+        with self._lock:
+            self.in_flight += 1
+            self.stats_counter['admitted'] += 1
+        return None
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _shed(self, name, reason):
+        now = time.monotonic()
+        with self._lock:
+            self.stats_counter['shed'] += 1
+            self.stats_counter[f'shed_{reason}'] += 1
+            self.shed_by_endpoint[name] = self.shed_by_endpoint.get(name, 0) + 1
+            # 过载时每秒最多打印一次，不让日志本身成为负担
+            should_print = now - self._last_shed_print >= 1
+            if should_print:
+                self._last_shed_print = now
+        if should_print:
+            print(f"⛔ 过载保护：拒绝请求（{reason}），处理中{self.in_flight}，排队{self.queued}，"
+                  f"借连接平均等待{self.pool_wait_ms():.0f}ms，累计拒绝{self.stats_counter['shed']}")
+        return reason
+
+    # ---------- Flask ----------
+
+    def init_app(self, app):
+        """每个请求开始时定截止时间、占名额；结束时还名额"""
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.register_error_handler(Overloaded, self._overloaded)
+
+    def _before_request(self):
+        from flask import request
+
+        name = request.endpoint or request.path
+        seconds = ENDPOINT_DEADLINES.get(name, REQUEST_DEADLINE)
+        _deadline.set(time.monotonic() + seconds if seconds else None)
+
+        if name in EXEMPT_ENDPOINTS:
+            return None
+        reason = self.admit(name)
+        if reason:
+            return self._unavailable(reason)
+        _admitted.set(True)
+        return None
+
+    def _teardown_request(self, error=None):
+        if _admitted.get():
+            _admitted.set(False)
+            self.release()
+        _deadline.set(None)
+
+    def _overloaded(self, error):
+        reason = 'deadline' if isinstance(error, DeadlineExceeded) else 'overloaded'
+        return self._unavailable(reason, str(error))
+
+    @staticmethod
+    def _unavailable(reason, message='服务器繁忙，请稍后重试'):
+        from serialize import json_response
+
+        response = json_response({'success': False, 'message': message, 'reason': reason}, status=503)
+        response.headers['Retry-After'] = '1'
+        return response
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self.stats_counter,
+                in_flight=self.in_flight,
+                queued=self.queued,
+                max_in_flight=self.max_in_flight,
+                max_queue=self.max_queue,
+                pool_wait_ms=round(self.pool_wait_ms(), 1),
+                shed_by_endpoint=dict(self.shed_by_endpoint)
+            )
+
+
+admission = AdmissionController()
@@ -7,9 +7,24 @@ AI歌曲生成器 - 服务器主程序
 import os
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from auth import AuthAPI
 from vip import VIPAPI
-from database import Database
+from admin import AdminAPI, require_admin
+from services import db as service_db  # 共用的连接池（主库 + 只读从库）
+from services import vip_service
+from sweeper import start_background_tasks, stop_background_tasks, task_stats
+from bloom import negative_cache
+from serialize import PayloadTemplate, json_response, now_text
+from homepage import StaticPage, list_routes, render_home
+from httpcache import http_cache, email_tag
+from cache_backend import cache
+from singleflight import flight_stats
+from tiers import tier_catalog
+from sqlprofile import sql_profiler
+from cpuprofile import cpu_profiler
+from admission import admission
+from lifecycle import lifecycle
 from datetime import datetime
 import json
 
@@ -26,132 +41,43 @@ IS_TENCENT_WEB_FUNC = os.environ.get('TENCENTCLOUD_RUNENV') == 'SCF'
 # 1. 创建Flask应用
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
+# 部署在反向代理/负载均衡后面时，从 X-Forwarded-For 取客户端IP（登录/激活限流按IP计数）
+# TRUSTED_PROXY_HOPS 是前面有几层代理；直接对外时保持0，否则客户端可以伪造IP
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+lifecycle.init_app(app)  # 收到SIGTERM后不再接新请求，等处理中的请求做完再退出
+admission.init_app(app)  # 请求截止时间 + 过载时快速返回503（在其他钩子之前注册：被拒绝的请求不再做别的事）
+http_cache.init_app(app)  # 响应压缩 + ETag/304
+sql_profiler.init_app(app)  # SQL_PROFILE=1 时记录每个请求的SQL（响应头 Server-Timing）
+cpu_profiler.init_app(app)  # CPU采样（管理员接口或 SIGUSR2 打开）
 
 print("="*60)
 print("🎵 AI歌曲生成器服务器 v2.0 启动中...")
 print("="*60)
 
-# 2. 初始化数据库
-try:
-    db = Database(DATABASE_CONFIG)
-    db.init_database()
-    print("✅ 数据库初始化完成")
-except Exception as e:
-    print(f"❌ 数据库初始化失败: {e}")
+# 2. 开始接请求之前：建表/补列（init_database 可以重复执行），再预热连接池、加载会员等级目录
+#    某一步失败时 /readyz 检查时重试，建表没成功之前不会就绪
+lifecycle.on_startup('初始化数据库表', service_db.init_database)
+lifecycle.on_startup('预热数据库连接池', service_db.warm_up)
+lifecycle.on_startup('加载会员等级目录', lambda: tier_catalog.reload(service_db))
+lifecycle.on_ready_check('数据库', service_db.ping)
+lifecycle.start()
+
+# 启动后台任务（释放过期的次数预留、标记过期会员、建立布隆过滤器）
+start_background_tasks()
+
+# 退出步骤（按顺序）：先停后台任务，再写回攒着的数据，最后关连接池
+lifecycle.on_shutdown('停止后台任务', lambda: stop_background_tasks(timeout=5))
+lifecycle.on_shutdown('最后检查时间写回', vip_service.flush_last_checks)
+lifecycle.on_shutdown('停止CPU采样', cpu_profiler.stop)
+lifecycle.on_shutdown('关闭数据库连接池', service_db.close)
 
-# 3. 主页 - 漂亮的Web界面
+# 3. 主页 - 漂亮的Web界面（所有路由注册完之后才渲染，见下面的 HOME_PAGE）
 @app.route('/')
 def home():
     """首页 - 显示服务器状态和API文档"""
-    return """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>🎵 AI歌曲生成器服务器</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                margin: 50px;
-                text-align: center;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-            }
-            .container {
-                background: rgba(255, 255, 255, 0.1);
-                padding: 40px;
-                border-radius: 20px;
-                backdrop-filter: blur(10px);
-                max-width: 800px;
-                margin: 0 auto;
-            }
-            h1 {
-                font-size: 3em;
-                margin-bottom: 20px;
-            }
-            .status {
-                background: rgba(0, 255, 0, 0.2);
-                padding: 10px;
-                border-radius: 10px;
-                margin: 20px 0;
-            }
-            .api-list {
-                text-align: left;
-                background: rgba(255, 255, 255, 0.1);
-                padding: 20px;
-                border-radius: 10px;
-                margin-top: 30px;
-            }
-            .api-item {
-                margin: 10px 0;
-                padding: 10px;
-                background: rgba(255, 255, 255, 0.05);
-                border-radius: 5px;
-            }
-            code {
-                background: rgba(0, 0, 0, 0.3);
-                padding: 2px 5px;
-                border-radius: 3px;
-            }
-            .method {
-                display: inline-block;
-                padding: 2px 8px;
-                border-radius: 4px;
-                font-weight: bold;
-                margin-right: 10px;
-            }
-            .method-get { background: #61affe; }
-            .method-post { background: #49cc90; }
-            .method-put { background: #fca130; }
-            .method-delete { background: #f93e3e; }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🎵 AI歌曲生成器服务器</h1>
-            <div class="status">
-                <h2>✅ 服务器运行正常</h2>
-                <p>版本: 2.0 | 状态: 在线</p>
-                <p>启动时间: """ + datetime.now().strftime('%Y-%m-%d %H:%M:%S') + """</p>
-            </div>
-            
-            <div class="api-list">
-                <h3>📡 可用API接口:</h3>
-                
-                <div class="api-item">
-                    <strong>🔐 用户认证</strong><br>
-                    <span class="method method-post">POST</span> <code>/api/auth/register</code> - 用户注册<br>
-                    <span class="method method-post">POST</span> <code>/api/auth/login</code> - 用户登录
-                </div>
-                
-                <div class="api-item">
-                    <strong>👑 VIP管理</strong><br>
-                    <span class="method method-post">POST</span> <code>/api/vip/generate</code> - 生成卡密（管理员）<br>
-                    <span class="method method-post">POST</span> <code>/api/vip/activate</code> - 激活VIP卡密<br>
-                    <span class="method method-post">POST</span> <code>/api/vip/check</code> - 检查会员状态<br>
-                    <span class="method method-post">POST</span> <code>/api/vip/record</code> - 记录使用次数
-                </div>
-                
-                <div class="api-item">
-                    <strong>🔧 系统功能</strong><br>
-                    <span class="method method-get">GET</span> <code>/api/test</code> - 测试接口<br>
-                    <span class="method method-get">GET</span> <code>/api/status</code> - 服务器状态
-                </div>
-            </div>
-            
-            <div style="margin-top: 30px; padding: 15px; background: rgba(255,255,255,0.1); border-radius: 10px;">
-                <h3>📚 快速测试</h3>
-                <p>使用以下命令测试API：</p>
-                <code>curl -X GET http://localhost:5000/api/test</code><br>
-                <code>curl -X POST http://localhost:5000/api/auth/register -H "Content-Type: application/json" -d '{"email":"test@qq.com","password":"12345678a"}'</code>
-            </div>
-            
-            <p style="margin-top: 30px; opacity: 0.8;">
-                🚀 服务已启动，等待客户端连接...
-            </p>
-        </div>
-    </body>
-    </html>
-    """
+    return HOME_PAGE.response(request)
 
 # 4. 🔐 用户认证API
 @app.route('/api/auth/register', methods=['POST'])
@@ -188,6 +114,7 @@ def activate_key():
     return VIPAPI.activate_card()
 
 @app.route('/api/vip/check', methods=['POST'])
+@http_cache.conditional(email_tag)  # 客户端轮询时，没变化直接回304
 def check_vip():
     """检查会员状态"""
     print("\n" + "="*40)
@@ -203,33 +130,171 @@ def record_usage():
     print("="*40)
     return VIPAPI.record_usage()
 
+@app.route('/api/vip/record/batch', methods=['POST'])
+def record_usage_batch():
+    """批量记录使用次数"""
+    print("\n" + "="*40)
+    print("📊 收到批量记录使用次数请求")
+    print("="*40)
+    return VIPAPI.record_usage_batch()
+
+@app.route('/api/vip/reserve', methods=['POST'])
+def reserve_usage():
+    """预留使用次数"""
+    print("\n" + "="*40)
+    print("📌 收到预留次数请求")
+    print("="*40)
+    return VIPAPI.reserve_usage()
+
+@app.route('/api/vip/reserve/commit', methods=['POST'])
+def commit_reservation():
+    """结算预留"""
+    print("\n" + "="*40)
+    print("✅ 收到结算预留请求")
+    print("="*40)
+    return VIPAPI.commit_reservation()
+
+@app.route('/api/vip/reserve/release', methods=['POST'])
+def release_reservation():
+    """释放预留"""
+    print("\n" + "="*40)
+    print("↩️ 收到释放预留请求")
+    print("="*40)
+    return VIPAPI.release_reservation()
+
+@app.route('/api/vip/history', methods=['POST'])
+def usage_history():
+    """使用记录（游标分页）"""
+    print("\n" + "="*40)
+    print("📜 收到查询使用记录请求")
+    print("="*40)
+    return VIPAPI.usage_history()
+
+# 🛠️ 管理员API（请求头带 X-Admin-Token）
+@app.route('/api/admin/users/import', methods=['POST'])
+@require_admin
+def import_users():
+    """批量导入用户（CSV/NDJSON）"""
+    print("\n" + "="*40)
+    print("📥 收到批量导入用户请求")
+    print("="*40)
+    return AdminAPI.import_users()
+
+@app.route('/api/admin/card-keys', methods=['GET'])
+@require_admin
+def list_card_keys():
+    """卡密列表（按状态筛选，游标分页）"""
+    return AdminAPI.list_card_keys()
+
+@app.route('/api/admin/card-keys/export', methods=['GET'])
+@require_admin
+def export_card_keys():
+    """导出卡密（NDJSON流）"""
+    print("📤 收到导出卡密请求")
+    return AdminAPI.export_card_keys()
+
+@app.route('/api/admin/card-keys/jobs', methods=['POST'])
+@require_admin
+def create_card_key_job():
+    """卡密批量冻结/解冻/作废/过期"""
+    print("\n" + "="*40)
+    print("🗂️ 收到卡密批量操作请求")
+    print("="*40)
+    return AdminAPI.create_card_key_job()
+
+@app.route('/api/admin/card-keys/jobs/<int:job_id>', methods=['GET'])
+@require_admin
+def card_key_job(job_id):
+    """卡密批量操作进度"""
+    return AdminAPI.card_key_job(job_id)
+
+@app.route('/api/admin/card-keys/jobs/<int:job_id>/cancel', methods=['POST'])
+@require_admin
+def cancel_card_key_job(job_id):
+    """取消卡密批量操作"""
+    return AdminAPI.cancel_card_key_job(job_id)
+
+@app.route('/api/admin/members', methods=['GET'])
+@require_admin
+def list_members():
+    """会员列表（按到期时间，游标分页）"""
+    return AdminAPI.list_members()
+
+@app.route('/api/admin/members/export', methods=['GET'])
+@require_admin
+def export_members():
+    """导出会员（NDJSON流）"""
+    print("📤 收到导出会员请求")
+    return AdminAPI.export_members()
+
+@app.route('/api/admin/profiler', methods=['GET'])
+@require_admin
+def profiler_status():
+    """CPU采样状态"""
+    return AdminAPI.profiler_status()
+
+@app.route('/api/admin/profiler', methods=['POST'])
+@require_admin
+def start_profiler():
+    """打开CPU采样（按比例、限时）"""
+    print("🔥 收到打开CPU采样请求")
+    return AdminAPI.start_profiler()
+
+@app.route('/api/admin/profiler/stop', methods=['POST'])
+@require_admin
+def stop_profiler():
+    """提前停止CPU采样"""
+    return AdminAPI.stop_profiler()
+
+@app.route('/api/admin/profiler/flamegraph', methods=['GET'])
+@require_admin
+def profiler_flamegraph():
+    """CPU采样结果（折叠格式，画火焰图用）"""
+    return AdminAPI.flamegraph()
+
 # 6. 🔧 系统API
+# /api/test 的固定部分启动时编码一次，每次请求只编码时间戳
+TEST_PAYLOAD = PayloadTemplate({
+    'status': 'success',
+    'message': '服务器运行正常',
+    'version': '2.0',
+    'endpoints': [
+        '/api/auth/register',
+        '/api/auth/login',
+        '/api/vip/generate',
+        '/api/vip/activate',
+        '/api/vip/check',
+        '/api/vip/record',
+        '/api/vip/record/batch',
+        '/api/vip/reserve',
+        '/api/vip/reserve/commit',
+        '/api/vip/reserve/release',
+        '/api/vip/history'
+    ]
+})
+
 @app.route('/api/test', methods=['GET'])
 def test_api():
     """测试接口 - 检查服务器是否正常"""
-    return jsonify({
-        'status': 'success',
-        'message': '服务器运行正常',
-        'version': '2.0',
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'endpoints': [
-            '/api/auth/register',
-            '/api/auth/login',
-            '/api/vip/generate',
-            '/api/vip/activate',
-            '/api/vip/check',
-            '/api/vip/record'
-        ]
-    })
+    return TEST_PAYLOAD.response(timestamp=now_text())
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """存活检查：进程能处理请求就返回200，不访问数据库"""
+    return json_response({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """就绪检查：预热完成、数据库可用、不在退出中才返回200（结果缓存几秒）"""
+    ready, details = lifecycle.readiness()
+    return json_response(dict(details, ready=ready), status=200 if ready else 503)
 
 @app.route('/api/status', methods=['GET'])
 def status_api():
     """服务器状态 - 显示详细系统信息"""
-    db = Database(DATABASE_CONFIG)
-    
     try:
-        conn = db.get_connection()
-        with conn.cursor() as cursor:
+        # 只读统计，走从库
+        with service_db.read_connection() as conn, conn.cursor() as cursor:
             # 获取用户数量
             cursor.execute("SELECT COUNT(*) FROM users")
             user_count = cursor.fetchone()[0]
@@ -245,13 +310,11 @@ def status_api():
             # 获取各状态卡密数量
             cursor.execute("SELECT status, COUNT(*) FROM vip_keys GROUP BY status")
             vip_status = dict(cursor.fetchall())
-            
-        conn.close()
         
         return jsonify({
             'status': 'online',
             'version': '2.0',
-            'server_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'server_time': now_text(),
             'database': {
                 'users': user_count,
                 'members': member_count,
@@ -260,42 +323,57 @@ def status_api():
             },
             'uptime': '刚刚启动',
             'memory_usage': 'N/A',
-            'api_count': 8
+            'background_tasks': task_stats(),
+            'negative_cache': negative_cache.stats(),
+            'http_cache': http_cache.stats(),
+            'cache_backend': cache.stats(),
+            'single_flight': flight_stats(),
+            'tier_catalog': tier_catalog.stats(),
+            'sql_profile': sql_profiler.report() if sql_profiler.enabled else {'enabled': False},
+            'cpu_profile': cpu_profiler.stats(),
+            'admission': admission.stats(),
+            'lifecycle': lifecycle.stats(),
+            'replication': service_db.replica_stats(),
+            'api_count': sum(len(routes) for _, routes in list_routes(app))  # 和首页列出的接口数一致
         })
         
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e),
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            'timestamp': now_text()
         })
 
 # 7. 🔍 数据库检查API（可选）
 @app.route('/api/db/check', methods=['GET'])
 def db_check():
     """检查数据库连接和表结构"""
-    db = Database(DATABASE_CONFIG)
-    
     try:
-        conn = db.get_connection()
-        with conn.cursor() as cursor:
+        # 只读检查，走从库（PostgreSQL 没有 SHOW TABLES / DESCRIBE，改查 information_schema）
+        with service_db.read_connection() as conn, conn.cursor() as cursor:
             # 获取所有表
-            cursor.execute("SHOW TABLES")
+            cursor.execute("""
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = 'public' ORDER BY table_name
+            """)
             tables = [table[0] for table in cursor.fetchall()]
             
             # 获取表结构
             table_info = {}
             for table in tables:
-                cursor.execute(f"DESCRIBE {table}")
+                cursor.execute("""
+                    SELECT column_name, data_type, is_nullable, column_default
+                    FROM information_schema.columns
+                    WHERE table_schema = 'public' AND table_name = %s
+                    ORDER BY ordinal_position
+                """, (table,))
                 columns = []
                 for col in cursor.fetchall():
                     columns.append({
                         'name': col[0],
                         'type': col[1],
                         'null': col[2],
-                        'key': col[3],
-                        'default': col[4],
-                        'extra': col[5]
+                        'default': col[3]
                     })
                 table_info[table] = columns
             
@@ -304,15 +382,15 @@ def db_check():
             for table in tables:
                 cursor.execute(f"SELECT COUNT(*) FROM {table}")
                 row_counts[table] = cursor.fetchone()[0]
-                
-        conn.close()
+            
+            database_name = conn.get_dsn_parameters().get('dbname')
         
         return jsonify({
             'status': 'success',
             'tables': tables,
             'table_info': table_info,
             'row_counts': row_counts,
-            'database': DATABASE_CONFIG['database']
+            'database': database_name
         })
         
     except Exception as e:
@@ -346,6 +424,9 @@ def internal_error(error):
         'error': str(error)
     }), 500
 
+# 首页启动时渲染一次（API列表来自路由表，所以放在所有路由注册之后）
+HOME_PAGE = StaticPage(render_home(app))
+
 # 新增用于云函数入口的代码
 import os
 def main_handler(event, context):
@@ -381,10 +462,17 @@ if __name__ == '__main__':
         print("    POST /api/vip/activate - 激活VIP卡密")
         print("    POST /api/vip/check    - 检查会员状态")
         print("    POST /api/vip/record   - 记录使用次数")
+        print("    POST /api/vip/record/batch - 批量记录使用次数")
+        print("    POST /api/vip/reserve  - 预留使用次数")
+        print("    POST /api/vip/reserve/commit  - 结算预留")
+        print("    POST /api/vip/reserve/release - 释放预留")
+        print("    POST /api/vip/history  - 使用记录")
         print("  🔧 系统功能:")
         print("    GET  /api/test         - 测试接口")
         print("    GET  /api/status       - 服务器状态")
         print("    GET  /api/db/check     - 数据库检查")
+        print("    GET  /healthz          - 存活检查")
+        print("    GET  /readyz           - 就绪检查")
         print("\n" + "="*60)
         
         # 启动Flask应用（本地用你原来的配置）
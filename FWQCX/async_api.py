@@ -0,0 +1,538 @@
+"""
+异步版API - auth.py / vip.py 里最常用的几个接口，换成了asyncio写法
+文件名：async_api.py
+
+规则判断全部来自rules.py（设备绑定、续费后的等级/次数/有效期、次数检查、返回字段），
+和同步版共用；这里只负责：读请求 → 查数据库（asyncpg） → 返回JSON。
+登录失败的延迟用asyncio.sleep，等待期间不占用线程。
+
+和同步版一致的部分：
+- 登录签发同一种会话令牌（session_token.py），两边签发的令牌互相认
+- 登录失败限流、激活失败限流用 services.py 里同一个 RateLimiter（共享缓存里同一份计数）；
+  限流计数可能要访问Redis，放到线程里执行，不卡事件循环
+- 激活前同样做卡密预检和布隆过滤器检查（cardkey.py / bloom.py）
+
+没有做的（要用这些功能请用同步版 app.py）：
+- 只有注册、登录、激活、查会员、记录次数五个接口；批量记录、预留次数、使用记录、
+  生成卡密、管理员接口都没有
+- 查会员、记录次数只认邮箱，不接受会话令牌
+- 没有准入控制/截止时间（admission.py）、优雅退出排空（lifecycle.py）、
+  会员状态的ETag缓存（httpcache.py）、只读从库和请求合并（singleflight.py）
+
+会员最后检查时间和同步版一样先攒在 vip_service 的缓冲里，由后台任务批量写回；
+会员等级目录同样定期重新加载（两个后台任务见 async_app.py）。
+
+注意：asyncpg的SQL参数占位符是 $1, $2 ...，不是 %s
+"""
+
+import asyncio
+import os
+from datetime import datetime
+
+import asyncpg
+from aiohttp import web
+
+import cardkey
+import rules
+import session_token
+from async_database import AsyncDatabase
+from bloom import negative_cache
+from services import activate_limiter, login_limiter, vip_service
+from tiers import tier_catalog
+
+# 创建异步数据库实例（连接池在第一次请求时创建）
+db = AsyncDatabase()
+
+# 前面有几层代理（和 app.py 同一个环境变量）
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+
+
+async def read_json(request):
+    """读取请求里的JSON，解析失败返回None"""
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+def failure(message):
+    """失败结果字典（格式和同步版一致）"""
+    return {
+        'success': False,
+        'message': message
+    }
+
+
+def fail(message):
+    """失败响应"""
+    return web.json_response(failure(message))
+
+
+def client_ip(request):
+    """
+    客户端IP（限流按它计数）
+
+    和同步版的 ProxyFix 一样：前面有 TRUSTED_PROXY_HOPS 层代理时，取 X-Forwarded-For
+    从右数第 TRUSTED_PROXY_HOPS 个；直接对外时用连接的对端地址，客户端伪造的头不算数
+    """
+    if TRUSTED_PROXY_HOPS:
+        forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    return request.remote
+
+
+class AsyncAuthAPI:
+    """异步用户认证API - 注册和登录"""
+
+    @staticmethod
+    async def register(request):
+        """用户注册API"""
+        data = await read_json(request)
+        if not data:
+            return fail('请求数据为空')
+
+        email = data.get('email', '').strip()
+        password = data.get('password', '').strip()
+
+        # 验证邮箱和密码格式
+        error = rules.validate_register(email, password)
+        if error:
+            return fail(error)
+
+        pool = await db.get_pool()
+        try:
+            async with pool.acquire() as conn:
+                # 检查邮箱是否已注册
+                existing_user = await conn.fetchval(
+                    "SELECT id FROM users WHERE email = $1", email
+                )
+                if existing_user:
+                    return fail('该邮箱已注册')
+
+                # 加密密码、生成验证密钥
+                password_hash, salt = rules.hash_password(password)
+                verification_key = rules.generate_verification_key()
+                current_time = datetime.now()
+
+                user_id = await conn.fetchval("""
+                    INSERT INTO users (
+                        email, password_hash, salt,
+                        verification_key, created_at
+                    ) VALUES ($1, $2, $3, $4, $5)
+                    RETURNING id
+                """, email, password_hash, salt, verification_key, current_time)
+                # 同步版进程的布隆过滤器看不到这次写入，共享写入代数+1
+                negative_cache.add_email(email)
+
+                # 记录系统日志（失败不影响注册）
+                try:
+                    await conn.execute("""
+                        INSERT INTO system_logs (
+                            level, module, action,
+                            details, created_at
+                        ) VALUES ($1, $2, $3, $4, $5)
+                    """, 'INFO', 'auth', 'register',
+                        f'用户注册成功: {email}', current_time)
+                except Exception as log_error:
+                    print(f"⚠️ 记录日志失败（不影响注册）: {log_error}")
+
+                return web.json_response({
+                    'success': True,
+                    'message': '注册成功！请务必记下验证密钥，后续换设备登录需要它。',
+                    'verification_key': verification_key,
+                    'user_id': user_id,
+                    'email': email,
+                    'created_at': rules.format_time(current_time)
+                })
+
+        except asyncpg.UniqueViolationError:
+            return fail('该邮箱已注册')
+
+        except Exception as e:
+            print(f"❌ 注册失败: {str(e)}")
+            return fail(f'注册失败: {str(e)}')
+
+    @staticmethod
+    async def login(request):
+        """用户登录API（失败限流和同步版共用 services.login_limiter）"""
+        data = await read_json(request)
+        if not data:
+            return fail('请求数据为空')
+
+        email = data.get('email', '').strip()
+        password = data.get('password', '').strip()
+        verification_key = data.get('verification_key', '').strip()
+        hardware_id = data.get('hardware_id', '').strip()
+
+        if not email or not password:
+            return fail('邮箱和密码不能为空')
+
+        # 这个IP对这个账号失败次数太多时先挡住，不查数据库（计数和同步版共用）
+        limiter_key = f'{client_ip(request)}:{email}'
+        if await asyncio.to_thread(login_limiter.blocked, limiter_key):
+            print(f"⛔ 登录失败次数过多: {limiter_key}")
+            return fail(f'登录失败次数过多，请{login_limiter.window // 60}分钟后再试')
+
+        result = await AsyncAuthAPI._login(email, password, verification_key, hardware_id)
+        if result['success']:
+            await asyncio.to_thread(login_limiter.reset, limiter_key)
+        elif result['message'] in rules.CREDENTIAL_ERRORS:
+            await asyncio.to_thread(login_limiter.hit, limiter_key)
+        return web.json_response(result)
+
+    @staticmethod
+    async def _login(email, password, verification_key, hardware_id):
+        """验证密码、绑定设备、签发会话令牌，返回响应字典"""
+        pool = await db.get_pool()
+        try:
+            async with pool.acquire() as conn:
+                user = await conn.fetchrow("""
+                    SELECT id, password_hash, salt
+                    FROM users WHERE email = $1
+                """, email)
+
+            # 用户不存在/密码错误：先把连接还回池子再等待，防止暴力破解的同时不占连接
+            if not user:
+                await asyncio.sleep(rules.USER_NOT_FOUND_DELAY)
+                return failure(rules.WRONG_PASSWORD)
+
+            user_id, stored_hash, stored_salt = user
+
+            input_hash, _ = rules.hash_password(password, stored_salt)
+            if input_hash != stored_hash:
+                await asyncio.sleep(rules.WRONG_PASSWORD_DELAY)
+                return failure(rules.WRONG_PASSWORD)
+
+            current_time = datetime.now()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    # 设备绑定检查（规则和同步版一致）：和同步版一样加锁读取，
+                    # 两台设备同时首次登录时只有一台能绑定成功
+                    stored_key, stored_hardware_id = await conn.fetchrow("""
+                        SELECT verification_key, hardware_id
+                        FROM users WHERE id = $1
+                        FOR UPDATE
+                    """, user_id)
+
+                    device_error, bind_hardware_id = rules.check_device(
+                        stored_hardware_id, stored_key, hardware_id, verification_key
+                    )
+                    if device_error:
+                        return failure(device_error)
+
+                    if bind_hardware_id:
+                        await conn.execute(
+                            "UPDATE users SET hardware_id = $1 WHERE id = $2",
+                            hardware_id, user_id
+                        )
+
+                    await conn.execute(
+                        "UPDATE users SET last_login = $1 WHERE id = $2",
+                        current_time, user_id
+                    )
+
+                    member_info = await conn.fetchrow("""
+                        SELECT vip_level, expire_time,
+                               total_lyrics_limit, lyrics_used,
+                               total_music_limit, music_used,
+                               COALESCE(lyrics_reserved, 0), COALESCE(music_reserved, 0)
+                        FROM members WHERE user_id = $1 AND is_active AND expire_time > $2
+                        ORDER BY expire_time DESC LIMIT 1
+                    """, user_id, current_time)
+
+                # 记录登录日志（失败不影响登录）
+                try:
+                    log_details = f"用户登录成功: {email}"
+                    if hardware_id:
+                        log_details += f", 硬件ID: {hardware_id}"
+
+                    await conn.execute("""
+                        INSERT INTO system_logs (
+                            level, module, action,
+                            details, created_at
+                        ) VALUES ($1, $2, $3, $4, $5)
+                    """, 'INFO', 'auth', 'login', log_details, current_time)
+                except Exception as log_error:
+                    print(f"⚠️ 记录日志失败（不影响登录）: {log_error}")
+
+            result = {
+                'success': True,
+                'message': '登录成功',
+                'user': {
+                    'id': user_id,
+                    'email': email,
+                    'is_member': bool(member_info),
+                    'last_login': rules.format_time(current_time)
+                }
+            }
+
+            if member_info:
+                result['member'] = rules.login_member_info(tuple(member_info), current_time)
+
+            # 签发会话令牌（和同步版同一个 session_token，两边签发的令牌互相认）
+            token, token_expires = session_token.issue(
+                user_id, email, hardware_id, member_info['vip_level'] if member_info else 0
+            )
+            result['token'] = token
+            result['token_expires'] = rules.format_time(datetime.fromtimestamp(token_expires))
+
+            return result
+
+        except Exception as e:
+            print(f"❌ 登录失败: {str(e)}")
+            return failure(f'登录失败: {str(e)}')
+
+
+class AsyncVIPAPI:
+    """异步VIP管理API - 激活、查询、记录使用次数"""
+
+    @staticmethod
+    async def activate_card(request):
+        """激活VIP卡密"""
+        data = await read_json(request) or {}
+
+        card_key = data.get('card_key', '').strip()
+        email = data.get('email', '').strip()
+
+        if not card_key or not email:
+            return fail('请提供卡密和邮箱')
+
+        # 这个IP猜错卡密的次数太多时先挡住（计数和同步版共用）
+        ip = client_ip(request)
+        if await asyncio.to_thread(activate_limiter.blocked, ip):
+            return fail(f'激活失败次数过多，请{activate_limiter.window // 60}分钟后再试')
+
+        result = await AsyncVIPAPI._activate(card_key.upper(), email)
+        if not result['success'] and result['message'] == cardkey.NOT_FOUND:
+            await asyncio.to_thread(activate_limiter.hit, ip)
+        return web.json_response(result)
+
+    @staticmethod
+    async def _activate(card_key, email):
+        """用卡密开通/续费会员，返回响应字典"""
+        # 本地预检：格式不对、签名不对的卡密不去查数据库
+        precheck_error = cardkey.precheck(card_key)
+        if precheck_error:
+            return failure(precheck_error)
+
+        # 布隆过滤器：卡密/用户肯定不存在时不查数据库
+        if negative_cache.card_key_missing(card_key):
+            return failure(cardkey.NOT_FOUND)
+        if negative_cache.email_missing(email):
+            return failure('用户不存在，请先注册')
+
+        pool = await db.get_pool()
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    key_info = await conn.fetchrow("""
+                        SELECT id, vip_level, days, lyrics_limit, music_limit, status, activated_by
+                        FROM vip_keys WHERE card_key = $1
+                        FOR UPDATE
+                    """, card_key)
+
+                    if not key_info:
+                        return failure(cardkey.NOT_FOUND)
+
+                    key_id, vip_level, days, lyrics_limit, music_limit, status, activated_by = key_info
+
+                    status_error = rules.card_status_error(status, activated_by)
+                    if status_error:
+                        return failure(status_error)
+
+                    user_id = await conn.fetchval(
+                        "SELECT id FROM users WHERE email = $1", email
+                    )
+                    if not user_id:
+                        return failure('用户不存在，请先注册')
+
+                    current_time = datetime.now()
+                    existing_member = await conn.fetchrow("""
+                        SELECT id, vip_level, lyrics_used, music_used,
+                               total_lyrics_limit, total_music_limit, expire_time
+                        FROM members WHERE user_id = $1 AND is_active AND expire_time > $2
+                        FOR UPDATE
+                    """, user_id, current_time)
+                    if existing_member is not None:
+                        existing_member = tuple(existing_member)
+
+                    # 新的等级/次数/有效期（rules.py，和同步版共用）
+                    new_vip_level, new_lyrics_limit, new_music_limit, new_expire = rules.activation_update(
+                        existing_member, vip_level, days, lyrics_limit, music_limit, current_time
+                    )
+
+                    if existing_member:
+                        # 老会员：叠加次数和延长有效期
+                        await conn.execute("""
+                            UPDATE members SET
+                                vip_level = $1,
+                                total_lyrics_limit = $2,
+                                total_music_limit = $3,
+                                expire_time = $4
+                            WHERE id = $5
+                        """, new_vip_level, new_lyrics_limit, new_music_limit, new_expire, existing_member[0])
+                    else:
+                        # 新会员：创建新的会员记录
+                        await conn.execute("""
+                            INSERT INTO members
+                            (user_id, email, vip_level, total_lyrics_limit, total_music_limit,
+                             lyrics_used, music_used, expire_time, activate_time)
+                            VALUES ($1, $2, $3, $4, $5, 0, 0, $6, $7)
+                        """, user_id, email, vip_level, lyrics_limit, music_limit, new_expire, current_time)
+
+                    await conn.execute("""
+                        UPDATE vip_keys SET
+                            status = '已激活',
+                            activated_by = $1,
+                            activated_time = $2,
+                            expire_time = $3
+                        WHERE id = $4
+                    """, email, current_time, new_expire, key_id)
+
+            return {
+                'success': True,
+                'message': '🎉 激活成功！',
+                'member': {
+                    'email': email,
+                    'vip_level': vip_level,
+                    'vip_name': tier_catalog.current.name(vip_level),
+                    'expire_time': rules.format_time(new_expire),
+                    'lyrics_added': lyrics_limit,
+                    'music_added': music_limit,
+                    'days_added': days
+                }
+            }
+
+        except Exception as e:
+            print(f"❌ 激活卡密时出错：{e}")
+            return failure(f'激活失败：{str(e)}')
+
+    @staticmethod
+    async def check_membership(request):
+        """检查会员状态"""
+        data = await read_json(request) or {}
+        email = data.get('email', '').strip()
+
+        if not email:
+            return fail('请提供邮箱地址')
+
+        pool = await db.get_pool()
+        try:
+            async with pool.acquire() as conn:
+                user_id = await conn.fetchval(
+                    "SELECT id FROM users WHERE email = $1", email
+                )
+                if not user_id:
+                    return fail('用户不存在')
+
+                current_time = datetime.now()
+                member = await conn.fetchrow("""
+                    SELECT vip_level, expire_time,
+                           total_lyrics_limit, lyrics_used,
+                           total_music_limit, music_used,
+                           COALESCE(lyrics_reserved, 0), COALESCE(music_reserved, 0)
+                    FROM members
+                    WHERE user_id = $1 AND is_active AND expire_time > $2
+                    ORDER BY expire_time DESC
+                    LIMIT 1
+                """, user_id, current_time)
+
+                if not member:
+                    return web.json_response({
+                        'success': True,
+                        'is_member': False,
+                        'message': '您不是会员或会员已过期'
+                    })
+
+            # 最后检查时间进缓冲，由后台任务批量写回（和同步版一样，查询本身不写库）
+            vip_service.note_check(user_id, current_time)
+
+            vip_level = member['vip_level']
+            return web.json_response({
+                'success': True,
+                'is_member': True,
+                'member': rules.membership_info(
+                    email, tuple(member), tier_catalog.current.name(vip_level), current_time
+                )
+            })
+
+        except Exception as e:
+            print(f"❌ 检查会员状态时出错：{e}")
+            return fail(f'查询失败：{str(e)}')
+
+    @staticmethod
+    async def record_usage(request):
+        """记录使用次数"""
+        data = await read_json(request) or {}
+        email = data.get('email', '').strip()
+        usage_type = data.get('type', 'lyrics')
+
+        if not email:
+            return fail('请提供邮箱地址')
+
+        type_error = rules.usage_type_error(usage_type)
+        if type_error:
+            return fail(type_error)
+
+        pool = await db.get_pool()
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    current_time = datetime.now()
+                    result = await conn.fetchrow("""
+                        SELECT u.id,
+                               m.id AS member_id,
+                               m.lyrics_used, m.total_lyrics_limit,
+                               m.music_used, m.total_music_limit,
+                               COALESCE(m.lyrics_reserved, 0), COALESCE(m.music_reserved, 0)
+                        FROM users u
+                        LEFT JOIN members m ON u.id = m.user_id
+                            AND m.is_active AND m.expire_time > $1
+                        WHERE u.email = $2
+                    """, current_time, email)
+
+                    if not result:
+                        return fail('用户不存在')
+
+                    (user_id, member_id, lyrics_used, total_lyrics_limit,
+                     music_used, total_music_limit, lyrics_reserved, music_reserved) = result
+
+                    if not member_id:
+                        return fail('您不是会员，请先激活会员')
+
+                    # 已被预留的次数也不能再用（和同步版一致）
+                    if usage_type == 'lyrics':
+                        used, limit, reserved = lyrics_used, total_lyrics_limit, lyrics_reserved
+                    else:
+                        used, limit, reserved = music_used, total_music_limit, music_reserved
+
+                    quota_message = rules.quota_error(usage_type, used + reserved, limit)
+                    if quota_message:
+                        return fail(quota_message)
+
+                    # 原子地 +1 并检查次数（和同步版同一条语句，列名来自固定白名单USAGE_TYPES）
+                    updated = await conn.fetchrow(
+                        rules.USAGE_INCREMENT_SQL.format(type=usage_type).replace('%s', '$1'),
+                        member_id
+                    )
+                    if not updated:
+                        return fail(rules.quota_error(usage_type, limit, limit))
+                    used, limit, reserved = updated
+
+                    await conn.execute("""
+                        INSERT INTO usage_logs
+                        (user_id, email, action_type, action_time)
+                        VALUES ($1, $2, $3, $4)
+                    """, user_id, email, usage_type, current_time)
+
+            return web.json_response({
+                'success': True,
+                'message': '使用记录成功',
+                'remaining': limit - used - reserved,
+                'usage_type': usage_type
+            })
+
+        except Exception as e:
+            print(f"❌ 记录使用次数时出错：{e}")
+            return fail(f'记录失败：{str(e)}')
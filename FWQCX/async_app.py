@@ -0,0 +1,110 @@
+"""
+AI歌曲生成器 - 异步版服务器
+描述：和app.py提供相同的API，基于aiohttp + asyncpg
+
+本地启动：
+    python async_app.py
+
+生产环境（gunicorn）：
+    gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+
+启动时先执行和同步版相同的建表/补列（database.py 的 init_database），
+查询里用到的 members.is_active、lyrics_reserved/music_reserved 等列由它创建。
+
+后台任务（和同步版用同一套函数，见 sweeper.py）：
+- 会员等级目录有变化时重新加载
+- 会员状态查询攒下的最后检查时间批量写回，关闭时再写回一次
+"""
+import asyncio
+import os
+from datetime import datetime
+
+from aiohttp import web
+
+from async_api import AsyncAuthAPI, AsyncVIPAPI, db
+from services import db as service_db
+from sweeper import PeriodicTask, flush_last_checks, reload_tier_catalog
+
+# 异步版需要的后台任务（在线程里执行，不占用事件循环）
+flush_task = PeriodicTask('最后检查时间写回', flush_last_checks, interval=30)
+BACKGROUND_TASKS = [
+    PeriodicTask('会员等级目录刷新', reload_tier_catalog, interval=30, run_at_start=True),
+    flush_task,
+]
+
+
+async def test_api(request):
+    """测试接口 - 检查服务器是否正常"""
+    return web.json_response({
+        'status': 'success',
+        'message': '服务器运行正常（异步版）',
+        'version': '2.0',
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'endpoints': [
+            '/api/auth/register',
+            '/api/auth/login',
+            '/api/vip/activate',
+            '/api/vip/check',
+            '/api/vip/record'
+        ]
+    })
+
+
+async def init_database(app):
+    """服务器启动时建表/补列（psycopg2，放到线程里执行）；失败时不接请求，直接退出"""
+    await asyncio.get_running_loop().run_in_executor(None, service_db.init_database)
+
+
+async def start_background_tasks(app):
+    """服务器启动时开始后台任务"""
+    for task in BACKGROUND_TASKS:
+        task.start()
+
+
+async def stop_background_tasks(app):
+    """服务器关闭时停后台任务，把攒着的最后检查时间写回"""
+    for task in BACKGROUND_TASKS:
+        task.stop(timeout=5)
+    # 出错只打印，不影响后面关闭连接池
+    flush_task.run_once()
+
+
+async def close_database(app):
+    """服务器关闭时关闭连接池"""
+    await db.close()
+    print("🔌 异步连接池已关闭")
+
+
+def create_app():
+    """创建aiohttp应用并注册路由"""
+    app = web.Application()
+
+    # 🔐 用户认证API
+    app.router.add_post('/api/auth/register', AsyncAuthAPI.register)
+    app.router.add_post('/api/auth/login', AsyncAuthAPI.login)
+
+    # 👑 VIP管理API
+    app.router.add_post('/api/vip/activate', AsyncVIPAPI.activate_card)
+    app.router.add_post('/api/vip/check', AsyncVIPAPI.check_membership)
+    app.router.add_post('/api/vip/record', AsyncVIPAPI.record_usage)
+
+    # 🔧 系统API
+    app.router.add_get('/api/test', test_api)
+
+    app.on_startup.append(init_database)
+    app.on_startup.append(start_background_tasks)
+    app.on_cleanup.append(stop_background_tasks)
+    app.on_cleanup.append(close_database)
+    return app
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5001))
+    print("="*60)
+    print("🎵 AI歌曲生成器服务器（异步版）启动中...")
+    print(f"🌐 本地访问: http://localhost:{port}/api/test")
+    print("="*60)
+    web.run_app(app, port=port)
@@ -0,0 +1,50 @@
+# async_database.py - 异步版数据库连接池（asyncpg）
+import os
+import asyncio
+import asyncpg
+
+
+class AsyncDatabase:
+    """
+    异步数据库 - 和Database用同一个DATABASE_URL
+
+    同步版每个请求占用一个线程等数据库，
+    异步版等数据库时把线程让出来，并发数只受socket数量限制。
+    """
+
+    def __init__(self, min_size=1, max_size=20):
+        # 从环境变量获取数据库连接字符串
+        database_url = os.getenv('DATABASE_URL')
+
+        if not database_url:
+            # 本地测试用
+            database_url = "postgresql://localhost/ai_song"
+            print("⚠️ 使用本地数据库连接（异步）")
+
+        self.database_url = database_url
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        # 锁要在事件循环里创建（Python 3.9会把锁绑定到创建时的循环）
+        self._pool_lock = None
+
+    async def get_pool(self):
+        """获取连接池（第一次使用时创建）"""
+        if self.pool is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                # 拿到锁以后再检查一次，防止并发请求重复建池
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(
+                        self.database_url,
+                        min_size=self.min_size,
+                        max_size=self.max_size
+                    )
+        return self.pool
+
+    async def close(self):
+        """关闭连接池"""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
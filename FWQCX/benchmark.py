@@ -0,0 +1,634 @@
+"""
+性能测试脚本
+文件名：benchmark.py
+
+用法：
+    # 压测HTTP接口（同步版和异步版各跑一次，对比结果）
+    python benchmark.py http --url http://localhost:5000/api/vip/check --concurrency 1000
+    python benchmark.py http --url http://localhost:5001/api/vip/check --concurrency 1000
+
+    # 直接调用服务层（不经过HTTP和Flask），测量纯业务+数据库耗时
+    python benchmark.py service --email 123456789@qq.com --count 1000
+    python benchmark.py service --email 123456789@qq.com --count 1000 --threads 50
+
+    # 卡密生成速度（纯CPU，不需要数据库）
+    python benchmark.py cardkey --count 1000000
+
+    # 暴力猜卡密：大量随机卡密有多少在查数据库之前被挡掉（当前配置 / --enforce 配置好以后）
+    python benchmark.py keycheck --count 1000000
+    python benchmark.py keycheck --count 1000000 --enforce
+
+    # 各种响应的JSON编码耗时：jsonify同款编码 vs 快速编码/模板
+    python benchmark.py serialize --count 100000
+
+    # 会话令牌：签发和校验的耗时（纯CPU，不需要数据库）
+    python benchmark.py token --count 100000
+
+    # 缓存后端：每种操作的耗时，多个进程同时计数结果是否准确
+    python benchmark.py cache --url sqlite:// --processes 4
+
+    # 批量导入用户：解析+校验+哈希的吞吐量（不同进程数）；加 --load 真正写进数据库
+    python benchmark.py import --count 100000 --workers 4
+    python benchmark.py import --count 1000000 --workers 4 --load
+
+    # 使用记录翻页：前几页和很深的页延迟是否一样（游标分页 vs 同样深度的OFFSET）
+    python benchmark.py history --email 123456789@qq.com --seed 300000 --pages 500
+
+    # SQL分析：每个服务调用执行了几条SQL、哪些语句最耗时、有没有N+1/重复查询
+    python benchmark.py sqlprofile --email 123456789@qq.com --password abc123456 --count 200
+
+    # CPU采样：登录的时间花在哪里，以及采样本身让登录慢了多少
+    python benchmark.py cpuprofile --email 123456789@qq.com --password abc123456 --count 300
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+
+def print_latency_report(title, latencies, errors, elapsed):
+    """打印延迟统计（平均值、P50/P95/P99、吞吐量）"""
+    print("="*60)
+    print(f"📊 {title}")
+    print("="*60)
+    if not latencies:
+        print(f"❌ 没有成功的请求（失败 {errors} 次）")
+        return
+
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def percentile(p):
+        return latencies[min(count - 1, int(count * p))] * 1000
+
+    print(f"  成功请求: {count}，失败: {errors}")
+    print(f"  总耗时: {elapsed:.2f}秒，吞吐量: {count / elapsed:.0f} 次/秒")
+    print(f"  平均延迟: {sum(latencies) / count * 1000:.1f}ms")
+    print(f"  P50: {percentile(0.50):.1f}ms  P95: {percentile(0.95):.1f}ms  P99: {percentile(0.99):.1f}ms")
+
+
+# ======================= HTTP压测 =======================
+
+async def _http_worker(session, url, payload, requests_per_worker, latencies, counters):
+    """一个并发连接：连续发送requests_per_worker次请求"""
+    for _ in range(requests_per_worker):
+        start = time.perf_counter()
+        try:
+            async with session.post(url, json=payload) as response:
+                await response.read()
+                if response.status < 500:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    counters['errors'] += 1
+        except Exception:
+            counters['errors'] += 1
+
+
+async def _run_http(url, payload, concurrency, requests_per_worker):
+    import aiohttp
+
+    # 每个并发用户一条独立连接，limit=0 表示不限制连接数
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=120)
+    latencies = []
+    counters = {'errors': 0}
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            _http_worker(session, url, payload, requests_per_worker, latencies, counters)
+            for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    print_latency_report(f"HTTP压测 {url}（并发{concurrency}）", latencies, counters['errors'], elapsed)
+
+
+def bench_http(args):
+    payload = json.loads(args.payload)
+    asyncio.run(_run_http(args.url, payload, args.concurrency, args.requests))
+
+
+# ======================= 服务层 =======================
+
+def bench_service(args):
+    """直接调用services.py，不需要Flask请求上下文；--threads 大于1时并发调用"""
+    from concurrent.futures import ThreadPoolExecutor
+    from services import vip_service
+    from singleflight import flight_stats
+
+    latencies = []
+    errors = 0
+
+    def call(_):
+        nonlocal errors
+        call_start = time.perf_counter()
+        result = vip_service.check_membership(args.email)
+        if result.success:
+            latencies.append(time.perf_counter() - call_start)
+        else:
+            errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(call, range(args.count)))
+    elapsed = time.perf_counter() - start
+
+    print_latency_report(f"服务层 check_membership x{args.count}（{args.threads}线程）",
+                         latencies, errors, elapsed)
+
+    # 同一个邮箱并发查询时，有多少次被合并掉了
+    for name, stats in flight_stats().items():
+        print(f"  {name}：调用{stats['calls']}次，实际查询{stats['executed']}次，合并{stats['shared']}次")
+
+
+# ======================= 卡密生成 =======================
+
+def bench_cardkey(args):
+    """卡密生成速度：不带签名段 / 带签名段"""
+    import cardkey
+
+    print("="*60)
+    print(f"📊 卡密生成 x{args.count}")
+    print("="*60)
+    secret = cardkey.CARD_KEY_SECRET or b'benchmark-secret'
+    for label, generate in (('不带签名段', cardkey.generate_keys),
+                            ('带签名段', lambda n: cardkey.generate_signed_keys(n, secret))):
+        start = time.perf_counter()
+        keys = generate(args.count)
+        elapsed = time.perf_counter() - start
+        print(f"  {label}: {elapsed:.3f}秒，{len(keys) / elapsed:,.0f} 张/秒，"
+              f"重复 {len(keys) - len(set(keys))} 张，示例 {keys[0]}")
+
+
+def bench_keycheck(args):
+    """
+    模拟暴力猜卡密：大量格式正确的随机卡密，统计有多少在查数据库之前就被拒绝
+
+    默认按当前环境变量的配置（CARD_KEY_SECRET / CARD_KEY_ALLOW_UNSIGNED）跑，
+    看线上配置下到底挡住了多少；--enforce 模拟"配置了密钥且不放行老卡密"的效果
+    本地拒绝的判断和激活接口（services.py activate_card）一样：卡密预检 + 布隆过滤器
+    """
+    import cardkey
+    from bloom import negative_cache
+
+    if args.enforce:
+        if not cardkey.CARD_KEY_SECRET:
+            cardkey.CARD_KEY_SECRET = b'benchmark-secret'
+        cardkey.ALLOW_UNSIGNED = False
+    enforced = bool(cardkey.CARD_KEY_SECRET) and not cardkey.ALLOW_UNSIGNED
+
+    guesses = cardkey.generate_keys(args.count)
+    genuine = cardkey.generate_signed_keys(1000) if cardkey.CARD_KEY_SECRET else cardkey.generate_keys(1000)
+
+    def rejected_locally(key):
+        return bool(cardkey.precheck(key)) or negative_cache.card_key_missing(key)
+
+    start = time.perf_counter()
+    rejected = sum(1 for key in guesses if rejected_locally(key))
+    elapsed = time.perf_counter() - start
+    reached_db = args.count - rejected
+
+    passed = sum(1 for key in genuine if not cardkey.precheck(key))
+
+    print("="*60)
+    print(f"📊 暴力猜卡密 x{args.count}（随机卡密）")
+    print("="*60)
+    print(f"  配置：CARD_KEY_SECRET={'已配置' if cardkey.CARD_KEY_SECRET else '未配置'}，"
+          f"CARD_KEY_ALLOW_UNSIGNED={'1' if cardkey.ALLOW_UNSIGNED else '0'}，"
+          f"布隆过滤器={'开启' if negative_cache.enabled else '关闭'}")
+    print(f"  查库之前拒绝 {rejected}/{args.count}（{rejected / args.count:.2%}），"
+          f"要查数据库 {reached_db} 次")
+    if enforced:
+        print(f"  （理论上能通过签名校验的 ≈ {args.count / 2**20:.1f} 张）")
+    else:
+        print("  ⚠️ 当前配置下签名校验没有生效，加 --enforce 看配置好以后的效果")
+    print(f"  本地判断耗时 {elapsed:.3f}秒，{args.count / elapsed:,.0f} 次/秒，"
+          f"每次 {elapsed / args.count * 1e6:.2f}微秒（对比：一次数据库往返通常要几百微秒到几毫秒）")
+    print(f"  真卡密通过预检 {passed}/1000")
+
+
+# ======================= 响应序列化 =======================
+
+def bench_serialize(args):
+    """每种响应类型的编码耗时（不经过Flask，只比较编码本身）"""
+    from datetime import datetime, timedelta
+    import rules
+    import serialize
+    from tiers import tier_catalog
+
+    now = datetime.now()
+    member_row = (2, now + timedelta(days=20), 200, 5, 50, 2, 0, 1)
+    login_payload = {
+        'success': True, 'message': '登录成功',
+        'user': {'id': 1, 'email': '123456789@qq.com', 'is_member': True,
+                 'last_login': rules.format_time(now)},
+        'member': rules.login_member_info(member_row, now)
+    }
+    check_payload = {
+        'success': True, 'is_member': True,
+        'member': dict(rules.login_member_info(member_row, now),
+                       email='123456789@qq.com', vip_name=tier_catalog.current.name(2))
+    }
+    batch_payload = {
+        'success': True, 'message': '批量记录完成', 'succeeded': 100, 'failed': 0,
+        'results': [{'index': i, 'email': '123456789@qq.com', 'type': 'lyrics', 'count': 1,
+                     'success': True, 'message': '使用记录成功', 'remaining': 100 - i}
+                    for i in range(100)]
+    }
+    test_static = {'status': 'success', 'message': '服务器运行正常', 'version': '2.0',
+                   'endpoints': ['/api/auth/register', '/api/auth/login', '/api/vip/check']}
+    test_template = serialize.PayloadTemplate(test_static)
+
+    # Flask jsonify 默认：ensure_ascii + sort_keys + 标准库json
+    def flask_style(data):
+        return json.dumps(data, ensure_ascii=True, sort_keys=True).encode('utf-8')
+
+    cases = [
+        ('login', lambda: flask_style(login_payload), lambda: serialize.dumps(login_payload)),
+        ('check', lambda: flask_style(check_payload), lambda: serialize.dumps(check_payload)),
+        ('record/batch x100', lambda: flask_style(batch_payload), lambda: serialize.dumps(batch_payload)),
+        ('test',
+         lambda: flask_style(dict(test_static, timestamp=now.strftime('%Y-%m-%d %H:%M:%S'))),
+         lambda: test_template.render(timestamp=serialize.now_text())),
+    ]
+
+    print("="*60)
+    print(f"📊 响应编码 x{args.count}（编码器：{'orjson' if serialize.orjson else '标准库json'}）")
+    print("="*60)
+    for name, old, new in cases:
+        timings = []
+        for func in (old, new):
+            start = time.perf_counter()
+            for _ in range(args.count):
+                func()
+            timings.append((time.perf_counter() - start) / args.count * 1e6)
+        print(f"  {name:<20} jsonify同款 {timings[0]:6.2f}微秒   快速路径 {timings[1]:6.2f}微秒"
+              f"   ({timings[0] / timings[1]:.1f}x)")
+
+
+def bench_token(args):
+    """会话令牌签发/校验耗时（纯CPU，不访问数据库）"""
+    import secrets
+    import session_token
+
+    hardware_id = 'HWID-' + secrets.token_hex(16)
+    token, _ = session_token.issue(12345, '123456789@qq.com', hardware_id, tier=2)
+    forged = token[:-4] + ('AAAA' if not token.endswith('AAAA') else 'BBBB')
+
+    cases = [
+        ('签发', lambda: session_token.issue(12345, '123456789@qq.com', hardware_id, tier=2)),
+        ('校验（通过）', lambda: session_token.verify(token, hardware_id)),
+        ('校验（签名错误）', lambda: session_token.verify(forged, hardware_id)),
+        ('校验（设备不符）', lambda: session_token.verify(token, 'OTHER-DEVICE')),
+    ]
+
+    print("="*60)
+    print(f"📊 会话令牌 x{args.count}（令牌长度{len(token)}字符）")
+    print("="*60)
+    for name, func in cases:
+        start = time.perf_counter()
+        for _ in range(args.count):
+            func()
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<12} {elapsed / args.count * 1e6:6.2f}微秒/次   {args.count / elapsed:10.0f}次/秒")
+
+
+def _cache_incr_worker(url, key, count):
+    """子进程：对同一个key计数count次"""
+    from cache_backend import create_backend
+
+    backend = create_backend(url)
+    for _ in range(count):
+        backend.incr(key, 60)
+
+
+def bench_cache(args):
+    """缓存后端每种操作的耗时 + 多进程计数是否准确"""
+    import multiprocessing
+    import os
+    import tempfile
+    from cache_backend import create_backend
+
+    url = args.url
+    if url == 'sqlite://':
+        url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_cache.db')
+    backend = create_backend(url)
+
+    print("="*60)
+    print(f"📊 缓存后端 {backend.name} x{args.count}")
+    print("="*60)
+    cases = [
+        ('set', lambda i: backend.set(f'bench:{i}', 'x' * 16, 60)),
+        ('get（命中）', lambda i: backend.get(f'bench:{i}')),
+        ('get（未命中）', lambda i: backend.get(f'missing:{i}')),
+        ('incr', lambda i: backend.incr('bench:counter', 60)),
+        ('delete', lambda i: backend.delete(f'bench:{i}')),
+    ]
+    for name, func in cases:
+        start = time.perf_counter()
+        for i in range(args.count):
+            func(i)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<12} {elapsed / args.count * 1e6:8.1f}微秒/次   {args.count / elapsed:10.0f}次/秒")
+
+    if backend.name == 'memory':
+        return
+
+    # 多个进程同时计数，最后的值应该正好是 进程数 × 每个进程的次数
+    key = f'bench:shared:{os.getpid()}'
+    processes = [
+        multiprocessing.Process(target=_cache_incr_worker, args=(url, key, args.count))
+        for _ in range(args.processes)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    expected = args.processes * args.count
+    actual = int(backend.get(key) or 0)
+    print(f"  {args.processes}个进程并发incr：期望{expected}，实际{actual}"
+          f"（{'✅ 一致' if actual == expected else '❌ 不一致'}），耗时{elapsed:.2f}秒")
+
+
+# ======================= 批量导入用户 =======================
+
+def _import_lines(count, base):
+    """生成CSV内容（逐行产出，100万行也不占内存）"""
+    yield 'email,password\n'
+    for i in range(count):
+        yield f'{base + i}@qq.com,bench{i:08d}\n'
+
+
+def bench_import(args):
+    """批量导入：每种进程数下准备记录的速度；--load 时再测完整导入（COPY进数据库）"""
+    import random
+    import provisioning
+
+    base = random.randrange(10**10, 9 * 10**10)
+
+    print("="*60)
+    print(f"📊 批量导入用户 x{args.count}")
+    print("="*60)
+    for workers in sorted({0, args.workers}):
+        records = provisioning.read_records(_import_lines(args.count, base), 'csv')
+        start = time.perf_counter()
+        prepared = sum(1 for _ in provisioning.prepare_records(records, workers))
+        elapsed = time.perf_counter() - start
+        label = f'{workers}个子进程' if workers else '单进程'
+        print(f"  解析+校验+哈希（{label}）: {elapsed:.2f}秒，{prepared / elapsed:,.0f} 条/秒")
+
+    if not args.load:
+        print("  （加 --load 测完整导入，会真的往数据库里写用户）")
+        return
+
+    from services import db
+
+    failures = []
+
+    def on_result(result):
+        if not result['success'] and len(failures) < 5:
+            failures.append(result)
+
+    records = provisioning.read_records(_import_lines(args.count, base), 'csv')
+    report = provisioning.UserImporter(db).run(records, args.workers, args.batch_size, on_result)
+    elapsed = report['elapsed_ms'] / 1000
+    print(f"  完整导入（{args.workers}个子进程，每批{args.batch_size}条）: {elapsed:.2f}秒，"
+          f"{report['total'] / elapsed:,.0f} 条/秒，成功{report['created']}，失败{report['failed']}")
+    for failure in failures:
+        print(f"  ❌ 第{failure['line']}行 {failure['email']}：{failure['message']}")
+    print(f"  清理测试数据：DELETE FROM users WHERE email >= '{base}@qq.com' "
+          f"AND email < '{base + args.count}@qq.com'")
+
+
+# ======================= 使用记录翻页 =======================
+
+def bench_history(args):
+    """一页页翻到底：游标分页每页耗时应该不随深度变化；同样深度的OFFSET查询作对照"""
+    from services import db, find_user, vip_service
+
+    user = find_user(db, args.email, consistent=True)
+    if not user:
+        print(f"❌ 用户不存在：{args.email}")
+        return
+    user_id = user[0]
+
+    if args.seed:
+        # 造数据：每分钟一条，四条里一条是音乐
+        with db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO usage_logs (user_id, email, action_type, action_time)
+                SELECT %s, %s, CASE WHEN g %% 4 = 0 THEN 'music' ELSE 'lyrics' END,
+                       now() - g * interval '1 minute'
+                FROM generate_series(1, %s) AS g
+            """, (user_id, args.email, args.seed))
+            conn.commit()
+            cursor.execute("ANALYZE usage_logs")
+            conn.commit()
+        print(f"🌱 已为 {args.email} 写入 {args.seed} 条使用记录")
+
+    latencies = []
+    cursor = None
+    for _ in range(args.pages):
+        call_start = time.perf_counter()
+        result = vip_service.usage_history(args.email, args.type, args.limit, cursor,
+                                           user_id=user_id, consistent=True)
+        latencies.append(time.perf_counter() - call_start)
+        cursor = result.data.get('next_cursor')
+        if not result.success or not cursor:
+            break
+
+    def average_ms(values):
+        return sum(values) / len(values) * 1000
+
+    print("="*60)
+    print(f"📊 使用记录翻页：每页{args.limit}条，共翻{len(latencies)}页（{args.type or '全部类型'}）")
+    print("="*60)
+    print(f"  游标分页  前10页平均 {average_ms(latencies[:10]):.2f}ms，最后10页平均 {average_ms(latencies[-10:]):.2f}ms")
+
+    # 对照：同样深度用OFFSET
+    type_filter = "AND action_type = %s" if args.type else ""
+    with db.connection() as conn, conn.cursor() as db_cursor:
+        for page in sorted({0, len(latencies) // 2, len(latencies) - 1}):
+            params = [user_id] + ([args.type] if args.type else []) + [args.limit, page * args.limit]
+            query_start = time.perf_counter()
+            db_cursor.execute(f"""
+                SELECT id, action_type, action_time, details FROM usage_logs
+                WHERE user_id = %s {type_filter}
+                ORDER BY action_time DESC, id DESC
+                LIMIT %s OFFSET %s
+            """, params)
+            db_cursor.fetchall()
+            print(f"  OFFSET    第{page + 1}页 {(time.perf_counter() - query_start) * 1000:.2f}ms")
+        conn.rollback()
+
+
+# ======================= SQL分析 =======================
+
+def bench_sqlprofile(args):
+    """打开SQL分析，把常用的服务调用各跑count次，打印汇总报告"""
+    from sqlprofile import sql_profiler
+
+    # 必须在第一次借连接之前打开（连接池建连接时才换游标）
+    sql_profiler.enabled = True
+
+    from services import auth_service, vip_service
+
+    calls = [
+        ('login', lambda: auth_service.login(args.email, args.password, '', args.hardware_id)),
+        ('check_membership', lambda: vip_service.check_membership(args.email)),
+        ('check_membership(consistent)', lambda: vip_service.check_membership(args.email, consistent=True)),
+        ('usage_history', lambda: vip_service.usage_history(args.email)),
+    ]
+    for name, call in calls:
+        for _ in range(args.count):
+            with sql_profiler.scope(name):
+                call()
+
+    report = sql_profiler.report(top=args.top)
+    print("="*60)
+    print(f"📊 SQL分析 x{args.count}")
+    print("="*60)
+    for name, stats in report['endpoints'].items():
+        print(f"  {name:<30} 每次{stats['queries_per_request']}条SQL，{stats['db_ms_per_request']}ms，"
+              f"N+1 {stats['n_plus_one']}次，重复查询 {stats['duplicate']}次")
+    print(f"\n  总耗时最多的{len(report['top_statements'])}条语句：")
+    for entry in report['top_statements']:
+        print(f"  [{entry['endpoint']}] {entry['calls']}次 平均{entry['avg_ms']}ms 最大{entry['max_ms']}ms "
+              f"行数{entry['rows']} 参数({entry['params']})")
+        print(f"      {entry['statement'][:150]}")
+
+
+# ======================= CPU采样 =======================
+
+def bench_cpuprofile(args):
+    """同样的登录先不采样跑一遍、再100%采样跑一遍，比较耗时，打印最耗时的函数"""
+    from collections import Counter
+    from cpuprofile import cpu_profiler
+    from services import auth_service
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(args.count):
+            with cpu_profiler.scope('login'):
+                auth_service.login(args.email, args.password, '', args.hardware_id)
+        return time.perf_counter() - start
+
+    run()  # 预热：连接池、布隆过滤器
+    baseline = run()
+
+    cpu_profiler.interval = args.interval / 1000
+    cpu_profiler.output_dir = args.output
+    cpu_profiler.start(1.0, 600)
+    profiled = run()
+    cpu_profiler.stop()
+    stats = cpu_profiler.stats()
+
+    # 最里层的函数（自身耗时）
+    leaves = Counter()
+    for line in cpu_profiler.collapsed('login').splitlines():
+        stack, count = line.rsplit(' ', 1)
+        leaves[stack.rsplit(';', 1)[-1]] += int(count)
+
+    print("="*60)
+    print(f"🔥 CPU采样 登录x{args.count}，每{args.interval}ms一次")
+    print("="*60)
+    print(f"  不采样：{baseline / args.count * 1000:.2f}ms/次")
+    print(f"  采样：  {profiled / args.count * 1000:.2f}ms/次（慢了{(profiled / baseline - 1) * 100:.1f}%）")
+    print(f"  样本{stats['samples']}个，采样线程耗时{stats['overhead_ms']}ms")
+    print(f"\n  自身耗时最多的{args.top}个函数：")
+    total = sum(leaves.values()) or 1
+    for name, count in leaves.most_common(args.top):
+        print(f"  {count / total * 100:5.1f}%  {name}")
+    print(f"\n  折叠格式的调用栈已写到 {args.output}/login.folded（flamegraph.pl 或 speedscope 打开）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI歌曲生成器服务器性能测试')
+    subparsers = parser.add_subparsers(dest='command')
+
+    http_parser = subparsers.add_parser('http', help='并发压测HTTP接口（对比同步版/异步版）')
+    http_parser.add_argument('--url', default='http://localhost:5000/api/vip/check')
+    http_parser.add_argument('--payload', default='{"email": "123456789@qq.com"}')
+    http_parser.add_argument('--concurrency', type=int, default=1000, help='并发连接数')
+    http_parser.add_argument('--requests', type=int, default=10, help='每个连接发送的请求数')
+    http_parser.set_defaults(func=bench_http)
+
+    service_parser = subparsers.add_parser('service', help='直接调用服务层（不经过HTTP）')
+    service_parser.add_argument('--email', default='123456789@qq.com')
+    service_parser.add_argument('--count', type=int, default=1000)
+    service_parser.add_argument('--threads', type=int, default=1,
+                                help='并发线程数（同一个邮箱并发查询，看single-flight合并了多少次）')
+    service_parser.set_defaults(func=bench_service)
+
+    cardkey_parser = subparsers.add_parser('cardkey', help='卡密生成速度（纯CPU）')
+    cardkey_parser.add_argument('--count', type=int, default=1000000)
+    cardkey_parser.set_defaults(func=bench_cardkey)
+
+    keycheck_parser = subparsers.add_parser('keycheck', help='卡密本地预检速度（纯CPU）')
+    keycheck_parser.add_argument('--count', type=int, default=1000000)
+    keycheck_parser.add_argument('--enforce', action='store_true',
+                                 help='模拟配置了CARD_KEY_SECRET且CARD_KEY_ALLOW_UNSIGNED=0')
+    keycheck_parser.set_defaults(func=bench_keycheck)
+
+    serialize_parser = subparsers.add_parser('serialize', help='响应JSON编码耗时（纯CPU）')
+    serialize_parser.add_argument('--count', type=int, default=100000)
+    serialize_parser.set_defaults(func=bench_serialize)
+
+    token_parser = subparsers.add_parser('token', help='会话令牌签发/校验速度（纯CPU）')
+    token_parser.add_argument('--count', type=int, default=100000)
+    token_parser.set_defaults(func=bench_token)
+
+    cache_parser = subparsers.add_parser('cache', help='缓存后端读写耗时 + 多进程共享是否准确')
+    cache_parser.add_argument('--url', default='sqlite://',
+                              help='memory:// | sqlite://（临时文件）| sqlite:///路径 | redis://host:6379/0')
+    cache_parser.add_argument('--count', type=int, default=10000)
+    cache_parser.add_argument('--processes', type=int, default=4)
+    cache_parser.set_defaults(func=bench_cache)
+
+    import_parser = subparsers.add_parser('import', help='批量导入用户吞吐量（--load 时写数据库）')
+    import_parser.add_argument('--count', type=int, default=100000)
+    import_parser.add_argument('--workers', type=int, default=4, help='校验/哈希的子进程数')
+    import_parser.add_argument('--batch-size', type=int, default=20000, help='每批COPY的条数')
+    import_parser.add_argument('--load', action='store_true', help='真正导入数据库（需要DATABASE_URL）')
+    import_parser.set_defaults(func=bench_import)
+
+    history_parser = subparsers.add_parser('history', help='使用记录翻页延迟（游标分页 vs OFFSET）')
+    history_parser.add_argument('--email', default='123456789@qq.com')
+    history_parser.add_argument('--type', choices=['lyrics', 'music'], help='只看某种类型')
+    history_parser.add_argument('--limit', type=int, default=50, help='每页条数')
+    history_parser.add_argument('--pages', type=int, default=500, help='最多翻多少页')
+    history_parser.add_argument('--seed', type=int, default=0, help='先给这个用户造多少条记录')
+    history_parser.set_defaults(func=bench_history)
+
+    sqlprofile_parser = subparsers.add_parser('sqlprofile', help='每个服务调用的SQL条数/耗时，找N+1')
+    sqlprofile_parser.add_argument('--email', default='123456789@qq.com')
+    sqlprofile_parser.add_argument('--password', default='abc123456')
+    sqlprofile_parser.add_argument('--hardware-id', default='BENCH-PC')
+    sqlprofile_parser.add_argument('--count', type=int, default=200)
+    sqlprofile_parser.add_argument('--top', type=int, default=10, help='列出总耗时最多的几条语句')
+    sqlprofile_parser.set_defaults(func=bench_sqlprofile)
+
+    cpuprofile_parser = subparsers.add_parser('cpuprofile', help='登录的CPU采样（火焰图）和采样开销')
+    cpuprofile_parser.add_argument('--email', default='123456789@qq.com')
+    cpuprofile_parser.add_argument('--password', default='abc123456')
+    cpuprofile_parser.add_argument('--hardware-id', default='BENCH-PC')
+    cpuprofile_parser.add_argument('--count', type=int, default=300)
+    cpuprofile_parser.add_argument('--interval', type=float, default=5, help='采样间隔（毫秒）')
+    cpuprofile_parser.add_argument('--top', type=int, default=15)
+    cpuprofile_parser.add_argument('--output', default='cpu-profiles', help='.folded 文件目录')
+    cpuprofile_parser.set_defaults(func=bench_cpuprofile)
+
+    args = parser.parse_args()
+    if not hasattr(args, 'func'):
+        parser.print_help()
+        return
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
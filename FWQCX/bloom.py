@@ -0,0 +1,257 @@
+"""
+布隆过滤器 - 邮箱和卡密的"肯定不存在"缓存
+文件名：bloom.py
+
+布隆过滤器只会答两种结果：
+- 肯定不存在：直接返回"用户不存在"/"卡密不存在"，不用查数据库
+- 可能存在：照常去数据库查（有很小的概率其实不存在，这就是误判率）
+
+启动时用服务端游标流式扫描 users.email 和 vip_keys.card_key 建立过滤器，
+注册和生成卡密时实时加入；后台任务定期重建。
+
+"肯定不存在"绝不能答错，别的进程（其他worker、异步版服务器、批量导入）写入的数据
+本进程的过滤器里没有，所以用共享缓存（cache_backend）里的写入代数来判断过滤器是否完整：
+1. 每次新增邮箱/卡密（提交之后）把共享代数+1，不管本进程有没有开启过滤器
+2. 重建时先读共享代数再扫描表，过滤器就包含了这个代数之前的所有写入
+3. 本进程自己的写入如果正好接着过滤器的代数（中间没有别人写），过滤器的代数跟着前进
+4. 查询时共享代数和过滤器的代数不一样，说明有别的进程写过，一律当作"可能存在"去查数据库，
+   直到下一次重建（sweeper.py，默认10分钟）
+共享缓存读不到（Redis连不上）时同样当作"可能存在"。
+
+配置（环境变量）：
+    NEGATIVE_CACHE=1          开启（默认关闭）
+    BLOOM_CAPACITY=1000000    预计最多多少条（每个过滤器）
+    BLOOM_FP_RATE=0.01        目标误判率
+
+注意：
+- 多个worker进程部署时必须配置共享的 CACHE_URL（sqlite:// 或 redis://）；
+  用默认的进程内缓存（memory://）时，只有 WEB_CONCURRENCY=1（单进程）才会开启，
+  而且同时跑着异步版服务器或批量导入时也不能开（它们是别的进程）
+- 直接用SQL往 users / vip_keys 加数据不会更新共享代数，这种情况要先关闭过滤器，
+  或者加完以后调用 negative_cache.note_external_write()
+- 注册接口不用过滤器，总是查一次邮箱是否已注册
+"""
+
+import hashlib
+import math
+import os
+import secrets
+import threading
+import time
+
+from cache_backend import cache
+
+# 共享缓存里写入代数的键和保存时间（秒）；过期以后所有进程都当作"可能存在"，直到重建
+GENERATION_KEY = 'bloom:generation'
+GENERATION_TTL = 7 * 24 * 3600
+
+
+class BloomFilter:
+    """布隆过滤器（bytearray位图 + 双重哈希）"""
+
+    def __init__(self, capacity=1000000, fp_rate=0.01):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        # 位数 m = -n·ln(p) / (ln2)²，哈希个数 k = m/n · ln2
+        self.num_bits = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        # 改位图要加锁：两个线程同时改同一个字节会丢位，丢位就会变成"误报不存在"
+        with self._lock:
+            for pos in positions:
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def memory_bytes(self):
+        return len(self.bits)
+
+    def estimated_fp_rate(self):
+        """按当前条数估算的误判率 (1 - e^(-kn/m))^k"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'capacity': self.capacity,
+            'memory_kb': round(self.memory_bytes() / 1024, 1),
+            'num_hashes': self.num_hashes,
+            'target_fp_rate': self.fp_rate,
+            'estimated_fp_rate': round(self.estimated_fp_rate(), 6)
+        }
+
+
+class NegativeCache:
+    """邮箱、卡密两个布隆过滤器，外加重建和统计"""
+
+    # 流式扫描时每次从数据库取多少行
+    SCAN_BATCH = 10000
+
+    def __init__(self, enabled=True, capacity=1000000, fp_rate=0.01, shared=cache):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.shared = shared
+        self.emails = None      # None 表示还没建好，一律当作"可能存在"
+        self.card_keys = None
+        self.generation = None  # 过滤器包含到哪一个共享写入代数
+        self.skipped_lookups = 0
+        self.stale_lookups = 0  # 有别的进程写过、只能去查数据库的次数
+        self.last_build_ms = 0
+        self._lock = threading.Lock()
+        self._pending = None    # 重建期间新加入的数据，重建完补进新过滤器
+
+    # ---------- 查询 ----------
+
+    def email_missing(self, email):
+        """邮箱肯定不存在时返回True"""
+        return self._missing(self.emails, email)
+
+    def card_key_missing(self, card_key):
+        """卡密肯定不存在时返回True"""
+        return self._missing(self.card_keys, card_key)
+
+    def _missing(self, bloom, item):
+        if not self.enabled or bloom is None:
+            return False
+        if item in bloom:
+            return False
+        # 过滤器说不存在，还要确认这之后没有别的进程写过
+        if self._shared_generation() != self.generation:
+            self.stale_lookups += 1
+            return False
+        self.skipped_lookups += 1
+        return True
+
+    def _shared_generation(self):
+        value = self.shared.get(GENERATION_KEY)
+        return int(value) if value is not None else None
+
+    # ---------- 写入 ----------
+
+    def add_email(self, email):
+        self._add('emails', [email])
+
+    def add_emails(self, emails):
+        self._add('emails', list(emails))
+
+    def add_card_keys(self, card_keys):
+        self._add('card_keys', list(card_keys))
+
+    def _add(self, name, items):
+        """写入已经提交以后调用：先加进本进程的过滤器，再把共享代数+1"""
+        if not items:
+            return
+        with self._lock:
+            bloom = getattr(self, name)
+            for item in items:
+                if bloom is not None:
+                    bloom.add(item)
+                if self._pending is not None:
+                    self._pending.append((name, item))
+        self._bump()
+
+    def note_external_write(self):
+        """绕过本模块直接写了 users / vip_keys 以后调用：所有进程的过滤器都不再答"不存在"，直到重建"""
+        self.shared.incr(GENERATION_KEY, GENERATION_TTL)
+
+    def _bump(self):
+        generation = self.shared.incr(GENERATION_KEY, GENERATION_TTL)
+        with self._lock:
+            # 紧接着过滤器的代数（中间没有别的进程写过）时过滤器仍然完整
+            if self.generation is not None and generation == self.generation + 1:
+                self.generation = generation
+
+    # ---------- 重建 ----------
+
+    def _scan(self, conn, sql):
+        """服务端游标流式读取，内存占用和表大小无关"""
+        bloom = BloomFilter(self.capacity, self.fp_rate)
+        with conn.cursor(name=f'bloom_scan_{id(bloom)}') as cursor:
+            cursor.itersize = self.SCAN_BATCH
+            cursor.execute(sql)
+            for (item,) in cursor:
+                bloom.add(item)
+        return bloom
+
+    def rebuild(self, database):
+        """从数据库重新建立两个过滤器，建好后原子替换；返回总条数"""
+        if not self.enabled:
+            return 0
+
+        start = time.perf_counter()
+        with self._lock:
+            self._pending = []
+
+        # 先读共享代数再扫描：读到的代数之前提交的写入一定在扫描结果里
+        generation = self._shared_generation()
+        if generation is None:
+            # 第一次（或已过期）：随机起点，不会和过期前别的进程记着的代数撞上
+            generation = secrets.randbits(48)
+            self.shared.set(GENERATION_KEY, generation, GENERATION_TTL)
+
+        try:
+            with database.connection() as conn:
+                emails = self._scan(conn, "SELECT email FROM users")
+                card_keys = self._scan(conn, "SELECT card_key FROM vip_keys")
+                conn.commit()
+
+            with self._lock:
+                # 扫描期间新加入的数据补进新过滤器，再替换
+                for name, item in self._pending:
+                    (emails if name == 'emails' else card_keys).add(item)
+                self.emails = emails
+                self.card_keys = card_keys
+                self.generation = generation
+        finally:
+            with self._lock:
+                self._pending = None
+
+        self.last_build_ms = round((time.perf_counter() - start) * 1000, 1)
+        return emails.count + card_keys.count
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'ready': self.emails is not None,
+            'current': self.emails is not None and self._shared_generation() == self.generation,
+            'skipped_lookups': self.skipped_lookups,
+            'stale_lookups': self.stale_lookups,
+            'last_build_ms': self.last_build_ms,
+            'emails': self.emails.stats() if self.emails else None,
+            'card_keys': self.card_keys.stats() if self.card_keys else None
+        }
+
+
+def _enabled():
+    """默认关闭；进程内缓存看不到别的worker的写入，多进程时不开启"""
+    if os.getenv('NEGATIVE_CACHE', '0') != '1':
+        return False
+    if cache.name == 'memory' and os.getenv('WEB_CONCURRENCY', '1') != '1':
+        print("⚠️ 布隆过滤器需要共享缓存（CACHE_URL=sqlite://... 或 redis://...），多worker下已关闭")
+        return False
+    return True
+
+
+negative_cache = NegativeCache(
+    enabled=_enabled(),
+    capacity=int(os.getenv('BLOOM_CAPACITY', '1000000')),
+    fp_rate=float(os.getenv('BLOOM_FP_RATE', '0.01'))
+)
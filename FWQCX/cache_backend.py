@@ -0,0 +1,314 @@
+"""
+缓存/限流后端 - 多个worker进程共享的键值存储
+文件名：cache_backend.py
+
+同一个接口，三种实现，用环境变量 CACHE_URL 选择：
+    memory://                      进程内字典（默认；单worker部署、本地开发）
+    sqlite:///tmp/ai_song_cache.db 同一台机器上的多个worker共用一个SQLite文件（WAL模式），
+                                   不经过网络，也不占数据库连接
+    redis://host:6379/0            多台机器共用一个Redis（需要 pip install redis）
+
+接口（值一律是字符串，ttl单位是秒）：
+    get(key)          取值，不存在或已过期返回None
+    set(key, value, ttl)
+    delete(key)
+    incr(key, ttl)    计数+1并返回新值；第一次计数时开始计算过期时间（固定窗口限流用）
+
+缓存只是加速：Redis连不上、SQLite文件被锁住时 get 返回None、set/delete 什么都不做、incr 返回0，
+请求照常走数据库，限流暂时放行。
+
+用法：
+    from cache_backend import cache, RateLimiter
+
+    cache.set('etag:check:a@qq.com', 'abc', 30)
+    login_limiter = RateLimiter(cache, 'login', limit=10, window=600)
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class MemoryBackend:
+    """进程内字典：最快，但每个worker进程各有一份"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._data = {}     # key → (value, 过期时间)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data.pop(key, None)   # 重新插到最后，淘汰时按写入先后
+            self._data[key] = (str(value), time.monotonic() + ttl)
+            self._evict()
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def incr(self, key, ttl):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                count, expire_at = 1, now + ttl
+            else:
+                count, expire_at = int(entry[0]) + 1, entry[1]
+            self._data[key] = (str(count), expire_at)
+            self._evict()
+        return count
+
+    def _evict(self):
+        """超过上限时先删过期的，还不够就删最早写入的"""
+        if len(self._data) <= self.max_entries:
+            return
+        now = time.monotonic()
+        for key in [k for k, (_, expire_at) in self._data.items() if expire_at <= now]:
+            del self._data[key]
+        while len(self._data) > self.max_entries:
+            del self._data[next(iter(self._data))]
+
+    def stats(self):
+        return {'backend': self.name, 'entries': len(self._data)}
+
+
+class SQLiteBackend:
+    """
+    SQLite文件：同一台机器上的所有worker进程共享
+
+    WAL模式下读不阻塞写；每个线程一个连接（fork之后的子进程重新连接）
+    出错（例如等锁超时 database is locked）时和Redis后端一样降级，不让请求报500
+    """
+
+    name = 'sqlite'
+
+    # 每写这么多次顺便删一次过期数据
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self.errors = 0
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expire_at REAL NOT NULL
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    @property
+    def _conn(self):
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            self._local.conn = self._connect()
+            self._local.conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.pid = pid
+        return self._local.conn
+
+    def _failed(self, error):
+        self.errors += 1
+        if self.errors == 1 or self.errors % 1000 == 0:
+            print(f"⚠️ SQLite缓存不可用（第{self.errors}次），请求照常走数据库：{error}")
+
+    def get(self, key):
+        try:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expire_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._failed(e)
+            return None
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expire_at) VALUES (?, ?, ?)",
+                (key, str(value), time.time() + ttl)
+            )
+            self._after_write()
+        except sqlite3.Error as e:
+            self._failed(e)
+
+    def delete(self, key):
+        try:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            self._failed(e)
+
+    def incr(self, key, ttl):
+        try:
+            conn = self._conn
+            now = time.time()
+            # BEGIN IMMEDIATE：先拿写锁，多个进程同时计数不会丢
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT value, expire_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or row[1] <= now:
+                    count, expire_at = 1, now + ttl
+                else:
+                    count, expire_at = int(row[0]) + 1, row[1]
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expire_at) VALUES (?, ?, ?)",
+                    (key, str(count), expire_at)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            self._after_write()
+        except sqlite3.Error as e:
+            self._failed(e)
+            return 0
+        return count
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._conn.execute("DELETE FROM cache WHERE expire_at <= ?", (time.time(),))
+
+    def stats(self):
+        try:
+            count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error as e:
+            self._failed(e)
+            count = None
+        return {'backend': self.name, 'path': self.path, 'entries': count, 'errors': self.errors}
+
+
+class RedisBackend:
+    """Redis（或兼容Redis协议的服务）：多台机器共享；连不上时自动降级"""
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='ai_song:'):
+        if redis is None:
+            raise RuntimeError('CACHE_URL 使用 redis:// 需要先安装：pip install redis')
+        self.client = redis.Redis.from_url(
+            url, decode_responses=True, socket_timeout=0.5, socket_connect_timeout=0.5
+        )
+        self.prefix = prefix
+        self.errors = 0
+
+    def _failed(self, error):
+        self.errors += 1
+        if self.errors == 1 or self.errors % 1000 == 0:
+            print(f"⚠️ Redis缓存不可用（第{self.errors}次），请求照常走数据库：{error}")
+
+    def get(self, key):
+        try:
+            return self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            self._failed(e)
+            return None
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(self.prefix + key, str(value), px=max(1, int(ttl * 1000)))
+        except redis.RedisError as e:
+            self._failed(e)
+
+    def delete(self, key):
+        try:
+            self.client.delete(self.prefix + key)
+        except redis.RedisError as e:
+            self._failed(e)
+
+    def incr(self, key, ttl):
+        key = self.prefix + key
+        try:
+            # 一次往返：不存在时先建一个带过期时间的0，再+1
+            pipe = self.client.pipeline()
+            pipe.set(key, 0, px=max(1, int(ttl * 1000)), nx=True)
+            pipe.incr(key)
+            return pipe.execute()[1]
+        except redis.RedisError as e:
+            self._failed(e)
+            return 0
+
+    def stats(self):
+        return {'backend': self.name, 'errors': self.errors}
+
+
+def create_backend(url):
+    """按 CACHE_URL 创建后端"""
+    parsed = urlparse(url)
+
+    if parsed.scheme in ('', 'memory'):
+        return MemoryBackend()
+
+    if parsed.scheme == 'sqlite':
+        # sqlite:///绝对路径；不写路径时放在系统临时目录
+        path = parsed.path or os.path.join(tempfile.gettempdir(), 'ai_song_cache.db')
+        return SQLiteBackend(path)
+
+    if parsed.scheme in ('redis', 'rediss'):
+        return RedisBackend(url)
+
+    raise ValueError(f'不支持的CACHE_URL：{url}')
+
+
+class RateLimiter:
+    """
+    固定窗口限流：window秒内记了limit次就拒绝，窗口过了自动清零
+
+    用法：
+        if login_limiter.blocked(email): 拒绝
+        登录失败：login_limiter.hit(email)
+        登录成功：login_limiter.reset(email)
+    """
+
+    def __init__(self, backend, name, limit, window):
+        self.backend = backend
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def _key(self, key):
+        return f'limit:{self.name}:{key}'
+
+    def blocked(self, key):
+        count = self.backend.get(self._key(key))
+        return count is not None and int(count) >= self.limit
+
+    def hit(self, key):
+        return self.backend.incr(self._key(key), self.window)
+
+    def reset(self, key):
+        self.backend.delete(self._key(key))
+
+
+cache = create_backend(os.getenv('CACHE_URL', 'memory://'))
+print(f"✅ 缓存后端：{cache.name}")
@@ -0,0 +1,278 @@
+"""
+卡密批量操作 - 按批次/条件冻结、解冻、作废、过期
+文件名：card_jobs.py
+
+经销商手里的一批卡密泄露时，要把整批冻结。几千张卡密一条条UPDATE太慢；
+一条UPDATE改几万行又会长时间锁住这些行，挡住正在进行的激活。这里的做法：
+
+1. 创建任务（card_key_jobs表）：记下操作、筛选条件、预计张数，马上返回任务ID
+2. 后台任务（sweeper.py）分块执行，每块一个短事务：
+   按id顺序取 CARD_JOB_CHUNK_SIZE 张符合条件的卡密，一条UPDATE改掉，
+   同一个事务里把进度（处理到的id、已处理张数）写回任务表
+3. 进程崩溃/重启后从任务表里的进度接着做，不重复也不漏（可恢复）
+4. 每块之间停 CARD_JOB_PAUSE 秒，让排队等锁的激活请求先过去
+5. 多个worker同时跑同一个任务也没关系：每块开始时先锁任务行，块与块之间是串行的
+
+只改还没激活的卡密（已激活的已经换成了会员时长，改卡密状态没有意义）。
+激活时会先锁住卡密行（services.py），所以同一张卡密不会一边被冻结一边被激活。
+
+用法：
+    result = card_key_jobs.create('freeze', {'batch_id': '20240101120000-AB12'})
+    card_key_jobs.get(result.data['job']['id'])   # 查看进度
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+import rules
+from admission import Overloaded
+from database import Database
+from services import ServiceResult, db
+
+# 每块处理的卡密张数：一块一个事务，锁住的行数不超过这个数
+CARD_JOB_CHUNK_SIZE = int(os.getenv('CARD_JOB_CHUNK_SIZE', '500'))
+# 块与块之间暂停的秒数
+CARD_JOB_PAUSE = float(os.getenv('CARD_JOB_PAUSE', '0.05'))
+# 后台任务每次最多连续执行的秒数，做不完的下一轮接着做
+CARD_JOB_TIME_BUDGET = float(os.getenv('CARD_JOB_TIME_BUDGET', '20'))
+
+# 操作 → (可以被改的状态, 改成的状态, 中文名)
+ACTIONS = {
+    'freeze': (('未激活',), '已冻结', '冻结'),
+    'unfreeze': (('已冻结',), '未激活', '解冻'),
+    'revoke': (('未激活', '已冻结'), '已作废', '作废'),
+    'expire': (('未激活', '已冻结'), '已过期', '过期'),
+}
+
+# 支持的筛选条件
+FILTER_NAMES = ('batch_id', 'vip_level', 'created_after', 'created_before')
+
+UNFINISHED = ('pending', 'running')
+
+JOB_COLUMNS = (
+    'id', 'action', 'filters', 'status', 'total', 'processed', 'last_id',
+    'error', 'created_at', 'updated_at', 'finished_at'
+)
+
+
+def _where(filters, from_statuses):
+    """筛选条件 → WHERE子句和参数"""
+    conditions = ["status = ANY(%s)"]
+    params = [list(from_statuses)]
+    if filters.get('batch_id'):
+        conditions.append("batch_id = %s")
+        params.append(filters['batch_id'])
+    if filters.get('vip_level') is not None:
+        conditions.append("vip_level = %s")
+        params.append(filters['vip_level'])
+    if filters.get('created_after'):
+        conditions.append("created_at >= %s")
+        params.append(filters['created_after'])
+    if filters.get('created_before'):
+        conditions.append("created_at < %s")
+        params.append(filters['created_before'])
+    return " AND ".join(conditions), params
+
+
+def clean_filters(raw):
+    """检查筛选条件，返回 (筛选条件, 错误描述)"""
+    filters = {}
+    for name in FILTER_NAMES:
+        value = raw.get(name)
+        if value in (None, ''):
+            continue
+        if name == 'vip_level':
+            if not isinstance(value, int) or isinstance(value, bool):
+                return None, 'vip_level必须是整数'
+        elif name.startswith('created_'):
+            try:
+                value = datetime.fromisoformat(str(value)).isoformat()
+            except ValueError:
+                return None, f'{name}格式不对（例如：2024-01-01 或 2024-01-01 12:00:00）'
+        elif not isinstance(value, str) or len(value) > 64:
+            return None, 'batch_id必须是不超过64个字符的字符串'
+        filters[name] = value
+
+    # 不允许不带条件：一个手滑就把所有卡密都冻结了
+    if not filters:
+        return None, f'至少要提供一个筛选条件：{"、".join(FILTER_NAMES)}'
+    return filters, None
+
+
+class CardKeyJobService:
+    """卡密批量操作任务：创建、分块执行、查看进度、取消"""
+
+    def __init__(self, database: Database):
+        self.db = database
+
+    @staticmethod
+    def _job_dict(row) -> Dict[str, Any]:
+        job = dict(zip(JOB_COLUMNS, row))
+        job['filters'] = json.loads(job['filters'])
+        for name in ('created_at', 'updated_at', 'finished_at'):
+            if job[name] is not None:
+                job[name] = rules.format_time(job[name])
+        job['progress'] = round(min(100.0, job['processed'] * 100 / job['total']), 1) if job['total'] else 100.0
+        return job
+
+    def create(self, action: str, raw_filters: Dict[str, Any]) -> ServiceResult:
+        """创建任务（只统计张数，不改卡密），由后台任务执行"""
+        if action not in ACTIONS:
+            return ServiceResult.fail(f'不支持的操作：{action}（可选：{"、".join(ACTIONS)}）')
+
+        filters, error = clean_filters(raw_filters)
+        if error:
+            return ServiceResult.fail(error)
+
+        from_statuses, _, action_name = ACTIONS[action]
+        where, params = _where(filters, from_statuses)
+
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM vip_keys WHERE {where}", params)
+                total = cursor.fetchone()[0]
+
+                cursor.execute(f"""
+                    INSERT INTO card_key_jobs (action, filters, total)
+                    VALUES (%s, %s, %s)
+                    RETURNING {', '.join(JOB_COLUMNS)}
+                """, (action, json.dumps(filters, ensure_ascii=False), total))
+                job = self._job_dict(cursor.fetchone())
+                conn.commit()
+
+            print(f"🗂️ 卡密批量{action_name}任务#{job['id']}已创建：{filters}，预计{total}张")
+            return ServiceResult.ok(f'任务已创建，预计{action_name}{total}张卡密', job=job)
+
+        except Overloaded:
+            # 过载/过了截止时间：交给准入控制返回503（admission.py），不要变成普通的失败结果
+            raise
+
+        except Exception as e:
+            print(f"❌ 创建卡密批量任务失败：{e}")
+            return ServiceResult.fail(f'创建任务失败：{str(e)}')
+
+    def get(self, job_id: int) -> ServiceResult:
+        """查看任务进度"""
+        with self.db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM card_key_jobs WHERE id = %s", (job_id,))
+            row = cursor.fetchone()
+            conn.rollback()
+
+        if not row:
+            return ServiceResult.fail('任务不存在')
+        return ServiceResult.ok(job=self._job_dict(row))
+
+    def cancel(self, job_id: int) -> ServiceResult:
+        """取消还没做完的任务（已经改掉的卡密保持不变）"""
+        with self.db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE card_key_jobs SET status = 'cancelled', updated_at = %s, finished_at = %s
+                WHERE id = %s AND status = ANY(%s)
+            """, (datetime.now(), datetime.now(), job_id, list(UNFINISHED)))
+            cancelled = cursor.rowcount
+            conn.commit()
+
+        if not cancelled:
+            return ServiceResult.fail('任务不存在或已经结束')
+        return self.get(job_id)
+
+    def run_chunk(self, job_id: int, chunk_size: int = CARD_JOB_CHUNK_SIZE):
+        """
+        执行一块，返回 (这一块改了几张, 任务是否结束)
+
+        卡密的修改和进度的更新在同一个事务里，中途崩溃时两者一起回滚
+        """
+        with self.db.connection() as conn, conn.cursor() as cursor:
+            try:
+                # 锁住任务行：同一个任务的块只能一块一块地做
+                cursor.execute("""
+                    SELECT action, filters, last_id, status FROM card_key_jobs
+                    WHERE id = %s FOR UPDATE
+                """, (job_id,))
+                row = cursor.fetchone()
+                if not row or row[3] not in UNFINISHED:
+                    conn.rollback()
+                    return 0, True
+
+                action, filters, last_id, _ = row
+                from_statuses, to_status, action_name = ACTIONS[action]
+                where, params = _where(json.loads(filters), from_statuses)
+
+                # 1. 按id顺序找这一块的卡密（走索引，不加锁）
+                cursor.execute(f"""
+                    SELECT id FROM vip_keys
+                    WHERE {where} AND id > %s
+                    ORDER BY id LIMIT %s
+                """, params + [last_id, chunk_size])
+                key_ids = [key_id for (key_id,) in cursor.fetchall()]
+
+                # 2. 一条UPDATE改掉这一块；等锁期间被激活了的卡密状态不再符合，自动跳过
+                updated = 0
+                if key_ids:
+                    now = datetime.now()
+                    cursor.execute("""
+                        UPDATE vip_keys SET
+                            status = %s,
+                            notes = concat_ws(E'\\n', notes, %s)
+                        WHERE id = ANY(%s) AND status = ANY(%s)
+                    """, (to_status, f'{rules.format_time(now)} 批量{action_name}（任务#{job_id}）',
+                          key_ids, list(from_statuses)))
+                    updated = cursor.rowcount
+
+                # 3. 记下进度，和上面的UPDATE一起提交
+                finished = len(key_ids) < chunk_size
+                now = datetime.now()
+                cursor.execute("""
+                    UPDATE card_key_jobs SET
+                        status = %s,
+                        processed = processed + %s,
+                        last_id = %s,
+                        error = NULL,
+                        updated_at = %s,
+                        finished_at = %s
+                    WHERE id = %s
+                """, ('done' if finished else 'running', updated,
+                      key_ids[-1] if key_ids else last_id, now,
+                      now if finished else None, job_id))
+                conn.commit()
+                return updated, finished
+
+            except Exception as e:
+                # 这一块整体回滚，进度还是上一块的；记下错误，下一轮从这里重试
+                print(f"❌ 卡密批量任务#{job_id}执行出错（下一轮重试）：{e}")
+                try:
+                    conn.rollback()
+                    cursor.execute("UPDATE card_key_jobs SET error = %s, updated_at = %s WHERE id = %s",
+                                   (str(e)[:500], datetime.now(), job_id))
+                    conn.commit()
+                except Exception as record_error:
+                    # 连接可能已经断了：记不下错误也要把原来的异常抛出去
+                    print(f"⚠️ 记录任务#{job_id}的错误失败：{record_error}")
+                raise
+
+    def run_pending(self, time_budget: float = CARD_JOB_TIME_BUDGET) -> int:
+        """执行所有没做完的任务（后台任务调用），返回这一轮改了几张卡密"""
+        with self.db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM card_key_jobs WHERE status = ANY(%s) ORDER BY id",
+                           (list(UNFINISHED),))
+            job_ids = [job_id for (job_id,) in cursor.fetchall()]
+            conn.rollback()
+
+        total = 0
+        deadline = time.monotonic() + time_budget
+        for job_id in job_ids:
+            finished = False
+            while not finished and time.monotonic() < deadline:
+                updated, finished = self.run_chunk(job_id)
+                total += updated
+                if not finished:
+                    time.sleep(CARD_JOB_PAUSE)
+            if finished:
+                print(f"✅ 卡密批量任务#{job_id}已结束")
+        return total
+
+
+card_key_jobs = CardKeyJobService(db)
@@ -0,0 +1,154 @@
+"""
+卡密生成引擎
+文件名：cardkey.py
+
+卡密格式：VIP-XXXX-XXXX-XXXX-XXXX（16个字符，分4段）
+
+生成方法：
+1. 一次性从系统加密随机数（secrets / os.urandom）取 10*N 个字节
+2. 用 base64.b32encode 整块编码（C实现），每10个字节正好是16个字符
+3. 用 bytes.translate 把标准base32字母表换成我们的字母表
+4. 按16个字符切开，加上 VIP- 和分隔符
+
+整个过程没有"逐个字符"的Python循环，单核每秒可以生成上百万个卡密
+（python benchmark.py cardkey 实测）。
+
+字母表：Crockford base32，共32个字符，去掉了容易看错的 I L O U
+    0123456789ABCDEFGHJKMNPQRSTVWXYZ
+老卡密（36个字符的字母表）格式相同，仍然可以正常激活。
+
+======================= 卡密空间和碰撞概率 =======================
+16个随机字符 = 32^16 = 2^80 ≈ 1.2 × 10^24 种
+
+生日问题：一共生成 n 张卡密，出现至少一次重复的概率约为 n² / (2 × 空间大小)
+    n = 100万（10^6）   ≈ 4 × 10^-13
+    n = 10亿（10^9）    ≈ 4 × 10^-7
+新生成一张卡密时，和库里已有的 N 张撞上的概率约为 N / 空间大小。
+（KEY_SPACE / SIGNED_KEY_SPACE / collision_probability()，数值在 tests/test_cardkey.py 里核对）
+
+所以生成时不再逐个SELECT查重，而是批量 INSERT ... ON CONFLICT DO NOTHING，
+万一真的撞上（数据库UNIQUE约束兜底），只重新生成撞上的那几张。
+
+======================= 签名卡密（防暴力猜卡密） =======================
+配置了环境变量 CARD_KEY_SECRET 后，新卡密的最后一段是签名段：
+    VIP-XXXX-XXXX-XXXX-SSSS
+    前12个字符随机，SSSS = HMAC-SHA256(密钥, 前12个字符) 的前20位
+没有密钥的人伪造一张能通过校验的卡密，每次猜中的概率只有 2^-20（约百万分之一），
+所以 precheck() 在连数据库之前就能把乱猜、输错的卡密挡掉。
+签名卡密空间：32^12 = 2^60 ≈ 1.2 × 10^18，生成100万张时出现重复的概率 ≈ 4 × 10^-7。
+
+只有同时满足下面两个条件，乱猜的卡密才会在本地被挡掉：
+    CARD_KEY_SECRET=<密钥>          生成签名卡密
+    CARD_KEY_ALLOW_UNSIGNED=0       没有正确签名的卡密一律不查库
+CARD_KEY_ALLOW_UNSIGNED 默认是1（兼容没有签名段的老卡密），这时 precheck() 只检查格式，
+每次乱猜照样要查一次数据库——默认配置下这一层防护不起作用，模块加载时会打印提醒。
+render.yaml 里已经设置为0；库里还有没用完的老卡密时，先改成1，老卡密用完后再改回0。
+
+不再提供单独的校验位：签名段同样能在本地发现输错的字符（任意改动都只有 2^-20 的概率还能通过），
+还能挡住伪造；而校验位和普通卡密格式一样，precheck() 分不出哪些卡密带校验位，没法验证。
+"""
+
+import base64
+import hashlib
+import hmac
+import math
+import os
+import re
+import secrets
+
+# Crockford base32 字母表
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+# 标准base32字母表 → 我们的字母表
+_B32_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567'
+_TO_ALPHABET = bytes.maketrans(_B32_ALPHABET, ALPHABET.encode('ascii'))
+
+PREFIX = 'VIP-'
+KEY_CHARS = 16      # 卡密正文字符数（不含前缀和分隔符）
+KEY_BYTES = 10      # 10个字节 = 80位 = 16个base32字符
+CHUNK_SIZE = 65536  # 一次最多处理多少张，控制内存
+TAG_CHARS = 4       # 签名段字符数（20位）
+
+# 卡密空间：不带签名 32^16 = 2^80，带签名 32^12 = 2^60（签名段由前12个字符决定）
+KEY_SPACE = len(ALPHABET) ** KEY_CHARS
+SIGNED_KEY_SPACE = len(ALPHABET) ** (KEY_CHARS - TAG_CHARS)
+
+# 签名密钥；没配置时不生成签名卡密，precheck只检查格式
+CARD_KEY_SECRET = os.getenv('CARD_KEY_SECRET', '').encode('utf-8')
+# 是否放行没有正确签名的卡密（兼容老卡密）
+ALLOW_UNSIGNED = os.getenv('CARD_KEY_ALLOW_UNSIGNED', '1') == '1'
+
+if not CARD_KEY_SECRET:
+    print("⚠️ 没有配置CARD_KEY_SECRET：卡密预检只检查格式，乱猜的卡密每次都会查数据库")
+elif ALLOW_UNSIGNED:
+    print("⚠️ CARD_KEY_ALLOW_UNSIGNED=1：没有签名的卡密仍然会查数据库，暴力猜卡密没有在本地挡住"
+          "（老卡密用完后设置为0）")
+
+# 卡密查不到时的提示（签名不对时也用这一句，不告诉对方是哪一步没通过）
+NOT_FOUND = '卡密不存在，请检查输入'
+
+# 格式：VIP-XXXX-XXXX-XXXX-XXXX（老卡密用的是大写字母+数字，所以这里放宽到36个字符）
+KEY_PATTERN = re.compile(r'VIP-[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}')
+
+
+def random_bodies(quantity):
+    """生成 quantity 个16字符的随机卡密正文"""
+    bodies = []
+    for start in range(0, quantity, CHUNK_SIZE):
+        n = min(CHUNK_SIZE, quantity - start)
+        raw = secrets.token_bytes(KEY_BYTES * n)
+        encoded = base64.b32encode(raw).translate(_TO_ALPHABET).decode('ascii')
+        bodies.extend([encoded[i:i + KEY_CHARS] for i in range(0, KEY_CHARS * n, KEY_CHARS)])
+    return bodies
+
+
+def collision_probability(quantity, space=KEY_SPACE):
+    """生日问题：从 space 种卡密里随机生成 quantity 张，至少有两张相同的概率 ≈ 1 - e^(-n(n-1)/2N)"""
+    return -math.expm1(-quantity * (quantity - 1) / (2 * space))
+
+
+def format_key(body):
+    """正文加上前缀和分隔符：VIP-XXXX-XXXX-XXXX-XXXX"""
+    return f'{PREFIX}{body[0:4]}-{body[4:8]}-{body[8:12]}-{body[12:16]}'
+
+
+def generate_keys(quantity):
+    """批量生成卡密（没有签名段）"""
+    return [format_key(body) for body in random_bodies(quantity)]
+
+
+def signature(body12, secret=None):
+    """12个字符的正文 → 4个字符的签名段"""
+    secret = secret or CARD_KEY_SECRET
+    digest = hmac.new(secret, body12.encode('ascii'), hashlib.sha256).digest()
+    # 前5个字节编码成8个base32字符，取前4个（= 前20位）
+    return base64.b32encode(digest[:5]).translate(_TO_ALPHABET)[:TAG_CHARS].decode('ascii')
+
+
+def generate_signed_keys(quantity, secret=None):
+    """批量生成带签名段的卡密"""
+    return [
+        format_key(body[:12] + signature(body[:12], secret))
+        for body in random_bodies(quantity)
+    ]
+
+
+def is_signed(card_key, secret=None):
+    """卡密的签名段是否正确（调用前需要先通过格式检查）"""
+    body = card_key[4:8] + card_key[9:13] + card_key[14:18]
+    return hmac.compare_digest(card_key[19:23], signature(body, secret))
+
+
+def precheck(card_key):
+    """
+    激活前的本地预检，不访问数据库
+
+    返回错误描述；返回None表示可以去数据库查
+    """
+    if not KEY_PATTERN.fullmatch(card_key):
+        return '卡密格式错误，正确格式：VIP-XXXX-XXXX-XXXX-XXXX'
+
+    if CARD_KEY_SECRET and not ALLOW_UNSIGNED and not is_signed(card_key):
+        return NOT_FOUND
+
+    return None
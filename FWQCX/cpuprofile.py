@@ -0,0 +1,236 @@
+"""
+CPU采样分析 - 请求的时间花在哪里（哈希、JSON编码、Flask路由、打印日志……）
+文件名：cpuprofile.py
+
+不是每个函数调用都记（cProfile那样会让请求慢好几倍），而是定时"拍照"：
+1. 打开时指定采样比例和时长，例如 10% 的请求、60 秒
+2. 被选中的请求开始时登记 线程ID → 接口名，结束时注销
+3. 一个后台线程每 CPU_PROFILE_INTERVAL 毫秒看一眼这些线程正在执行的调用栈
+   （sys._current_frames），同样的调用栈累加次数
+4. 时间到了自动停止，每个接口写一个 <接口名>.folded 文件到 CPU_PROFILE_DIR，
+   也可以从管理员接口直接取
+
+输出是 flamegraph.pl / speedscope / inferno 都认的折叠格式（一行一个调用栈）：
+    app.py:login;auth.py:login;services.py:login;rules.py:verify_password 37
+
+采样的是请求线程的墙钟时间：等数据库的时间会落在 cursor.execute 上，
+和 SQL 分析（sqlprofile.py）配合着看。
+没打开时每个请求只多一次时间比较；打开时开销和采样频率、同时被采样的请求数成正比，
+/api/admin/profiler 里的 overhead_ms 是采样线程自己花掉的时间。
+
+打开方式：
+    curl -X POST -H "X-Admin-Token: ..." -H "Content-Type: application/json" \\
+         -d '{"rate": 0.1, "seconds": 60}' http://localhost:5000/api/admin/profiler
+    kill -USR2 <worker进程号>       # 100%的请求采样 CPU_PROFILE_SIGNAL_SECONDS 秒
+
+    with cpu_profiler.scope('login'):   # 不经过Flask（性能测试）
+        auth_service.login(...)
+"""
+
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# 采样间隔（毫秒）
+CPU_PROFILE_INTERVAL = float(os.getenv('CPU_PROFILE_INTERVAL', '5')) / 1000
+# 时间到了以后 .folded 文件写到哪里
+CPU_PROFILE_DIR = os.getenv('CPU_PROFILE_DIR', '/tmp/cpu-profiles')
+# 收到 SIGUSR2 时采样多少秒
+CPU_PROFILE_SIGNAL_SECONDS = float(os.getenv('CPU_PROFILE_SIGNAL_SECONDS', '30'))
+# 一次最多能开多久，防止忘了关
+MAX_PROFILE_SECONDS = 600
+# 每个接口最多保留的不同调用栈数，超过后新调用栈不再单独统计
+MAX_STACKS_PER_ENDPOINT = 5000
+# 调用栈最多记录的层数（从最里层往外数）
+MAX_STACK_DEPTH = 128
+
+_UNSAFE_FILENAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def frame_stack(frame):
+    """调用栈 → 'app.py:login;services.py:login;...'（最外层在前）"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+class CPUProfiler:
+    """按比例挑请求、后台线程采样调用栈、按接口汇总成折叠格式"""
+
+    def __init__(self, interval=CPU_PROFILE_INTERVAL, output_dir=CPU_PROFILE_DIR):
+        self.interval = interval
+        self.output_dir = output_dir
+        # 可重入锁：SIGUSR2 的处理函数在主线程里执行，可能正好打断了持有锁的代码
+        self._lock = threading.RLock()
+        self._active = {}          # 线程ID → 接口名（正在被采样的请求）
+        self._thread = None
+        self.rate = 0.0
+        self.until = 0.0           # time.monotonic()，0 表示没打开
+        self.started_at = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stacks = {}       # 接口名 → Counter(调用栈 → 次数)
+            self.samples = 0
+            self.requests = 0
+            self.overhead = 0.0    # 采样线程花掉的秒数
+
+    @property
+    def running(self):
+        return time.monotonic() < self.until
+
+    # ---------- 开关 ----------
+
+    def start(self, rate=1.0, seconds=60.0):
+        """打开采样：rate 是被采样的请求比例（0~1），seconds 后自动停止；数据从零开始"""
+        rate = min(max(float(rate), 0.0), 1.0)
+        seconds = min(max(float(seconds), 1.0), MAX_PROFILE_SECONDS)
+        with self._lock:
+            if not self.running:
+                self.reset()
+                self.started_at = time.strftime('%Y-%m-%d %H:%M:%S')
+            self.rate = rate
+            self.until = time.monotonic() + seconds
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sample_loop, name='CPU采样', daemon=True)
+                self._thread.start()
+        print(f"🔥 CPU采样已打开：{rate:.0%}的请求，{seconds:.0f}秒，每{self.interval * 1000:.0f}ms一次")
+
+    def stop(self):
+        """提前停止（已经采到的数据保留，并写出 .folded 文件）"""
+        with self._lock:
+            self.until = 0.0
+            thread = self._thread
+        if thread:
+            thread.join(self.interval * 10 + 1)
+
+    # ---------- 请求级 ----------
+
+    def begin(self, name):
+        """请求开始：按比例决定要不要采样这个请求，返回是否采样"""
+        if not self.running or random.random() >= self.rate:
+            return False
+        with self._lock:
+            self._active[threading.get_ident()] = name
+            self.requests += 1
+        return True
+
+    def end(self):
+        self._active.pop(threading.get_ident(), None)
+
+    @contextmanager
+    def scope(self, name):
+        """不经过Flask时手动划定一个"请求"（性能测试、脚本）"""
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def init_app(self, app):
+        """每个请求前后登记/注销；收到 SIGUSR2 时打开采样"""
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        self.install_signal_handler()
+
+    def _before_request(self):
+        if self.until:
+            from flask import request
+            self.begin(request.endpoint or request.path)
+
+    def _teardown_request(self, error=None):
+        self.end()
+
+    def install_signal_handler(self):
+        sigusr2 = getattr(signal, 'SIGUSR2', None)
+        if sigusr2 is None or threading.current_thread() is not threading.main_thread():
+            return
+        try:
+            signal.signal(sigusr2, lambda signum, frame: self.start(1.0, CPU_PROFILE_SIGNAL_SECONDS))
+        except ValueError:
+            pass
+
+    # ---------- 采样线程 ----------
+
+    def _sample_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            start = time.perf_counter()
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, name in list(self._active.items()):
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = frame_stack(frame)
+                    counter = self.stacks.setdefault(name, Counter())
+                    if stack in counter or len(counter) < MAX_STACKS_PER_ENDPOINT:
+                        counter[stack] += 1
+                        self.samples += 1
+                self.overhead += time.perf_counter() - start
+            del frames
+
+        with self._lock:
+            self._active.clear()
+        self.write_files()
+        print(f"🔥 CPU采样已结束：{self.requests}个请求，{self.samples}个样本，"
+              f"采样开销{self.overhead * 1000:.1f}ms")
+
+    # ---------- 输出 ----------
+
+    def collapsed(self, name=None):
+        """折叠格式的文本；不指定接口时每行最前面加上接口名，所有接口画在一张图里"""
+        with self._lock:
+            if name is not None:
+                items = sorted(self.stacks.get(name, {}).items())
+                return ''.join(f'{stack} {count}\n' for stack, count in items)
+            return ''.join(
+                f'{endpoint};{stack} {count}\n'
+                for endpoint, counter in sorted(self.stacks.items())
+                for stack, count in sorted(counter.items())
+            )
+
+    def write_files(self):
+        """每个接口写一个 <接口名>.folded，返回写出的文件列表"""
+        paths = []
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            for name in list(self.stacks):
+                path = os.path.join(self.output_dir, _UNSAFE_FILENAME.sub('_', name) + '.folded')
+                with open(path, 'w', encoding='utf-8') as output:
+                    output.write(self.collapsed(name))
+                paths.append(path)
+        except OSError as e:
+            print(f"⚠️ 写CPU采样文件失败：{e}")
+        return paths
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'rate': self.rate,
+                'remaining_seconds': round(max(self.until - time.monotonic(), 0.0), 1),
+                'interval_ms': self.interval * 1000,
+                'started_at': self.started_at,
+                'requests': self.requests,
+                'samples': self.samples,
+                'overhead_ms': round(self.overhead * 1000, 1),
+                'endpoints': {name: sum(counter.values()) for name, counter in self.stacks.items()},
+                'output_dir': self.output_dir
+            }
+
+
+cpu_profiler = CPUProfiler()
@@ -2,9 +2,181 @@
 import os
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
 import json
+from contextlib import contextmanager
 from datetime import datetime
 import time
+import itertools
+import threading
+
+from cache_backend import cache
+from sqlprofile import sql_profiler  # SQL_PROFILE=1 时连接换成记录每条SQL的游标
+from admission import (
+    admission, DeadlineExceeded, Overloaded, checkout_timeout, remaining, statement_timeout_ms
+)
+import rules  # vip_tiers 表的默认等级
+
+# 从库复制延迟超过这个秒数就暂时不用它
+REPLICA_MAX_LAG = float(os.getenv('DATABASE_REPLICA_MAX_LAG', '5'))
+# 写操作之后多少秒内，同一个用户的读请求仍然走主库（读自己刚写的数据）
+READ_YOUR_WRITES_WINDOW = float(os.getenv('DATABASE_READ_YOUR_WRITES', '5'))
+# 每个连接池最多的连接数
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '20'))
+# 每个连接池常驻的连接数：启动时预先建好；psycopg2 的连接池归还时超过这个数的连接会直接关掉，
+# 太小的话并发一高就会不停地建连接、断连接
+DATABASE_POOL_MIN = min(int(os.getenv('DATABASE_POOL_MIN', '4')), DATABASE_POOL_SIZE)
+
+# 预热时每个连接空跑一遍请求里最热的几条查询（参数查不到任何行，最后回滚）：
+# 这条查询要用到的表、索引的元数据读进这个连接的缓存，之后第一个真正的请求不用再查系统表。
+# psycopg2 每次都把SQL原样发过去、不复用执行计划，所以这里热的是元数据缓存，不是执行计划
+WARM_UP_QUERIES = [
+    (rules.USER_LOOKUP_SQL, ('',)),                          # 登录/查会员：按邮箱查用户
+    (rules.ACTIVE_MEMBER_SQL, (-1, datetime(1970, 1, 1))),   # 登录/查会员：当前有效的会员记录
+    ("SELECT id FROM vip_keys WHERE card_key = %s", ('',)),  # 激活：按卡密查
+    ("SELECT id FROM usage_reservations WHERE reservation_id = %s", ('',)),
+    ("SELECT id FROM usage_logs WHERE id = %s", (-1,)),
+]
+# 只在主库上执行的写查询（从库只读）：记录使用次数
+WARM_UP_WRITES = [
+    (rules.USAGE_INCREMENT_SQL.format(type=usage_type), (-1,)) for usage_type in rules.USAGE_TYPES
+]
+
+
+class PoolTimeout(psycopg2.pool.PoolError, Overloaded):
+    """等了 DATABASE_POOL_TIMEOUT 秒还借不到连接"""
+
+
+class DeadlineConnection(psycopg2.extensions.connection):
+    """记住这个连接当前的 statement_timeout，值没变时不用再发SET"""
+    statement_timeout_ms = None    # 新连接第一次借出时总会设置一次
+
+
+def connect_kwargs():
+    """两个连接池建连接时的额外参数"""
+    return dict(sql_profiler.connect_kwargs(), connection_factory=DeadlineConnection)
+
+
+def apply_deadline(conn):
+    """
+    把当前请求剩下的时间设成这个连接的 statement_timeout（见admission.py）
+
+    借出来的连接都是空闲的（归还时连接池会回滚），临时切到自动提交发一条SET，
+    不会开启事务，之后回滚也不会把设置撤销
+    """
+    timeout_ms = statement_timeout_ms()
+    if getattr(conn, 'statement_timeout_ms', None) == timeout_ms:
+        return
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET statement_timeout = %s", (timeout_ms,))
+    finally:
+        conn.autocommit = False
+    conn.statement_timeout_ms = timeout_ms
+
+
+class Replica:
+    """一个只读从库：自己的连接池 + 健康状态"""
+    
+    def __init__(self, url):
+        self.url = url
+        self.connection_pool = None
+        self.healthy = True     # 启动时先当作可用，健康检查发现问题再摘掉
+        self.lag = None
+        self.last_error = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+    
+    def get_connection(self):
+        """返回 (连接池, 连接)，归还时要还给借出它的那个连接池"""
+        with self._lock:
+            if not self.connection_pool:
+                # 第一次用到（或预热）时才建；从库连不上时这里抛错，摘掉从库，不影响启动
+                self.connection_pool = psycopg2.pool.ThreadedConnectionPool(
+                    DATABASE_POOL_MIN, DATABASE_POOL_SIZE, self.url, connect_timeout=3, **connect_kwargs()
+                )
+            connection_pool = self.connection_pool
+        # 从库连接用完时不等，直接抛 PoolError 改走主库
+        conn = connection_pool.getconn()
+        try:
+            apply_deadline(conn)
+        except Exception:
+            connection_pool.putconn(conn)
+            raise
+        return connection_pool, conn
+    
+    @staticmethod
+    def return_connection(connection_pool, conn, broken=False):
+        connection_pool.putconn(conn, close=broken)
+    
+    def mark_down(self, error):
+        """
+        摘掉这个从库，等健康检查通过后再放回来
+        
+        旧连接池直接丢弃（里面可能都是断掉的连接），正在用的连接归还后随旧池一起释放
+        """
+        if self.healthy:
+            print(f"⚠️ 从库不可用，读请求改走主库：{error}")
+        self.healthy = False
+        self.last_error = str(error)
+        with self._lock:
+            self.connection_pool = None
+    
+    def check(self):
+        """健康检查：能连上、复制延迟不超过 REPLICA_MAX_LAG 才算健康"""
+        self.checked_at = datetime.now()
+        try:
+            connection_pool, conn = self.get_connection()
+        except psycopg2.Error as e:
+            self.mark_down(e)
+            return False
+        
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                # 主库没有新写入时 replay 时间戳不会前进，所以已经追平时直接算0
+                cursor.execute("""
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                    END
+                """)
+                lag = cursor.fetchone()[0]
+            conn.rollback()
+        except psycopg2.Error as e:
+            broken = True
+            self.mark_down(e)
+            return False
+        finally:
+            self.return_connection(connection_pool, conn, broken=broken)
+        
+        self.lag = float(lag or 0)
+        if self.lag > REPLICA_MAX_LAG:
+            self.mark_down(f'复制延迟{self.lag:.1f}秒')
+            return False
+        
+        if not self.healthy:
+            print(f"✅ 从库恢复，重新分担读请求（延迟{self.lag:.1f}秒）")
+        self.healthy = True
+        self.last_error = None
+        return True
+    
+    def close(self):
+        with self._lock:
+            connection_pool, self.connection_pool = self.connection_pool, None
+        if connection_pool:
+            connection_pool.closeall()
+    
+    def stats(self):
+        return {
+            'healthy': self.healthy,
+            'lag_seconds': self.lag,
+            'last_error': self.last_error,
+            'checked_at': self.checked_at.strftime('%Y-%m-%d %H:%M:%S') if self.checked_at else None
+        }
+
 
 class Database:
     def __init__(self):
@@ -18,23 +190,239 @@ class Database:
         
         self.database_url = database_url
         self.connection_pool = None
+        self._pool_lock = threading.Lock()
+        # psycopg2 的连接池满了会立即报错，用信号量排队：最多等 checkout_timeout() 秒
+        self._pool_slots = threading.BoundedSemaphore(DATABASE_POOL_SIZE)
+        
+        # 只读从库（可选）：DATABASE_REPLICA_URLS=url1,url2
+        replica_urls = os.getenv('DATABASE_REPLICA_URLS', '')
+        self.replicas = [Replica(url.strip()) for url in replica_urls.split(',') if url.strip()]
+        self._replica_cursor = itertools.count()
+        # "刚写过"的标记放在共享缓存里（cache_backend），别的worker写的也能看到
+        self.write_marks = cache
+        self._write_listeners = []
+        if self.replicas:
+            print(f"📚 配置了{len(self.replicas)}个只读从库")
         
     def get_connection(self):
-        """获取数据库连接"""
-        if not self.connection_pool:
-            self.connection_pool = psycopg2.pool.SimpleConnectionPool(
-                1, 20, self.database_url
-            )
+        """获取数据库连接（连接池满时排队，超时抛 PoolTimeout；过了请求截止时间抛 DeadlineExceeded）"""
+        timeout = checkout_timeout()
+        start = time.perf_counter()
+        if not self._pool_slots.acquire(timeout=max(timeout, 0)):
+            admission.note('pool_timeouts')
+            raise PoolTimeout(f'数据库繁忙，{timeout:.1f}秒内没有空闲连接')
+        admission.note_pool_wait(time.perf_counter() - start)
         
-        return self.connection_pool.getconn()
+        conn = None
+        try:
+            if not self.connection_pool:
+                with self._pool_lock:
+                    if not self.connection_pool:
+                        # 请求线程、后台任务线程、single-flight 等待的线程会同时借还连接，
+                        # 必须用线程安全的连接池
+                        self.connection_pool = psycopg2.pool.ThreadedConnectionPool(
+                            DATABASE_POOL_MIN, DATABASE_POOL_SIZE, self.database_url, **connect_kwargs()
+                        )
+            conn = self.connection_pool.getconn()
+            apply_deadline(conn)
+            return conn
+        except Exception:
+            if conn is not None:
+                self.connection_pool.putconn(conn)
+            self._pool_slots.release()
+            raise
     
     def return_connection(self, conn):
         """归还数据库连接"""
         if self.connection_pool:
             self.connection_pool.putconn(conn)
+        self._pool_slots.release()
+    
+    @contextmanager
+    def connection(self):
+        """
+        借用连接的上下文管理器，用完自动归还连接池
+        
+        用法：
+            with db.connection() as conn:
+                ...
+        """
+        conn = self.get_connection()
+        try:
+            yield conn
+        except psycopg2.extensions.QueryCanceledError as e:
+            # 超过 statement_timeout 被数据库取消；请求里的超时按截止时间超时处理（503）
+            admission.note('statement_timeouts')
+            if remaining() is not None:
+                raise DeadlineExceeded('请求处理超时') from e
+            raise
+        finally:
+            self.return_connection(conn)
+    
+    # ---------- 读写分离 ----------
+    
+    def on_write(self, func):
+        """note_write 时同时调用 func(key)（services.py 用它作废进行中的合并查询）"""
+        self._write_listeners.append(func)
+    
+    def note_write(self, key):
+        """
+        记录某个用户刚写过数据（激活卡密、记录次数之后调用）
+        
+        READ_YOUR_WRITES_WINDOW 秒内这个用户的读请求走主库，不会读到从库上的旧数据
+        """
+        if not key:
+            return
+        for listener in self._write_listeners:
+            listener(key)
+        if self.replicas:
+            self.write_marks.set(f'ryw:{key}', '1', READ_YOUR_WRITES_WINDOW)
+    
+    def _wrote_recently(self, key):
+        if not key or not self.replicas:
+            return False
+        return self.write_marks.get(f'ryw:{key}') is not None
+    
+    def _pick_replica(self):
+        """轮流使用健康的从库；全部不可用时返回None（走主库）"""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._replica_cursor) % len(healthy)]
+    
+    @contextmanager
+    def read_connection(self, key=None, primary=False):
+        """
+        只读连接：有健康的从库就用从库，否则用主库
+        
+        key：用户标识（邮箱），这个用户刚写过数据时自动走主库
+        primary=True：这次请求强制走主库（客户端要求读到最新数据时）
+        
+        用完会回滚事务再归还：从库上不能留着打开的事务，否则会阻塞复制
+        
+        用法：
+            with db.read_connection(email) as conn:
+                ...
+        """
+        replica = None
+        if not primary and not self._wrote_recently(key):
+            replica = self._pick_replica()
+        
+        if replica is not None:
+            try:
+                connection_pool, conn = replica.get_connection()
+            except psycopg2.pool.PoolError:
+                # 从库连接用完了（不是从库坏了），这次先走主库
+                replica = None
+            except psycopg2.Error as e:
+                replica.mark_down(e)
+                replica = None
+        
+        if replica is None:
+            with self.connection() as conn:
+                try:
+                    yield conn
+                finally:
+                    if not conn.closed:
+                        conn.rollback()
+            return
+        
+        broken = False
+        try:
+            yield conn
+        except psycopg2.extensions.QueryCanceledError as e:
+            # 查询超时被取消，连接本身没问题（QueryCanceledError 是 OperationalError 的子类）
+            admission.note('statement_timeouts')
+            if remaining() is not None:
+                raise DeadlineExceeded('请求处理超时') from e
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # 连接断了：摘掉从库，这次请求照常报错，之后的读请求走其他库
+            broken = True
+            replica.mark_down(e)
+            raise
+        finally:
+            if not broken:
+                conn.rollback()
+            replica.return_connection(connection_pool, conn, broken=broken)
+    
+    def check_replicas(self):
+        """检查所有从库（后台任务定期调用），返回健康的从库个数"""
+        return sum(1 for replica in self.replicas if replica.check())
+    
+    def replica_stats(self):
+        return {'replicas': [replica.stats() for replica in self.replicas]}
+    
+    # ---------- 预热 / 就绪检查 ----------
+    
+    @staticmethod
+    def _warm_connections(conns, writes=False):
+        queries = WARM_UP_QUERIES + WARM_UP_WRITES if writes else WARM_UP_QUERIES
+        for conn in conns:
+            with conn.cursor() as cursor:
+                for query, params in queries:
+                    cursor.execute(query, params)
+            conn.rollback()
+    
+    def warm_up(self):
+        """
+        启动时预热：主库和每个健康的从库各建好 DATABASE_POOL_MIN 个连接，每个连接空跑一遍热点查询
+        
+        同时借出来才能保证是不同的连接；还回去后都留在连接池里。返回预热的连接数
+        """
+        conns = []
+        try:
+            for _ in range(DATABASE_POOL_MIN):
+                conns.append(self.get_connection())
+            self._warm_connections(conns, writes=True)
+        finally:
+            for conn in conns:
+                self.return_connection(conn)
+        warmed = len(conns)
+        
+        for replica in self.replicas:
+            if not replica.healthy:
+                continue
+            borrowed = []
+            try:
+                for _ in range(DATABASE_POOL_MIN):
+                    borrowed.append(replica.get_connection())
+                self._warm_connections(conn for _, conn in borrowed)
+                warmed += len(borrowed)
+            except psycopg2.Error as e:
+                replica.mark_down(e)
+            finally:
+                for connection_pool, conn in borrowed:
+                    replica.return_connection(connection_pool, conn)
+        
+        print(f"🔥 数据库连接池预热完成：{warmed}个连接")
+        return warmed
+    
+    def ping(self):
+        """就绪检查：连接池已经建好，主库能执行一条查询"""
+        if not self.connection_pool:
+            raise RuntimeError('连接池还没有预热')
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            conn.rollback()
+        return True
+    
+    def close(self):
+        """关闭主库和所有从库的连接（退出时调用，数据库那边不会留下断掉的连接）"""
+        with self._pool_lock:
+            connection_pool, self.connection_pool = self.connection_pool, None
+        if connection_pool:
+            connection_pool.closeall()
+        for replica in self.replicas:
+            replica.close()
     
     def init_database(self):
-        """初始化数据库表（第一次运行）"""
+        """
+        初始化数据库表、补上新加的列和索引（启动时执行，见 app.py / async_app.py）
+
+        全部是 IF NOT EXISTS，重复执行没有副作用；失败时回滚并抛出，启动步骤记为失败、稍后重试
+        """
         conn = self.get_connection()
         try:
             with conn.cursor() as cursor:
@@ -55,6 +443,14 @@ class Database:
                 # 创建索引
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
                 
+                # 密码盐值（注册/登录一直在用，老库上补上这一列）
+                cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS salt VARCHAR(64)")
+                # 登录查询的覆盖索引：按邮箱查 id/密码哈希/盐值 可以只读索引，不回表
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_users_login
+                    ON users(email) INCLUDE (id, password_hash, salt)
+                """)
+                
                 # 2. 创建VIP卡密表
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS vip_keys (
@@ -76,6 +472,12 @@ class Database:
                 
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_vip_keys_card_key ON vip_keys(card_key)")
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_vip_keys_status ON vip_keys(status)")
+                # 管理员按状态翻页（listing.py）：WHERE status = ? AND id > ? ORDER BY id
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_vip_keys_status_id ON vip_keys(status, id)")
+                
+                # 批次号：同一次生成的卡密一个批次，可以按批次冻结/作废（card_jobs.py）
+                cursor.execute("ALTER TABLE vip_keys ADD COLUMN IF NOT EXISTS batch_id VARCHAR(64)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_vip_keys_batch_id ON vip_keys(batch_id, id)")
                 
                 # 3. 创建会员表
                 cursor.execute("""
@@ -99,6 +501,14 @@ class Database:
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_user_id ON members(user_id)")
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_email ON members(email)")
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_expire ON members(expire_time)")
+                # 管理员按到期时间翻页（listing.py）：WHERE (expire_time, id) > (?, ?) ORDER BY expire_time, id
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_expire_id ON members(expire_time, id)")
+                
+                # 会员是否有效（过期的由后台清理任务批量标记为FALSE）
+                # 热点查询只走部分索引里的有效会员，不再扫描过期历史
+                cursor.execute("ALTER TABLE members ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_active_user ON members(user_id, expire_time DESC) WHERE is_active")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_active_expire ON members(expire_time) WHERE is_active")
                 
                 # 4. 创建使用记录表
                 cursor.execute("""
@@ -114,6 +524,86 @@ class Database:
                 
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_user_action ON usage_logs(user_id, action_type)")
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_time ON usage_logs(action_time)")
+                # 使用记录翻页（services.py usage_history）：每个用户按时间倒序，
+                # 按类型筛选时用第二个；排序键带上id，同一时刻的多条记录翻页不漏不重
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_user_time ON usage_logs(user_id, action_time DESC, id DESC)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_user_type_time ON usage_logs(user_id, action_type, action_time DESC, id DESC)")
+                
+                # 5. 次数预留（长时间生成任务先预留次数，完成后再结算）
+                cursor.execute("ALTER TABLE members ADD COLUMN IF NOT EXISTS lyrics_reserved INT DEFAULT 0")
+                cursor.execute("ALTER TABLE members ADD COLUMN IF NOT EXISTS music_reserved INT DEFAULT 0")
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS usage_reservations (
+                        id SERIAL PRIMARY KEY,
+                        reservation_id VARCHAR(64) UNIQUE NOT NULL,
+                        user_id INT NOT NULL,
+                        member_id INT NOT NULL,
+                        email VARCHAR(100) NOT NULL,
+                        action_type VARCHAR(20) NOT NULL,
+                        count INT NOT NULL,
+                        status VARCHAR(20) DEFAULT 'reserved',
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        expire_at TIMESTAMP NOT NULL,
+                        settled_at TIMESTAMP
+                    )
+                """)
+                
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_reservations_status_expire ON usage_reservations(status, expire_at)")
+                
+                # 系统日志（注册/登录成功时写一条，写失败不影响接口）
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS system_logs (
+                        id SERIAL PRIMARY KEY,
+                        level VARCHAR(10) NOT NULL,
+                        module VARCHAR(50) NOT NULL,
+                        action VARCHAR(50) NOT NULL,
+                        details TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                # 6. 卡密批量操作任务（按批次冻结/作废，分块执行，进度可恢复，见card_jobs.py）
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS card_key_jobs (
+                        id SERIAL PRIMARY KEY,
+                        action VARCHAR(20) NOT NULL,
+                        filters TEXT NOT NULL,
+                        status VARCHAR(20) DEFAULT 'pending',
+                        total INT DEFAULT 0,
+                        processed INT DEFAULT 0,
+                        last_id INT DEFAULT 0,
+                        error TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        finished_at TIMESTAMP
+                    )
+                """)
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_card_key_jobs_unfinished ON card_key_jobs(id) WHERE status IN ('pending', 'running')")
+                
+                # 7. 会员等级目录（改价格/次数直接改这张表，各进程30秒内自动生效，见tiers.py）
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS vip_tiers (
+                        level INT PRIMARY KEY,
+                        name VARCHAR(50) NOT NULL,
+                        days INT NOT NULL,
+                        lyrics INT NOT NULL,
+                        music INT NOT NULL,
+                        price NUMERIC(10, 2) DEFAULT 0,
+                        description TEXT,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                # 写入默认等级（已经存在的等级不覆盖，以数据库里改过的为准）
+                execute_values(cursor, """
+                    INSERT INTO vip_tiers (level, name, days, lyrics, music, price, description)
+                    VALUES %s
+                    ON CONFLICT (level) DO NOTHING
+                """, [
+                    (level, b['name'], b['days'], b['lyrics'], b['music'], b['price'], b['description'])
+                    for level, b in sorted(rules.VIP_BENEFITS.items())
+                ])
                 
                 conn.commit()
                 print("✅ 数据库表创建成功！")
@@ -121,5 +611,6 @@ class Database:
         except Exception as e:
             print(f"❌ 数据库初始化失败: {e}")
             conn.rollback()
+            raise
         finally:
             self.return_connection(conn)
\ No newline at end of file
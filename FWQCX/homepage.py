@@ -0,0 +1,239 @@
+"""
+首页（服务器状态 + API文档）- 启动时渲染一次，之后直接返回缓存的字节
+文件名：homepage.py
+
+1. API列表从Flask的真实路由表（app.url_map）生成，不再手写：
+   说明文字取视图函数文档字符串的第一行，按路径前缀分组
+2. 页面只在启动时渲染一次，同时准备好 gzip / brotli 压缩版本
+3. 带 ETag / Last-Modified，客户端和监控探针带条件请求头时直接回304
+
+用法（app.py，所有路由注册完之后）：
+    HOME_PAGE = StaticPage(render_home(app))
+    ...
+    return HOME_PAGE.response(request)
+"""
+
+import gzip
+import hashlib
+import html
+import time
+from string import Template
+
+from flask import Response
+from werkzeug.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# 路径前缀 → 分组标题（按顺序匹配，都不匹配的归到"系统功能"）
+ROUTE_GROUPS = [
+    ('/api/auth/', '🔐 用户认证'),
+    ('/api/vip/', '👑 VIP管理'),
+    ('/api/admin/', '🛠️ 管理员'),
+]
+DEFAULT_GROUP = '🔧 系统功能'
+
+# 不在文档里列出的请求方法
+HIDDEN_METHODS = {'HEAD', 'OPTIONS'}
+
+
+PAGE_TEMPLATE = Template("""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>🎵 AI歌曲生成器服务器</title>
+        <style>
+            body {
+                font-family: Arial, sans-serif;
+                margin: 50px;
+                text-align: center;
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white;
+            }
+            .container {
+                background: rgba(255, 255, 255, 0.1);
+                padding: 40px;
+                border-radius: 20px;
+                backdrop-filter: blur(10px);
+                max-width: 800px;
+                margin: 0 auto;
+            }
+            h1 {
+                font-size: 3em;
+                margin-bottom: 20px;
+            }
+            .status {
+                background: rgba(0, 255, 0, 0.2);
+                padding: 10px;
+                border-radius: 10px;
+                margin: 20px 0;
+            }
+            .api-list {
+                text-align: left;
+                background: rgba(255, 255, 255, 0.1);
+                padding: 20px;
+                border-radius: 10px;
+                margin-top: 30px;
+            }
+            .api-item {
+                margin: 10px 0;
+                padding: 10px;
+                background: rgba(255, 255, 255, 0.05);
+                border-radius: 5px;
+            }
+            code {
+                background: rgba(0, 0, 0, 0.3);
+                padding: 2px 5px;
+                border-radius: 3px;
+            }
+            .method {
+                display: inline-block;
+                padding: 2px 8px;
+                border-radius: 4px;
+                font-weight: bold;
+                margin-right: 10px;
+            }
+            .method-get { background: #61affe; }
+            .method-post { background: #49cc90; }
+            .method-put { background: #fca130; }
+            .method-delete { background: #f93e3e; }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <h1>🎵 AI歌曲生成器服务器</h1>
+            <div class="status">
+                <h2>✅ 服务器运行正常</h2>
+                <p>版本: 2.0 | 状态: 在线</p>
+                <p>启动时间: $started_at</p>
+            </div>
+
+            <div class="api-list">
+                <h3>📡 可用API接口（共$api_count个）:</h3>
+$api_groups
+            </div>
+
+            <div style="margin-top: 30px; padding: 15px; background: rgba(255,255,255,0.1); border-radius: 10px;">
+                <h3>📚 快速测试</h3>
+                <p>使用以下命令测试API：</p>
+                <code>curl -X GET http://localhost:5000/api/test</code><br>
+                <code>curl -X POST http://localhost:5000/api/auth/register -H "Content-Type: application/json" -d '{"email":"test@qq.com","password":"12345678a"}'</code>
+            </div>
+
+            <p style="margin-top: 30px; opacity: 0.8;">
+                🚀 服务已启动，等待客户端连接...
+            </p>
+        </div>
+    </body>
+    </html>
+    """)
+
+
+def list_routes(app):
+    """
+    从路由表整理出API列表：[(分组标题, [(方法列表, 路径, 说明), ...]), ...]
+
+    只列出 /api/ 开头的路由，同一分组内按路径排序
+    """
+    groups = {title: [] for _, title in ROUTE_GROUPS}
+    groups[DEFAULT_GROUP] = []
+
+    for rule in app.url_map.iter_rules():
+        if not rule.rule.startswith('/api/'):
+            continue
+        view = app.view_functions.get(rule.endpoint)
+        doc = (view.__doc__ or '').strip().splitlines() if view else []
+        description = doc[0].strip() if doc else rule.endpoint
+        methods = sorted(rule.methods - HIDDEN_METHODS)
+
+        title = next((t for prefix, t in ROUTE_GROUPS if rule.rule.startswith(prefix)), DEFAULT_GROUP)
+        groups[title].append((methods, rule.rule, description))
+
+    return [(title, sorted(routes, key=lambda r: r[1])) for title, routes in groups.items() if routes]
+
+
+def render_home(app, started_at=None):
+    """渲染首页HTML"""
+    blocks = []
+    api_count = 0
+    for title, routes in list_routes(app):
+        lines = []
+        for methods, path, description in routes:
+            badges = ' '.join(
+                f'<span class="method method-{m.lower()}">{m}</span>' for m in methods
+            )
+            lines.append(f'{badges} <code>{html.escape(path)}</code> - {html.escape(description)}')
+        api_count += len(routes)
+        blocks.append(
+            '                <div class="api-item">\n'
+            f'                    <strong>{title}</strong><br>\n'
+            '                    ' + '<br>\n                    '.join(lines) + '\n'
+            '                </div>\n'
+        )
+
+    return PAGE_TEMPLATE.substitute(
+        started_at=started_at or time.strftime('%Y-%m-%d %H:%M:%S'),
+        api_count=api_count,
+        api_groups='\n'.join(blocks)
+    )
+
+
+class StaticPage:
+    """
+    预先渲染好的页面：原文、gzip、brotli 三份字节和各自的ETag
+
+    每次请求只做请求头比较，不再拼字符串、不再压缩
+    """
+
+    def __init__(self, text, mimetype='text/html; charset=utf-8'):
+        body = text.encode('utf-8')
+        self.mimetype = mimetype
+        self.last_modified = time.time()
+        self._last_modified_text = http_date(self.last_modified)
+
+        # 同一个页面的不同压缩版本是不同的"表示"，ETag要区分开
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {None: (body, f'"{digest}"')}
+        self.variants['gzip'] = (gzip.compress(body, 9, mtime=0), f'"{digest}-gz"')
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+
+    def _choose_encoding(self, request):
+        """按 Accept-Encoding 选压缩方式：br 优先，其次 gzip"""
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted[encoding]:
+                return encoding
+        return None
+
+    def _not_modified(self, request, etag):
+        # 有 If-None-Match 时只看ETag；没有才看 If-Modified-Since
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(etag.strip('"'))
+        since = request.if_modified_since
+        return since is not None and since.timestamp() >= int(self.last_modified)
+
+    def response(self, request):
+        encoding = self._choose_encoding(request)
+        body, etag = self.variants[encoding]
+
+        if self._not_modified(request, etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=self.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = self._last_modified_text
+        response.headers['Vary'] = 'Accept-Encoding'
+        # 每次都回来验证一下（验证通过只回304，几乎没有开销）
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def stats(self):
+        return {encoding or 'identity': len(body) for encoding, (body, _) in self.variants.items()}
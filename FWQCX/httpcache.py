@@ -0,0 +1,213 @@
+"""
+HTTP层优化 - 响应压缩 + ETag条件请求
+文件名：httpcache.py
+
+1. 压缩：响应体超过 HTTP_COMPRESS_MIN_SIZE 字节、客户端支持时，
+   按 Accept-Encoding 用 brotli（装了brotli包时）或 gzip 压缩
+2. GET接口：自动加弱ETag，客户端带 If-None-Match 且内容没变时回304（省流量）
+3. 幂等查询接口（会员状态查询）：用 @http_cache.conditional 装饰，
+   记住每个用户最近一次成功（"success": true）返回的ETag，客户端带着这个ETag再来问、
+   且缓存没过期也没被写接口作废时，直接回304，连处理函数都不执行；
+   失败的结果（"用户不存在"、查询出错）不记，下次照常执行处理函数
+
+缓存作废：激活卡密、记录次数等写接口成功后、过期会员清理任务（sweeper.py）
+标记过期后调用 http_cache.invalidate(email)。
+ETag记录存在 cache_backend（CACHE_URL）里：用SQLite/Redis后端时，
+一个worker里的写操作会让所有worker上的缓存一起作废。
+
+没有作废、只靠 HTTP_CACHE_TTL 过期的情况（最多旧这么多秒）：
+- 会员刚好到期、清理任务还没跑到（查询本身按 expire_time 判断，ETag过期后就是最新结果）
+- 会员等级目录改名（tiers.py）、直接用SQL改 members 表
+批量导入（provisioning.py）只新增用户，之前的"用户不存在"是失败结果，本来就没有记ETag。
+
+配置（环境变量）：
+    HTTP_COMPRESS_MIN_SIZE=1024   小于这个大小不压缩（压缩小响应得不偿失）
+    HTTP_CACHE_TTL=30             查询结果的ETag有效秒数，0表示不跳过处理函数
+
+注意：默认的 memory:// 后端只在当前进程里作废。多个worker进程部署又没有配置共享后端时，
+别的进程里的写操作要等ETag过期（HTTP_CACHE_TTL）才会被本进程看到。
+"""
+
+import gzip
+import hashlib
+import os
+from functools import wraps
+
+from flask import make_response, request
+
+from cache_backend import cache
+import session_token
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# 值得压缩的内容类型
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+
+class HTTPCache:
+    """压缩 + ETag，两部分都挂在Flask的after_request上"""
+
+    def __init__(self, backend, min_size=1024, ttl=30,
+                 gzip_level=6, brotli_quality=4):
+        self.backend = backend
+        self.min_size = min_size
+        self.ttl = ttl
+        # 每次请求都要现压，所以用中等压缩级别：压缩率差不多，速度快很多
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        # 所有用了 conditional 的接口名（装饰时登记，每个worker进程都一样）
+        self._views = set()
+
+        self.stats_counter = {
+            'not_modified': 0,      # 回了304的请求（含跳过处理函数的）
+            'handler_skipped': 0,   # 直接回304、没执行处理函数的请求
+            'compressed': 0,
+            'bytes_before': 0,
+            'bytes_after': 0
+        }
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+
+    # ---------- 幂等查询接口：跳过处理函数 ----------
+
+    def conditional(self, tag_func):
+        """
+        装饰幂等查询接口
+
+        tag_func() 从请求里取出缓存的归属（一般是邮箱），写接口按它作废；
+        返回None表示这个请求不走缓存
+        """
+        def decorator(view):
+            self._views.add(view.__name__)
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                tag = tag_func()
+                if tag is None or not self.ttl:
+                    return view(*args, **kwargs)
+
+                key = self._key(view.__name__, tag)
+
+                # 1. 客户端手里的版本还有效：直接304
+                cached_etag = self.backend.get(key)
+                if cached_etag and request.if_none_match.contains_weak(cached_etag):
+                    self.stats_counter['handler_skipped'] += 1
+                    return self._not_modified(cached_etag)
+
+                # 2. 执行处理函数，成功的结果才记住ETag
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+
+                etag = self._set_etag(response)
+                payload = response.get_json(silent=True)
+                if isinstance(payload, dict) and payload.get('success') is True:
+                    self.backend.set(key, etag, self.ttl)
+                return response
+
+            return wrapper
+        return decorator
+
+    def invalidate(self, tag):
+        """写接口成功后调用：作废这个用户在所有查询接口上的ETag"""
+        if not tag:
+            return
+        for view_name in self._views:
+            self.backend.delete(self._key(view_name, tag))
+
+    @staticmethod
+    def _key(view_name, tag):
+        return f'etag:{view_name}:{tag}'
+
+    # ---------- 所有响应：ETag + 压缩 ----------
+
+    @staticmethod
+    def _set_etag(response):
+        """按未压缩的响应体算弱ETag（压缩前后内容相同，弱ETag可以共用）"""
+        etag, weak = response.get_etag()
+        if not etag:
+            etag = hashlib.sha256(response.get_data()).hexdigest()[:16]
+            response.set_etag(etag, weak=True)
+        return etag
+
+    def _not_modified(self, etag):
+        self.stats_counter['not_modified'] += 1
+        response = make_response('', 304)
+        response.set_etag(etag, weak=True)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _after_request(self, response):
+        # 流式响应（NDJSON导出等）不能为了算ETag/压缩把整个响应读进内存
+        if response.direct_passthrough or response.is_streamed or response.status_code != 200:
+            return response
+
+        # GET接口：加ETag，内容没变就回304
+        if request.method == 'GET':
+            etag = self._set_etag(response)
+            if request.if_none_match.contains_weak(etag):
+                return self._not_modified(etag)
+        elif response.get_etag()[0] and request.if_none_match.contains_weak(response.get_etag()[0]):
+            # conditional 接口执行完发现内容和客户端手里的一样
+            return self._not_modified(response.get_etag()[0])
+
+        return self._compress(response)
+
+    def _compress(self, response):
+        if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            compressed = brotli.compress(data, quality=self.brotli_quality)
+            encoding = 'br'
+        elif accepted['gzip']:
+            compressed = gzip.compress(data, self.gzip_level)
+            encoding = 'gzip'
+        else:
+            return response
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+
+        self.stats_counter['compressed'] += 1
+        self.stats_counter['bytes_before'] += len(data)
+        self.stats_counter['bytes_after'] += len(compressed)
+        return response
+
+    def stats(self):
+        return dict(self.stats_counter, ttl=self.ttl)
+
+
+http_cache = HTTPCache(
+    cache,
+    min_size=int(os.getenv('HTTP_COMPRESS_MIN_SIZE', '1024')),
+    ttl=int(os.getenv('HTTP_CACHE_TTL', '30'))
+)
+
+
+def email_tag():
+    """按请求里的邮箱（或会话令牌里的邮箱）区分缓存（会员状态查询用）；要求读最新数据的请求不走缓存"""
+    data = request.get_json(silent=True) or {}
+    if data.get('consistent'):
+        return None
+    token = data.get('token')
+    auth_header = request.headers.get('Authorization', '')
+    if not token and auth_header.startswith('Bearer '):
+        token = auth_header[7:].strip()
+    if token:
+        claims, error = session_token.verify(token, data.get('hardware_id', ''))
+        return claims['e'] if claims else None
+    email = data.get('email')
+    return email.strip() if isinstance(email, str) and email.strip() else None
@@ -0,0 +1,254 @@
+"""
+启动预热 + 就绪检查 + 优雅退出
+文件名：lifecycle.py
+
+启动时（app.py 调用 lifecycle.start()，开始接请求之前）：
+1. 按注册顺序执行预热步骤：建好数据库连接、加载会员等级目录……
+   这样第一批请求不用再付建连接、查系统表的时间
+2. 某一步失败不影响启动，/readyz 下一次检查时会重新执行没成功的步骤
+
+两个检查接口给负载均衡/部署平台用：
+- /healthz（存活）：进程还能处理请求就返回200，不做任何IO
+- /readyz（就绪）：预热完成、不在退出中、所有就绪检查（数据库能查询）都通过才返回200，
+  否则503；检查结果缓存 READY_CACHE_SECONDS 秒，探测再频繁也不会压到数据库上
+
+收到 SIGTERM（Render/gunicorn 重新部署时发的就是它）以后：
+1. 不再接新请求：之后进来的请求直接返回503（带 Connection: close，客户端换一台重试）
+2. 等正在处理的请求做完，最多等 SHUTDOWN_TIMEOUT 秒
+   流式响应（导出）要用 stream_with_context 包起来（admin.py），
+   teardown_request 才会等最后一行发完再执行，计数一直算着这个请求
+3. 按注册顺序执行退出步骤（app.py 里注册）：
+   停后台任务 → 把攒着的会员最后检查时间写回 → 停CPU采样 → 关闭数据库连接池
+4. 每一步出错只打印，不影响后面的步骤；整个过程只执行一次
+
+gunicorn 下：worker 自己会在做完当前请求后退出，这里先标记"不再接新请求"，
+再交给 gunicorn 原来的 SIGTERM 处理；退出步骤在进程退出前（atexit）执行。
+Flask 自带的服务器下：等请求做完、执行完退出步骤后直接结束进程。
+
+用法：
+    lifecycle.init_app(app)
+    lifecycle.on_startup('预热数据库连接池', db.warm_up)
+    lifecycle.on_ready_check('数据库', db.ping)
+    lifecycle.on_shutdown('关闭数据库连接池', db.close)
+    lifecycle.start()
+"""
+
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+
+# 等正在处理的请求做完最多等几秒（要小于平台强制结束进程前的等待时间，Render是30秒）
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '20'))
+# 就绪检查的结果缓存几秒
+READY_CACHE_SECONDS = float(os.getenv('READY_CACHE_SECONDS', '2'))
+
+# 退出过程中仍然放行的接口：存活/就绪检查要如实回答
+ALWAYS_ALLOWED_ENDPOINTS = {'healthz', 'readyz'}
+
+
+class Lifecycle:
+    """启动时预热、回答就绪检查；统计正在处理的请求，收到退出信号后排空请求、执行退出步骤"""
+
+    def __init__(self, timeout=SHUTDOWN_TIMEOUT):
+        self.timeout = timeout
+        self.state = 'running'      # running → draining → stopped
+        self.in_flight = 0
+        self.rejected = 0
+        self._hooks = []
+        # 预热步骤：[名称, 函数, 是否已成功]
+        self._startup_steps = []
+        self.warm_up_report = {}
+        self._ready_checks = []
+        self._ready_lock = threading.Lock()
+        self._ready_cache = (0.0, False, {})    # (检查时间, 是否就绪, 明细)
+        self._condition = threading.Condition()
+        self._shutdown_started = False
+        self._previous_sigterm = None
+
+    @property
+    def draining(self):
+        return self.state != 'running'
+
+    def on_startup(self, name, func):
+        """注册一个预热步骤（按注册顺序执行）"""
+        self._startup_steps.append([name, func, False])
+
+    def on_ready_check(self, name, func):
+        """注册一个就绪检查：func() 抛异常或返回假值表示没就绪"""
+        self._ready_checks.append((name, func))
+
+    def on_shutdown(self, name, func):
+        """注册一个退出步骤（按注册顺序执行）"""
+        self._hooks.append((name, func))
+
+    # ---------- 启动 / 就绪 ----------
+
+    @property
+    def warmed_up(self):
+        return all(done for _, _, done in self._startup_steps)
+
+    def start(self):
+        """执行还没成功的预热步骤，返回是否全部成功"""
+        for step in self._startup_steps:
+            name, func, done = step
+            if done:
+                continue
+            start = time.perf_counter()
+            try:
+                func()
+                step[2] = True
+                self.warm_up_report[name] = {'ok': True, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)}
+            except Exception as e:
+                self.warm_up_report[name] = {'ok': False, 'error': str(e)}
+                print(f"⚠️ 预热步骤 {name} 失败（/readyz 检查时重试）：{e}")
+        return self.warmed_up
+
+    def readiness(self):
+        """返回 (是否就绪, 明细)；结果缓存 READY_CACHE_SECONDS 秒，同一时刻只有一个线程真正去检查"""
+        if self.draining:
+            return False, {'state': self.state}
+
+        checked_at, ready, details = self._ready_cache
+        if time.monotonic() - checked_at < READY_CACHE_SECONDS:
+            return ready, details
+
+        with self._ready_lock:
+            checked_at, ready, details = self._ready_cache
+            if time.monotonic() - checked_at < READY_CACHE_SECONDS:
+                return ready, details
+
+            ready = self.start()
+            checks = {}
+            for name, func in self._ready_checks:
+                try:
+                    ok = bool(func())
+                    checks[name] = 'ok' if ok else 'failed'
+                except Exception as e:
+                    ok = False
+                    checks[name] = f'failed: {e}'
+                ready = ready and ok
+
+            details = {'state': self.state, 'warm_up': dict(self.warm_up_report), 'checks': checks}
+            self._ready_cache = (time.monotonic(), ready, details)
+            return ready, details
+
+    # ---------- Flask ----------
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        self.install_signal_handler()
+        atexit.register(self.shutdown)
+
+    def _before_request(self):
+        from flask import request
+
+        if request.endpoint in ALWAYS_ALLOWED_ENDPOINTS:
+            return None
+        with self._condition:
+            if self.draining:
+                self.rejected += 1
+                rejected = True
+            else:
+                self.in_flight += 1
+                rejected = False
+        if rejected:
+            from flask import g
+            from serialize import json_response
+
+            g.lifecycle_rejected = True
+            response = json_response({'success': False, 'message': '服务器正在重启，请稍后重试'}, status=503)
+            response.headers['Retry-After'] = '1'
+            response.headers['Connection'] = 'close'
+            return response
+        return None
+
+    def _teardown_request(self, error=None):
+        from flask import g, request
+
+        if g.pop('lifecycle_rejected', False) or request.endpoint in ALWAYS_ALLOWED_ENDPOINTS:
+            return
+        with self._condition:
+            self.in_flight -= 1
+            if self.in_flight <= 0:
+                self._condition.notify_all()
+
+    # ---------- 退出 ----------
+
+    def install_signal_handler(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        try:
+            self._previous_sigterm = signal.signal(signal.SIGTERM, self._on_sigterm)
+        except ValueError:
+            pass
+
+    def _on_sigterm(self, signum, frame):
+        self.begin_drain()
+        previous = self._previous_sigterm
+        if callable(previous):
+            # gunicorn：它会做完当前请求再退出，退出步骤在 atexit 里执行
+            previous(signum, frame)
+        else:
+            # 不能在信号处理函数里等：主线程可能正是要等的那个请求
+            threading.Thread(target=self._shutdown_and_exit, name='优雅退出', daemon=True).start()
+
+    def _shutdown_and_exit(self):
+        self.shutdown()
+        sys.stdout.flush()
+        os._exit(0)
+
+    def begin_drain(self):
+        """不再接新请求"""
+        with self._condition:
+            if self.state == 'running':
+                self.state = 'draining'
+                print(f"🛑 收到退出信号：不再接新请求，等待{self.in_flight}个处理中的请求（最多{self.timeout:.0f}秒）")
+
+    def wait_for_drain(self, timeout):
+        """等正在处理的请求做完，返回是否全部做完"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.in_flight > 0:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._condition.wait(left)
+        return True
+
+    def shutdown(self):
+        """排空请求 + 执行所有退出步骤（只执行一次）"""
+        with self._condition:
+            if self._shutdown_started:
+                return
+            self._shutdown_started = True
+        self.begin_drain()
+
+        start = time.monotonic()
+        if not self.wait_for_drain(self.timeout):
+            print(f"⚠️ 等待超时，还有{self.in_flight}个请求没做完")
+
+        for name, func in self._hooks:
+            try:
+                func()
+                print(f"✅ 退出步骤完成：{name}")
+            except Exception as e:
+                print(f"❌ 退出步骤 {name} 失败：{e}")
+
+        self.state = 'stopped'
+        print(f"👋 服务器已退出（耗时{time.monotonic() - start:.1f}秒，期间拒绝{self.rejected}个新请求）")
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'in_flight': self.in_flight,
+            'rejected': self.rejected,
+            'warmed_up': self.warmed_up,
+            'warm_up': dict(self.warm_up_report)
+        }
+
+
+lifecycle = Lifecycle()
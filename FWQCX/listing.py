@@ -0,0 +1,240 @@
+"""
+管理员列表/导出 - 按状态列出卡密、按到期时间列出会员
+文件名：listing.py
+
+1. 分页用keyset（游标），不用OFFSET：
+   OFFSET 100000 要先读出前10万行再丢掉，越往后翻越慢；
+   keyset 记住上一页最后一行的排序键，下一页直接从索引里那个位置接着读，翻到哪一页都一样快
+   - 卡密：WHERE status = ? AND id > ? ORDER BY id                    索引 (status, id)
+   - 会员：WHERE (expire_time, id) > (?, ?) ORDER BY expire_time, id  索引 (expire_time, id)
+   排序键里都带上id：同一秒到期的会员可能有很多，只按时间翻页会漏行或重复
+2. 游标（cursor）是上一页最后一行排序键的base64，客户端原样传回来就是下一页
+3. 全量导出用服务器端游标（psycopg2命名游标），每次从数据库取 EXPORT_FETCH_SIZE 行，
+   编码成NDJSON边取边发，进程内存占用和表的大小无关
+4. 分页查询走只读从库；导出是长事务，走主库，避免从库上的长事务拖住复制
+
+用法：
+    from listing import listing_service
+
+    result = listing_service.list_card_keys(status='未激活', limit=100)
+    next_page = listing_service.list_card_keys(status='未激活', cursor=result.data['next_cursor'])
+
+    for line in listing_service.export_members(active=True):
+        ...  # 每行一个JSON（bytes）
+"""
+
+from datetime import datetime
+from typing import Optional
+
+import rules
+from rules import decode_cursor, encode_cursor
+from admission import Overloaded
+from database import Database
+from serialize import dumps
+from services import ServiceResult, db
+
+# 每页默认/最多条数
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# 导出时服务器端游标每次取的行数
+EXPORT_FETCH_SIZE = 2000
+
+CARD_KEY_COLUMNS = (
+    'id', 'card_key', 'vip_level', 'days', 'lyrics_limit', 'music_limit', 'status',
+    'activated_by', 'activated_time', 'expire_time', 'created_at', 'batch_id'
+)
+MEMBER_COLUMNS = (
+    'id', 'user_id', 'email', 'vip_level', 'total_lyrics_limit', 'lyrics_used',
+    'total_music_limit', 'music_used', 'activate_time', 'expire_time', 'last_check', 'is_active'
+)
+
+
+def _row_dict(columns, row):
+    return {
+        column: rules.format_time(value) if isinstance(value, datetime) else value
+        for column, value in zip(columns, row)
+    }
+
+
+class ListingService:
+    """卡密/会员的分页列表和全量导出（只读）"""
+
+    def __init__(self, database: Database):
+        self.db = database
+
+    # ---------- 查询条件 ----------
+
+    @staticmethod
+    def _card_key_query(status, after_id, limit=None):
+        conditions, params = [], []
+        if status:
+            conditions.append("status = %s")
+            params.append(status)
+        if after_id is not None:
+            conditions.append("id > %s")
+            params.append(after_id)
+
+        sql = f"SELECT {', '.join(CARD_KEY_COLUMNS)} FROM vip_keys"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return sql, params
+
+    @staticmethod
+    def _member_query(expires_from, expires_to, active, after, limit=None):
+        conditions, params = [], []
+        if after is not None:
+            # 行比较 (expire_time, id) > (?, ?) 可以直接用 (expire_time, id) 索引定位
+            conditions.append("(expire_time, id) > (%s, %s)")
+            params.extend(after)
+        if expires_from is not None:
+            conditions.append("expire_time >= %s")
+            params.append(expires_from)
+        if expires_to is not None:
+            conditions.append("expire_time < %s")
+            params.append(expires_to)
+        if active is not None:
+            conditions.append("is_active = %s")
+            params.append(active)
+
+        sql = f"SELECT {', '.join(MEMBER_COLUMNS)} FROM members"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY expire_time, id"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return sql, params
+
+    # ---------- 分页 ----------
+
+    def _page(self, sql, params, limit, columns, sort_key):
+        """多取一行判断还有没有下一页"""
+        with self.db.read_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort_key(rows[-1])) if has_more else None
+        return ServiceResult.ok(
+            items=[_row_dict(columns, row) for row in rows],
+            count=len(rows),
+            next_cursor=next_cursor
+        )
+
+    @staticmethod
+    def _page_size(limit):
+        if limit is None:
+            return DEFAULT_PAGE_SIZE
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            raise ValueError('limit必须是正整数')
+        return min(limit, MAX_PAGE_SIZE)
+
+    @staticmethod
+    def _decode_card_key_cursor(cursor):
+        values = decode_cursor(cursor)
+        if len(values) != 1 or not isinstance(values[0], int):
+            raise ValueError('cursor不合法')
+        return values[0]
+
+    @staticmethod
+    def _decode_member_cursor(cursor):
+        return rules.decode_time_cursor(cursor)
+
+    def list_card_keys(self, status: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> ServiceResult:
+        """按状态列出卡密（按id顺序），cursor 是上一页返回的 next_cursor"""
+        try:
+            limit = self._page_size(limit)
+            after_id = self._decode_card_key_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return ServiceResult.fail(str(e))
+
+        sql, params = self._card_key_query(status, after_id, limit + 1)
+        try:
+            return self._page(sql, params, limit, CARD_KEY_COLUMNS, lambda row: [row[0]])
+        except Overloaded:
+            # 过载/过了截止时间：交给准入控制返回503（admission.py），不要变成普通的失败结果
+            raise
+
+        except Exception as e:
+            print(f"❌ 查询卡密列表失败：{e}")
+            return ServiceResult.fail(f'查询卡密列表失败：{str(e)}')
+
+    def list_members(self, expires_from: Optional[datetime] = None,
+                     expires_to: Optional[datetime] = None, active: Optional[bool] = None,
+                     limit: Optional[int] = None, cursor: Optional[str] = None) -> ServiceResult:
+        """按到期时间列出会员（先到期的在前），cursor 是上一页返回的 next_cursor"""
+        try:
+            limit = self._page_size(limit)
+            after = self._decode_member_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return ServiceResult.fail(str(e))
+
+        sql, params = self._member_query(expires_from, expires_to, active, after, limit + 1)
+        try:
+            # 排序键取原始的datetime（带微秒），不能用格式化后的文本
+            return self._page(sql, params, limit, MEMBER_COLUMNS,
+                              lambda row: [row[MEMBER_COLUMNS.index('expire_time')], row[0]])
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 查询会员列表失败：{e}")
+            return ServiceResult.fail(f'查询会员列表失败：{str(e)}')
+
+    # ---------- 全量导出 ----------
+
+    def _export(self, name, sql, params, columns):
+        """
+        服务器端游标：每次取EXPORT_FETCH_SIZE行，一行编码成一行NDJSON
+
+        借到连接、开始查询以后先产出一个空块（_start 取走它），在这之前的过载/超时原样抛出，
+        接口照常返回503；之后响应头已经发出去了，中途出错没法再改状态码，
+        最后补一行错误信息让客户端知道导出不完整
+        """
+        exported = 0
+        started = False
+        try:
+            with self.db.read_connection(primary=True) as conn:
+                with conn.cursor(name=f'export_{name}') as cursor:
+                    cursor.itersize = EXPORT_FETCH_SIZE
+                    cursor.execute(sql, params)
+                    started = True
+                    yield b''
+                    for row in cursor:
+                        exported += 1
+                        yield dumps(_row_dict(columns, row)) + b'\n'
+        except Exception as e:
+            if not started:
+                if isinstance(e, Overloaded):
+                    raise
+                yield b''
+            print(f"❌ 导出{name}中断（已导出{exported}行）：{e}")
+            yield dumps({'success': False, 'message': f'导出中断：{str(e)}', 'exported': exported}) + b'\n'
+            return
+        print(f"📤 导出{name}完成：{exported}行")
+
+    @staticmethod
+    def _start(lines):
+        """在请求里先把导出跑到开始查询为止：借不到连接、过载时在这里抛 Overloaded"""
+        next(lines)
+        return lines
+
+    def export_card_keys(self, status: Optional[str] = None):
+        """导出卡密（生成器，每次产出一行NDJSON）"""
+        sql, params = self._card_key_query(status, None)
+        return self._start(self._export('card_keys', sql, params, CARD_KEY_COLUMNS))
+
+    def export_members(self, expires_from: Optional[datetime] = None,
+                       expires_to: Optional[datetime] = None, active: Optional[bool] = None):
+        """导出会员（生成器，每次产出一行NDJSON）"""
+        sql, params = self._member_query(expires_from, expires_to, active, None)
+        return self._start(self._export('members', sql, params, MEMBER_COLUMNS))
+
+
+listing_service = ListingService(db)
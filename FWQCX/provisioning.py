@@ -0,0 +1,296 @@
+"""
+批量导入用户 - 合作方一次开通成千上万个账号
+文件名：provisioning.py
+
+流程（边读边处理，内存占用和文件大小无关）：
+1. 逐行读取 CSV（email,password，可以有表头）或 NDJSON（每行 {"email": ..., "password": ...}）
+2. 每 CHUNK_SIZE 条打成一包交给进程池：校验格式、加盐哈希、生成验证密钥
+   （用的是 rules.py 里和注册接口同一套规则，结果和一个个注册完全一样）
+3. 每 BATCH_SIZE 条用 COPY 写进临时表，再用一条 INSERT ... SELECT ... ON CONFLICT DO NOTHING
+   并入 users 表。直接 COPY 进 users 的话，一个已注册的邮箱就会让整批失败；
+   经过临时表，已注册的邮箱只是被跳过，记为这一条失败
+4. 每条记录一个结果（成功：用户ID + 验证密钥；失败：原因），交给 on_result 回调，不中断导入
+
+用法：
+    # 命令行（大文件用这个，不受HTTP请求超时限制）
+    python provisioning.py partner_users.csv --workers 4 --output accounts.ndjson
+
+    # 管理员接口（见admin.py）
+    curl -H "X-Admin-Token: ..." -H "Content-Type: text/csv" \\
+         --data-binary @partner_users.csv http://localhost:5000/api/admin/users/import
+
+    # 吞吐量
+    python benchmark.py import --count 100000
+
+注意：这个模块会被进程池的子进程导入，顶层只能导入 rules 这样的纯逻辑模块，
+不能导入 services/database（导入时会建立数据库连接池）。
+"""
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import rules
+
+# 每包交给子进程的记录数：太小了进程间传输的开销占大头
+CHUNK_SIZE = 2000
+# 每批写入数据库的记录数（一批一个事务）
+BATCH_SIZE = 20000
+# users.email 是 VARCHAR(100)
+MAX_EMAIL_LENGTH = 100
+
+
+def read_records(lines, fmt='csv'):
+    """
+    逐行解析上传的文件
+
+    lines：文本行的迭代器（打开的文件、TextIOWrapper都可以）
+    产出 (行号, 邮箱, 密码, 解析错误)，解析错误为None表示这一行格式没问题
+    """
+    if fmt == 'csv':
+        reader = csv.reader(lines)
+        for row in reader:
+            if not any(field.strip() for field in row):
+                continue
+            # 第一行是表头就跳过
+            if reader.line_num == 1 and row[0].strip().lower() == 'email':
+                continue
+            if len(row) < 2:
+                yield reader.line_num, row[0].strip(), '', '缺少密码列'
+                continue
+            yield reader.line_num, row[0].strip(), row[1].strip(), None
+
+    elif fmt == 'ndjson':
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                email = str(record.get('email') or '').strip()
+                password = str(record.get('password') or '').strip()
+            except (ValueError, AttributeError):
+                yield line_no, '', '', '不是合法的JSON对象'
+                continue
+            yield line_no, email, password, None
+
+    else:
+        raise ValueError(f'不支持的文件格式：{fmt}（只支持csv或ndjson）')
+
+
+def prepare_chunk(records):
+    """
+    校验 + 哈希一包记录（在子进程里执行）
+
+    返回 [(行号, 邮箱, (密码哈希, 盐值, 验证密钥) 或 None, 错误)]
+    """
+    prepared = []
+    for line_no, email, password, error in records:
+        if not error and len(email) > MAX_EMAIL_LENGTH:
+            error = f'邮箱太长（最多{MAX_EMAIL_LENGTH}个字符）'
+        error = error or rules.validate_register(email, password)
+        if error:
+            prepared.append((line_no, email, None, error))
+            continue
+
+        password_hash, salt = rules.hash_password(password)
+        prepared.append((line_no, email, (password_hash, salt, rules.generate_verification_key()), None))
+    return prepared
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prepare_records(records, workers=0):
+    """
+    按原来的顺序产出 prepare_chunk 的结果
+
+    workers=0：在当前进程里处理
+    workers>0：进程池并行，最多提前读 workers*2 包，文件再大也不会全读进内存
+    """
+    chunks = _chunks(records, CHUNK_SIZE)
+    if workers <= 0:
+        for chunk in chunks:
+            yield from prepare_chunk(chunk)
+        return
+
+    # spawn：Web进程里有后台线程和数据库连接，fork出来的子进程可能卡在别的线程持有的锁上
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(prepare_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+class UserImporter:
+    """把准备好的记录分批写进 users 表"""
+
+    def __init__(self, database):
+        self.db = database
+
+    def run(self, records, workers=0, batch_size=BATCH_SIZE, on_result=None):
+        """
+        导入 read_records() 产出的记录
+
+        on_result：每条记录的结果（字典）都会传给它，例如写到文件里
+        返回汇总：{'total', 'created', 'failed', 'elapsed_ms'}；
+        数据库出错时已经提交的批次保留，汇总里带 error
+        """
+        from bloom import negative_cache
+
+        report = {'total': 0, 'created': 0, 'failed': 0}
+        emit = on_result or (lambda result: None)
+        start = time.perf_counter()
+
+        with self.db.connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS import_users (
+                        line_no INT,
+                        email VARCHAR(100),
+                        password_hash VARCHAR(255),
+                        salt VARCHAR(64),
+                        verification_key VARCHAR(20)
+                    ) ON COMMIT DELETE ROWS
+                """)
+
+                batch = []
+                for line_no, email, row, error in prepare_records(records, workers):
+                    report['total'] += 1
+                    if error:
+                        report['failed'] += 1
+                        emit({'line': line_no, 'email': email, 'success': False, 'message': error})
+                        continue
+
+                    batch.append((line_no, email) + row)
+                    if len(batch) >= batch_size:
+                        self._load_batch(conn, cursor, batch, report, emit, negative_cache)
+                        batch = []
+
+                if batch:
+                    self._load_batch(conn, cursor, batch, report, emit, negative_cache)
+
+                cursor.execute("DROP TABLE IF EXISTS import_users")
+                conn.commit()
+
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ 批量导入中断：{e}")
+                report['error'] = f'导入中断（之前的批次已经写入）：{str(e)}'
+
+        report['elapsed_ms'] = round((time.perf_counter() - start) * 1000)
+        print(f"📥 批量导入完成：共{report['total']}条，成功{report['created']}，"
+              f"失败{report['failed']}，耗时{report['elapsed_ms']}ms")
+        self._log(report)
+        return report
+
+    @staticmethod
+    def _load_batch(conn, cursor, batch, report, emit, negative_cache):
+        """一批：COPY进临时表 → 并入users（已注册的跳过）→ 提交"""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        cursor.copy_expert("""
+            COPY import_users (line_no, email, password_hash, salt, verification_key)
+            FROM STDIN WITH (FORMAT csv)
+        """, buffer)
+
+        # 按行号顺序插入：文件里同一个邮箱出现多次时，第一次出现的那行成功
+        cursor.execute("""
+            INSERT INTO users (email, password_hash, salt, verification_key, created_at)
+            SELECT email, password_hash, salt, verification_key, %s
+            FROM import_users
+            ORDER BY line_no
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id, email
+        """, (datetime.now(),))
+        created = {email: user_id for user_id, email in cursor.fetchall()}
+        conn.commit()
+        negative_cache.add_emails(created)
+
+        for line_no, email, _, _, verification_key in batch:
+            user_id = created.pop(email, None)
+            if user_id is None:
+                report['failed'] += 1
+                emit({'line': line_no, 'email': email, 'success': False, 'message': '该邮箱已注册'})
+            else:
+                report['created'] += 1
+                emit({'line': line_no, 'email': email, 'success': True,
+                      'user_id': user_id, 'verification_key': verification_key})
+
+    def _log(self, report):
+        """系统日志里记一条汇总（不是每个用户一条）"""
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO system_logs (level, module, action, details, created_at)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, ('INFO', 'auth', 'import',
+                      f"批量导入用户: 共{report['total']}条，成功{report['created']}，失败{report['failed']}",
+                      datetime.now()))
+                conn.commit()
+        except Exception as log_error:
+            print(f"⚠️ 记录日志失败（不影响导入）: {log_error}")
+
+
+def detect_format(path_or_type):
+    """按文件扩展名或Content-Type判断格式"""
+    text = (path_or_type or '').lower()
+    if 'ndjson' in text or 'jsonl' in text or text.endswith('.json'):
+        return 'ndjson'
+    return 'csv'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量导入用户（CSV或NDJSON）')
+    parser.add_argument('path', help='用户文件：CSV（email,password）或NDJSON')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='默认按扩展名判断')
+    # 主进程要负责读文件和COPY，留一个核给它；单核机器上开子进程只会更慢
+    parser.add_argument('--workers', type=int, default=max(0, (os.cpu_count() or 1) - 1),
+                        help='校验/哈希的子进程数，0=不开子进程')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--output', default='-', help='每条记录的结果（NDJSON），默认输出到屏幕')
+    args = parser.parse_args()
+
+    from services import db
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output != '-' else None
+
+    def on_result(result):
+        line = json.dumps(result, ensure_ascii=False)
+        if output:
+            output.write(line + '\n')
+        else:
+            print(line)
+
+    try:
+        with open(args.path, encoding='utf-8-sig', newline='') as source:
+            records = read_records(source, args.format or detect_format(args.path))
+            report = UserImporter(db).run(records, args.workers, args.batch_size, on_result)
+    finally:
+        if output:
+            output.close()
+
+    print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
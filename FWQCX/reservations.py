@@ -0,0 +1,286 @@
+"""
+次数预留 - 长时间音乐生成的两阶段扣次数
+文件名：reservations.py
+
+流程：
+1. reserve：开始生成前预留次数（members.xxx_reserved 增加），拿到reservation_id
+2. commit：生成成功后结算（reserved 转成 used，写使用日志）
+3. release：生成失败时释放（reserved 减回去，不扣次数）
+
+预留有有效期，客户端崩溃没来得及commit/release的预留，
+由后台清理任务（sweeper.py）到期后自动释放。
+每一步都是一个很短的事务，生成期间不占用数据库事务。
+"""
+
+import secrets
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from psycopg2.extras import execute_values
+
+import rules
+from admission import Overloaded
+from database import Database
+from services import ServiceResult, db
+
+
+class ReservationService:
+    """次数预留服务"""
+
+    # 预留默认有效期（秒），音乐生成通常几分钟内完成
+    DEFAULT_TTL = 600
+    # 预留最长有效期（秒）
+    MAX_TTL = 3600
+
+    def __init__(self, database: Database):
+        self.db = database
+
+    def reserve(self, email: str, usage_type: str = 'music', count: int = 1,
+                ttl: Optional[int] = None) -> ServiceResult:
+        """预留次数：剩余次数够才成功，成功后这些次数别的请求不能再用"""
+        if not email:
+            return ServiceResult.fail('请提供邮箱地址')
+
+        type_error = rules.usage_type_error(usage_type)
+        if type_error:
+            return ServiceResult.fail(type_error)
+
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            return ServiceResult.fail('count必须是正整数')
+
+        ttl = ttl or self.DEFAULT_TTL
+        if not isinstance(ttl, int) or ttl < 1 or ttl > self.MAX_TTL:
+            return ServiceResult.fail(f'ttl必须在1到{self.MAX_TTL}秒之间')
+
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                current_time = datetime.now()
+                expire_at = current_time + timedelta(seconds=ttl)
+
+                # 1. 条件更新：只有 已用+已预留+本次 <= 总次数 时才预留成功
+                #    （列名来自固定白名单USAGE_TYPES，可以安全拼接）
+                cursor.execute(f"""
+                    UPDATE members m SET
+                        {usage_type}_reserved = COALESCE(m.{usage_type}_reserved, 0) + %s
+                    FROM users u
+                    WHERE u.email = %s
+                      AND m.id = (
+                          SELECT id FROM members
+                          WHERE user_id = u.id AND is_active AND expire_time > %s
+                          ORDER BY expire_time DESC LIMIT 1
+                      )
+                      AND m.{usage_type}_used + COALESCE(m.{usage_type}_reserved, 0) + %s
+                          <= m.total_{usage_type}_limit
+                    RETURNING u.id, m.id,
+                              m.total_{usage_type}_limit - m.{usage_type}_used - m.{usage_type}_reserved
+                """, (count, email, current_time, count))
+                updated = cursor.fetchone()
+
+                if not updated:
+                    conn.rollback()
+                    return self._reserve_failure(cursor, email, usage_type, count, current_time)
+
+                user_id, member_id, remaining = updated
+
+                # 2. 保存预留记录
+                reservation_id = secrets.token_hex(16)
+                cursor.execute("""
+                    INSERT INTO usage_reservations
+                    (reservation_id, user_id, member_id, email, action_type, count, status, created_at, expire_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, 'reserved', %s, %s)
+                """, (reservation_id, user_id, member_id, email, usage_type, count, current_time, expire_at))
+
+                conn.commit()
+                self.db.note_write(email)
+
+            print(f"📌 预留成功：{email} {usage_type}x{count}，预留号={reservation_id[:8]}...")
+            return ServiceResult.ok(
+                '预留成功',
+                reservation_id=reservation_id,
+                usage_type=usage_type,
+                count=count,
+                remaining=remaining,
+                expire_at=rules.format_time(expire_at)
+            )
+
+        except Overloaded:
+            # 过载/过了截止时间：交给准入控制返回503（admission.py），不要变成普通的失败结果
+            raise
+
+        except Exception as e:
+            print(f"❌ 预留次数时出错：{e}")
+            return ServiceResult.fail(f'预留失败：{str(e)}')
+
+    def _reserve_failure(self, cursor, email, usage_type, count, current_time):
+        """预留失败时查明原因（用户不存在/不是会员/次数不够）"""
+        cursor.execute(f"""
+            SELECT u.id, m.id,
+                   m.{usage_type}_used + COALESCE(m.{usage_type}_reserved, 0),
+                   m.total_{usage_type}_limit
+            FROM users u
+            LEFT JOIN members m ON u.id = m.user_id AND m.is_active AND m.expire_time > %s
+            WHERE u.email = %s
+            ORDER BY m.expire_time DESC NULLS LAST
+            LIMIT 1
+        """, (current_time, email))
+        row = cursor.fetchone()
+
+        if not row:
+            return ServiceResult.fail('用户不存在')
+
+        _, member_id, used, limit = row
+        if not member_id:
+            return ServiceResult.fail('您不是会员，请先激活会员')
+
+        return ServiceResult.fail(
+            rules.quota_error(usage_type, used, limit, count) or '预留失败，请重试'
+        )
+
+    def commit(self, reservation_id: str) -> ServiceResult:
+        """结算预留：预留的次数变成已用次数，并写使用日志"""
+        if not reservation_id:
+            return ServiceResult.fail('请提供预留号')
+
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                current_time = datetime.now()
+
+                # 1. 把预留标记为已结算（只有未过期的预留才能结算）
+                cursor.execute("""
+                    UPDATE usage_reservations SET
+                        status = 'committed',
+                        settled_at = %s
+                    WHERE reservation_id = %s
+                      AND status = 'reserved'
+                      AND expire_at > %s
+                    RETURNING user_id, member_id, email, action_type, count
+                """, (current_time, reservation_id, current_time))
+                row = cursor.fetchone()
+
+                if not row:
+                    conn.rollback()
+                    return ServiceResult.fail('预留不存在、已过期或已结算')
+
+                user_id, member_id, email, usage_type, count = row
+
+                # 2. reserved 转成 used
+                cursor.execute(f"""
+                    UPDATE members SET
+                        {usage_type}_used = {usage_type}_used + %s,
+                        {usage_type}_reserved = GREATEST(0, {usage_type}_reserved - %s),
+                        last_used = %s
+                    WHERE id = %s
+                    RETURNING total_{usage_type}_limit - {usage_type}_used - {usage_type}_reserved
+                """, (count, count, current_time, member_id))
+                remaining = cursor.fetchone()[0]
+
+                # 3. 每次使用一条日志，和单条记录接口保持一致
+                execute_values(cursor, """
+                    INSERT INTO usage_logs
+                    (user_id, email, action_type, action_time)
+                    VALUES %s
+                """, [(user_id, email, usage_type, current_time)] * count)
+
+                conn.commit()
+                self.db.note_write(email)
+
+            print(f"✅ 预留结算成功：{email} {usage_type}x{count}，剩余{remaining}次")
+            return ServiceResult.ok('使用记录成功', remaining=remaining,
+                                    usage_type=usage_type, count=count, email=email)
+
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 结算预留时出错：{e}")
+            return ServiceResult.fail(f'结算失败：{str(e)}')
+
+    def release(self, reservation_id: str) -> ServiceResult:
+        """释放预留：生成失败时把次数还回去"""
+        if not reservation_id:
+            return ServiceResult.fail('请提供预留号')
+
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                current_time = datetime.now()
+
+                cursor.execute("""
+                    UPDATE usage_reservations SET
+                        status = 'released',
+                        settled_at = %s
+                    WHERE reservation_id = %s
+                      AND status = 'reserved'
+                    RETURNING member_id, email, action_type, count
+                """, (current_time, reservation_id))
+                row = cursor.fetchone()
+
+                if not row:
+                    conn.rollback()
+                    return ServiceResult.fail('预留不存在或已结算')
+
+                member_id, email, usage_type, count = row
+                cursor.execute(f"""
+                    UPDATE members SET
+                        {usage_type}_reserved = GREATEST(0, {usage_type}_reserved - %s)
+                    WHERE id = %s
+                """, (count, member_id))
+
+                conn.commit()
+                self.db.note_write(email)
+
+            print(f"↩️ 预留已释放：{usage_type}x{count}")
+            return ServiceResult.ok('预留已释放', email=email, usage_type=usage_type, count=count)
+
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 释放预留时出错：{e}")
+            return ServiceResult.fail(f'释放失败：{str(e)}')
+
+    def expire_reservations(self, batch_size: int = 500) -> int:
+        """
+        释放已过期的预留（后台清理任务调用），返回本次处理的条数
+
+        SKIP LOCKED：多个worker进程同时跑清理时互不阻塞、不会重复释放
+        """
+        with self.db.connection() as conn, conn.cursor() as cursor:
+            current_time = datetime.now()
+
+            cursor.execute("""
+                UPDATE usage_reservations SET
+                    status = 'expired',
+                    settled_at = %s
+                WHERE id IN (
+                    SELECT id FROM usage_reservations
+                    WHERE status = 'reserved' AND expire_at <= %s
+                    ORDER BY expire_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING member_id, action_type, count
+            """, (current_time, current_time, batch_size))
+            rows = cursor.fetchall()
+
+            if rows:
+                # 同一个会员的多条预留合并，一条UPDATE还回所有次数
+                released = defaultdict(lambda: {'lyrics': 0, 'music': 0})
+                for member_id, usage_type, count in rows:
+                    released[member_id][usage_type] += count
+
+                execute_values(cursor, """
+                    UPDATE members AS m SET
+                        lyrics_reserved = GREATEST(0, m.lyrics_reserved - v.lyrics),
+                        music_reserved = GREATEST(0, m.music_reserved - v.music)
+                    FROM (VALUES %s) AS v(id, lyrics, music)
+                    WHERE m.id = v.id
+                """, [(member_id, c['lyrics'], c['music']) for member_id, c in released.items()])
+
+            conn.commit()
+
+        return len(rows)
+
+
+# 默认的服务实例（和services.py共用一个数据库连接池）
+reservation_service = ReservationService(db)
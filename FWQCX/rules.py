@@ -0,0 +1,360 @@
+"""
+业务规则模块 - 同步版(Flask)和异步版(aiohttp)共用的纯逻辑
+文件名：rules.py
+
+这里的函数不读取request、不连接数据库、不返回HTTP响应，
+只负责"判断"和"计算"。两套接口各自取数据、查数据库，
+然后调用这里的函数，保证两边的规则完全一致。
+"""
+
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import string
+from datetime import datetime, timedelta
+
+# 登录失败时的延迟（秒），防止暴力破解
+USER_NOT_FOUND_DELAY = 0.5
+WRONG_PASSWORD_DELAY = 1
+
+# 登录时密码/验证密钥不对的提示；只有这两种算"登录失败"，计入限流
+WRONG_PASSWORD = '用户不存在或密码错误'
+WRONG_VERIFICATION_KEY = '验证密钥错误'
+CREDENTIAL_ERRORS = (WRONG_PASSWORD, WRONG_VERIFICATION_KEY)
+
+# 支持的使用类型
+USAGE_TYPES = ('lyrics', 'music')
+
+# 会员权益配置 - 就像菜单一样
+# 这里是默认值：第一次建库时写入 vip_tiers 表，之后以数据库为准（tiers.py）
+VIP_BENEFITS = {
+    1: {  # 体验会员（就像试吃套餐）
+        'name': '体验会员',
+        'days': 7,          # 有效期7天
+        'lyrics': 50,       # 可以生成50次歌词
+        'music': 10,        # 可以生成10次音乐
+        'price': 0,         # 价格：免费
+        'description': '免费体验所有功能'
+    },
+    2: {  # 月度会员（普通套餐）
+        'name': '月度会员',
+        'days': 30,         # 有效期30天
+        'lyrics': 200,      # 可以生成200次歌词
+        'music': 50,        # 可以生成50次音乐
+        'price': 29.9,      # 价格：29.9元
+        'description': '适合轻度创作者'
+    },
+    3: {  # 季度会员（豪华套餐）
+        'name': '季度会员',
+        'days': 90,         # 有效期90天
+        'lyrics': 600,      # 可以生成600次歌词
+        'music': 150,       # 可以生成150次音乐
+        'price': 79.9,      # 价格：79.9元
+        'description': '性价比最高的选择'
+    },
+    4: {  # 年度会员（尊享套餐）
+        'name': '年度会员',
+        'days': 365,        # 有效期365天
+        'lyrics': 2400,     # 可以生成2400次歌词
+        'music': 600,       # 可以生成600次音乐
+        'price': 299.9,     # 价格：299.9元
+        'description': '专业创作者的最佳选择'
+    }
+}
+
+
+def format_time(value):
+    """所有接口统一的时间格式：YYYY-MM-DD HH:MM:SS（isoformat是C实现，比strftime快）"""
+    return value.isoformat(' ', 'seconds')
+
+
+# ======================= 用户认证 =======================
+
+def hash_password(password, salt=None):
+    """加盐哈希密码，返回 (哈希值, 盐值)"""
+    if salt is None:
+        salt = os.urandom(16).hex()
+
+    # 密码+盐值一起哈希
+    hash_obj = hashlib.sha256()
+    hash_obj.update(password.encode('utf-8'))
+    hash_obj.update(salt.encode('utf-8'))
+    password_hash = hash_obj.hexdigest()
+
+    return password_hash, salt
+
+
+def validate_register(email, password):
+    """检查注册信息，有问题返回错误描述，没问题返回None"""
+    # 邮箱必须是QQ邮箱
+    if not re.match(r'^\d+@qq\.com$', email):
+        return '请使用QQ邮箱（格式：数字@qq.com，例如：123456789@qq.com）'
+
+    # 密码至少8位
+    if len(password) < 8:
+        return '密码长度不能少于8位'
+
+    # 至少包含1个字母
+    if not any(c.isalpha() for c in password):
+        return '密码必须包含至少1个英文字母'
+
+    # 至少包含5个数字
+    if sum(c.isdigit() for c in password) < 5:
+        return '密码必须包含至少5个数字'
+
+    return None
+
+
+def generate_verification_key():
+    """生成6位验证密钥（大写字母+数字，至少各一个）"""
+    characters = string.ascii_uppercase + string.digits
+    verification_key = ''.join(random.choices(characters, k=6))
+
+    # 确保至少包含一个字母和一个数字
+    if not any(c.isalpha() for c in verification_key):
+        verification_key = verification_key[:5] + 'A'
+    if not any(c.isdigit() for c in verification_key):
+        verification_key = verification_key[:5] + '1'
+
+    return verification_key
+
+
+def check_device(stored_hardware_id, stored_key, hardware_id, verification_key):
+    """
+    设备绑定检查
+
+    返回 (错误描述, 是否需要保存新硬件ID)
+    错误描述为None表示允许登录
+    """
+    # 第一次登录：直接绑定当前设备
+    if not stored_hardware_id:
+        return None, bool(hardware_id)
+
+    # 同一设备：直接通过
+    if hardware_id and hardware_id == stored_hardware_id:
+        return None, False
+
+    # 不同设备：需要验证密钥
+    if not verification_key:
+        return '检测到新设备登录，需要验证密钥', False
+
+    if verification_key != stored_key:
+        return WRONG_VERIFICATION_KEY, False
+
+    # 验证通过后换绑到新设备
+    return None, bool(hardware_id)
+
+
+def login_member_info(member_row, current_time):
+    """
+    把会员查询结果整理成登录接口返回的member字段
+
+    member_row顺序：vip_level, expire_time, total_lyrics_limit, lyrics_used,
+                    total_music_limit, music_used, lyrics_reserved, music_reserved
+    剩余次数要扣掉预留中的次数（reservations.py），和记录使用时的额度检查一致
+    """
+    (vip_level, expire_time, lyrics_limit, lyrics_used, music_limit, music_used,
+     lyrics_reserved, music_reserved) = member_row
+
+    return {
+        'vip_level': vip_level,
+        'expire_time': format_time(expire_time),
+        'remaining_days': remaining_days(expire_time, current_time),
+        'lyrics_remaining': max(0, lyrics_limit - lyrics_used - lyrics_reserved),
+        'music_remaining': max(0, music_limit - music_used - music_reserved),
+        'lyrics_used': lyrics_used,
+        'lyrics_limit': lyrics_limit,
+        'music_used': music_used,
+        'music_limit': music_limit
+    }
+
+
+# ======================= 会员管理 =======================
+
+def remaining_days(expire_time, current_time, round_up=False):
+    """
+    计算剩余天数
+
+    round_up=False：登录接口的算法，不足1天算1天
+    round_up=True：查询接口的算法，有零头就多算一天
+    """
+    time_difference = expire_time - current_time
+    if time_difference.total_seconds() <= 0:
+        return 0
+
+    if round_up and time_difference.seconds > 0:
+        return max(1, time_difference.days + 1)
+    return max(1, time_difference.days)
+
+
+def card_status_error(status, activated_by):
+    """卡密状态检查，不能激活时返回错误描述"""
+    if status == '已激活':
+        return f'卡密已被激活（激活用户：{activated_by}）'
+    elif status == '已使用':
+        return '卡密已使用'
+    elif status == '已冻结':
+        return '卡密已被冻结'
+    elif status == '已作废':
+        return '卡密已作废'
+    elif status == '已过期':
+        return '卡密已过期'
+    return None
+
+
+def renew_member(old_expire, old_lyrics_remaining, old_music_remaining,
+                 days, lyrics_limit, music_limit, current_time):
+    """
+    老会员续费：剩余次数+新卡密次数，有效期在原基础上叠加
+
+    返回 (新总歌词次数, 新总音乐次数, 新过期时间)
+    """
+    if old_expire > current_time:
+        # 如果还没过期，在原有基础上增加天数
+        new_expire = old_expire + timedelta(days=days)
+    else:
+        # 如果已过期，从现在开始计算
+        new_expire = current_time + timedelta(days=days)
+
+    return (old_lyrics_remaining + lyrics_limit,
+            old_music_remaining + music_limit,
+            new_expire)
+
+
+def activation_update(existing_member, vip_level, days, lyrics_limit, music_limit, current_time):
+    """
+    激活卡密后会员记录的新值（同步版 services.py 和异步版 async_api.py 共用）
+
+    existing_member：当前有效的会员记录
+        (id, vip_level, lyrics_used, music_used, total_lyrics_limit, total_music_limit, expire_time)，
+        不是会员时为None
+    返回 (新等级, 新总歌词次数, 新总音乐次数, 新过期时间)
+    """
+    if existing_member is None:
+        # 新会员
+        _, _, new_expire = renew_member(current_time, 0, 0, days, lyrics_limit, music_limit, current_time)
+        return vip_level, lyrics_limit, music_limit, new_expire
+
+    # 老会员：叠加次数和延长有效期
+    _, old_level, lyrics_used, music_used, old_lyrics_limit, old_music_limit, old_expire = existing_member
+    if isinstance(old_expire, str):
+        old_expire = datetime.fromisoformat(old_expire)
+
+    new_lyrics_limit, new_music_limit, new_expire = renew_member(
+        old_expire,
+        max(0, old_lyrics_limit - lyrics_used),
+        max(0, old_music_limit - music_used),
+        days, lyrics_limit, music_limit, current_time
+    )
+    # 会员等级取较高的那个
+    return max(vip_level, old_level), new_lyrics_limit, new_music_limit, new_expire
+
+
+def membership_info(email, member_row, vip_name, current_time):
+    """
+    把会员查询结果整理成会员状态接口返回的member字段（同步版和异步版共用）
+
+    member_row顺序同 login_member_info，剩余次数同样扣掉预留中的次数
+    """
+    (vip_level, expire_time, lyrics_limit, lyrics_used, music_limit, music_used,
+     lyrics_reserved, music_reserved) = member_row
+    return {
+        'email': email,
+        'vip_level': vip_level,
+        'vip_name': vip_name,
+        'expire_time': format_time(expire_time),
+        'remaining_days': remaining_days(expire_time, current_time, round_up=True),
+        'lyrics_remaining': max(0, lyrics_limit - lyrics_used - lyrics_reserved),
+        'music_remaining': max(0, music_limit - music_used - music_reserved),
+        'lyrics_used': lyrics_used,
+        'lyrics_limit': lyrics_limit,
+        'music_used': music_used,
+        'music_limit': music_limit
+    }
+
+
+def usage_type_error(usage_type):
+    """使用类型检查"""
+    if usage_type not in USAGE_TYPES:
+        return '使用类型必须是lyrics或music'
+    return None
+
+
+# 登录/会员状态查询按邮箱查用户（services.find_user，连接预热时也执行一遍）
+USER_LOOKUP_SQL = """
+    SELECT id, password_hash, salt
+    FROM users WHERE email = %s
+"""
+
+# 用户当前有效的会员记录（services.find_active_member，连接预热时也执行一遍）
+ACTIVE_MEMBER_SQL = """
+    SELECT
+        m.vip_level,            -- 会员等级
+        m.expire_time,          -- 过期时间
+        m.total_lyrics_limit,   -- 总歌词次数
+        m.lyrics_used,          -- 已用歌词次数
+        m.total_music_limit,    -- 总音乐次数
+        m.music_used,           -- 已用音乐次数
+        COALESCE(m.lyrics_reserved, 0),  -- 预留中的歌词次数
+        COALESCE(m.music_reserved, 0)    -- 预留中的音乐次数
+    FROM members m
+    WHERE m.user_id = %s
+      AND m.is_active AND m.expire_time > %s
+    ORDER BY m.expire_time DESC
+    LIMIT 1
+"""
+
+
+# 记录一次使用：在数据库里原子地 +1，同时检查（已用 + 已预留 + 1）不超过总次数；
+# 次数不够时不更新、不返回行。{type} 只能是 USAGE_TYPES 里的值
+USAGE_INCREMENT_SQL = """
+    UPDATE members SET {type}_used = {type}_used + 1
+    WHERE id = %s
+      AND {type}_used + COALESCE({type}_reserved, 0) + 1 <= total_{type}_limit
+    RETURNING {type}_used, total_{type}_limit, COALESCE({type}_reserved, 0)
+"""
+
+
+def quota_error(usage_type, used, limit, count=1):
+    """次数检查，用完了（或不够扣count次）返回错误描述"""
+    type_name = '歌词' if usage_type == 'lyrics' else '音乐'
+    if used >= limit:
+        return f'{type_name}生成次数已用完（{limit}次）'
+    if used + count > limit:
+        return f'{type_name}剩余次数不足（剩余{limit - used}次，需要{count}次）'
+    return None
+
+
+# ======================= 游标分页 =======================
+
+def encode_cursor(values):
+    """排序键 → 游标字符串（时间用带微秒的isoformat，翻页时要精确比较）"""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    """游标字符串 → 排序键列表；不合法时抛 ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('cursor不合法')
+    if not isinstance(values, list):
+        raise ValueError('cursor不合法')
+    return values
+
+
+def decode_time_cursor(cursor):
+    """(时间, id) 形式的游标 → (datetime, id)；不合法时抛 ValueError"""
+    values = decode_cursor(cursor)
+    try:
+        time_text, row_id = values
+        if not isinstance(row_id, int):
+            raise ValueError
+        return datetime.fromisoformat(time_text), row_id
+    except (ValueError, TypeError):
+        raise ValueError('cursor不合法')
@@ -0,0 +1,1004 @@
+"""
+业务服务层 - 注册、登录、卡密、会员、使用次数
+文件名：services.py
+
+这里的类不依赖Flask：参数是普通的Python值，返回ServiceResult。
+HTTP接口（auth.py / vip.py）只负责读request和返回JSON，
+批量任务、后台worker、性能测试可以直接调用这里，不需要Flask请求上下文。
+
+用法：
+    from services import auth_service, vip_service
+
+    result = vip_service.check_membership('123456789@qq.com')
+    if result.success:
+        print(result.data['member'])
+"""
+
+import os
+import secrets
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from psycopg2 import errors
+from psycopg2.extras import execute_values
+
+import cardkey
+import rules
+import session_token
+from admission import Overloaded
+from bloom import negative_cache
+from cache_backend import cache, RateLimiter
+from database import Database
+from singleflight import SingleFlight
+from tiers import tier_catalog
+
+
+@dataclass
+class ServiceResult:
+    """服务调用结果 - 对应接口返回的JSON"""
+    success: bool
+    message: str = ''
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def ok(cls, message: str = '', **data) -> 'ServiceResult':
+        return cls(True, message, data)
+
+    @classmethod
+    def fail(cls, message: str, **data) -> 'ServiceResult':
+        return cls(False, message, data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换成接口返回的字典格式"""
+        result = {'success': self.success}
+        if self.message:
+            result['message'] = self.message
+        result.update(self.data)
+        return result
+
+
+# 登录失败限流：同一个IP对同一个邮箱10分钟内失败10次就暂时不让这个IP登录这个邮箱
+# （防暴力猜密码/验证密钥）。按 IP+邮箱 计数：别人在自己的IP上猜错再多次，
+# 也锁不住账号主人；只有密码/验证密钥错误才算失败，"新设备需要验证密钥"不算。
+# 计数放在共享缓存里，多个worker进程、同步版和异步版一起算
+login_limiter = RateLimiter(
+    cache, 'login',
+    limit=int(os.getenv('LOGIN_MAX_FAILURES', '10')),
+    window=int(os.getenv('LOGIN_FAILURE_WINDOW', '600'))
+)
+
+# 激活失败限流：同一个IP 10分钟内输了10次不存在的卡密就暂时不让这个IP激活（防暴力猜卡密）
+# 按IP计数：猜卡密的人可以换邮箱，但不能让别人的邮箱被锁；卡密已使用/已冻结等不算失败
+activate_limiter = RateLimiter(
+    cache, 'activate',
+    limit=int(os.getenv('ACTIVATE_MAX_FAILURES', '10')),
+    window=int(os.getenv('ACTIVATE_FAILURE_WINDOW', '600'))
+)
+
+# 同一时刻的相同查询只查一次数据库（singleflight.py）
+user_lookups = SingleFlight('用户查询')
+member_lookups = SingleFlight('会员查询')
+
+
+def forget_lookups(email):
+    """用户刚写过数据（db.note_write）：进行中的合并查询作废，之后来的请求读得到刚写的数据"""
+    for consistent in (False, True):
+        user_lookups.forget((email, consistent))
+        member_lookups.forget((email, consistent))
+
+
+def find_user(database: Database, email: str, consistent: bool = False):
+    """
+    按邮箱查 (id, password_hash, salt)，登录和会员状态查询共用
+
+    从库上查不到时再问一次主库（刚注册的用户可能还没同步过去）
+    """
+    def query():
+        for primary in ((True,) if consistent or not database.replicas else (False, True)):
+            with database.read_connection(email, primary=primary) as conn, conn.cursor() as cursor:
+                cursor.execute(rules.USER_LOOKUP_SQL, (email,))
+                user = cursor.fetchone()
+            if user:
+                return user
+        return None
+
+    return user_lookups.do((email, consistent), query)
+
+
+def find_active_member(database: Database, user_id: int, email: str, consistent: bool = False):
+    """
+    查用户当前有效的会员记录，登录和会员状态查询共用
+
+    返回 (vip_level, expire_time, total_lyrics_limit, lyrics_used, total_music_limit, music_used,
+    lyrics_reserved, music_reserved)，不是会员时返回None
+    """
+    def query():
+        with database.read_connection(email, primary=consistent) as conn, conn.cursor() as cursor:
+            cursor.execute(rules.ACTIVE_MEMBER_SQL, (user_id, datetime.now()))
+            return cursor.fetchone()
+
+    return member_lookups.do((email, consistent), query)
+
+
+class AuthService:
+    """用户认证服务 - 注册和登录"""
+
+    def __init__(self, database: Database):
+        self.db = database
+
+    def register(self, email: str, password: str) -> ServiceResult:
+        """注册新用户"""
+        # 1. 验证邮箱和密码格式（QQ邮箱；密码至少8位，含1个字母和5个数字）
+        error = rules.validate_register(email, password)
+        if error:
+            print(f"❌ 注册信息不合格: {error}")
+            return ServiceResult.fail(error)
+
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                # 2. 检查邮箱是否已注册（写接口不走布隆过滤器，总是查一次；
+                #    两个请求同时注册同一个邮箱时，INSERT的UNIQUE约束兜底）
+                print(f"🔍 检查邮箱是否已注册: {email}")
+                cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+                existing_user = cursor.fetchone()
+
+                if existing_user:
+                    print(f"❌ 邮箱已注册: ID={existing_user[0]}")
+                    return ServiceResult.fail('该邮箱已注册')
+
+                # 3. 密码加密（加盐哈希），生成6位验证密钥
+                password_hash, salt = rules.hash_password(password)
+                verification_key = rules.generate_verification_key()
+
+                # 4. 保存用户到数据库
+                current_time = datetime.now()
+                cursor.execute("""
+                    INSERT INTO users (
+                        email, password_hash, salt,
+                        verification_key, created_at
+                    ) VALUES (%s, %s, %s, %s, %s)
+                    RETURNING id
+                """, (email, password_hash, salt, verification_key, current_time))
+
+                # 获取刚插入的用户的ID
+                user_id = cursor.fetchone()[0]
+                conn.commit()
+                negative_cache.add_email(email)
+                self.db.note_write(email)
+
+                print(f"🎉 用户注册成功: ID={user_id}, 邮箱={email}")
+
+                # 5. 记录系统日志
+                try:
+                    cursor.execute("""
+                        INSERT INTO system_logs (
+                            level, module, action,
+                            details, created_at
+                        ) VALUES (%s, %s, %s, %s, %s)
+                    """, ('INFO', 'auth', 'register',
+                          f'用户注册成功: {email}', current_time))
+                    conn.commit()
+                except Exception as log_error:
+                    conn.rollback()
+                    print(f"⚠️ 记录日志失败（不影响注册）: {log_error}")
+
+                return ServiceResult.ok(
+                    '注册成功！请务必记下验证密钥，后续换设备登录需要它。',
+                    verification_key=verification_key,
+                    user_id=user_id,
+                    email=email,
+                    created_at=rules.format_time(current_time)
+                )
+
+        except errors.UniqueViolation:
+            return ServiceResult.fail('该邮箱已注册')
+
+        except Overloaded:
+            # 过载/过了截止时间：交给准入控制返回503（admission.py），不要变成普通的失败结果
+            raise
+
+        except Exception as e:
+            print(f"❌ 注册失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return ServiceResult.fail(f'注册失败: {str(e)}')
+
+    def login(self, email: str, password: str,
+              verification_key: str = '', hardware_id: str = '') -> ServiceResult:
+        """用户登录（含设备绑定检查）"""
+        if not email or not password:
+            print("❌ 邮箱或密码为空")
+            return ServiceResult.fail('邮箱和密码不能为空')
+
+        try:
+            # 1. 查询用户信息（只读，走从库；登录失败的请求完全不碰主库）
+            print(f"🔍 查询用户: {email}")
+            user = find_user(self.db, email)
+
+            # 2. 检查用户是否存在
+            if not user:
+                print(f"❌ 用户不存在: {email}")
+                # 为了防止恶意攻击，这里稍微延迟一下
+                time.sleep(rules.USER_NOT_FOUND_DELAY)
+                return ServiceResult.fail(rules.WRONG_PASSWORD)
+
+            user_id, stored_hash, stored_salt = user
+            print(f"✅ 找到用户: ID={user_id}")
+
+            # 3. 验证密码（使用盐值）
+            input_hash, _ = rules.hash_password(password, stored_salt)
+            if input_hash != stored_hash:
+                print(f"❌ 密码错误")
+                time.sleep(rules.WRONG_PASSWORD_DELAY)  # 增加延迟，防止暴力破解
+                return ServiceResult.fail(rules.WRONG_PASSWORD)
+
+            # 4. 获取会员信息（如果有；和同时到达的会员状态查询共用一次查询）
+            member_info = find_active_member(self.db, user_id, email)
+
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                # 5. 检查硬件ID绑定
+                # 规则：首次登录直接绑定；同设备直接通过；新设备需要验证密钥
+                # 绑定信息在主库上加锁读取：从库可能还没同步到刚换绑的设备，
+                # 两台设备同时首次登录时也只有一台能绑定成功
+                cursor.execute("""
+                    SELECT verification_key, hardware_id
+                    FROM users WHERE id = %s
+                    FOR UPDATE
+                """, (user_id,))
+                stored_key, stored_hardware_id = cursor.fetchone()
+
+                device_error, bind_hardware_id = rules.check_device(
+                    stored_hardware_id, stored_key, hardware_id, verification_key
+                )
+                if device_error:
+                    conn.rollback()
+                    print(f"❌ 设备验证失败: {device_error}")
+                    return ServiceResult.fail(device_error)
+
+                current_time = datetime.now()
+                if bind_hardware_id:
+                    cursor.execute("""
+                        UPDATE users SET hardware_id = %s WHERE id = %s
+                    """, (hardware_id, user_id))
+                    print(f"💾 保存硬件ID: {hardware_id}")
+
+                # 6. 更新最后登录时间
+                cursor.execute("""
+                    UPDATE users SET last_login = %s WHERE id = %s
+                """, (current_time, user_id))
+
+                conn.commit()
+
+                # 7. 记录登录日志
+                try:
+                    log_details = f"用户登录成功: {email}"
+                    if hardware_id:
+                        log_details += f", 硬件ID: {hardware_id}"
+
+                    cursor.execute("""
+                        INSERT INTO system_logs (
+                            level, module, action,
+                            details, created_at
+                        ) VALUES (%s, %s, %s, %s, %s)
+                    """, ('INFO', 'auth', 'login', log_details, current_time))
+                    conn.commit()
+                except Exception as log_error:
+                    conn.rollback()
+                    print(f"⚠️ 记录日志失败（不影响登录）: {log_error}")
+
+                print(f"🎉 登录成功: ID={user_id}, 是会员={bool(member_info)}")
+
+                # 8. 准备返回数据
+                data = {
+                    'user': {
+                        'id': user_id,
+                        'email': email,
+                        'is_member': bool(member_info),
+                        'last_login': rules.format_time(current_time)
+                    }
+                }
+                if member_info:
+                    data['member'] = rules.login_member_info(member_info, current_time)
+
+                # 9. 签发会话令牌：之后的VIP接口带上它，就不用再按邮箱查用户
+                token, token_expires = session_token.issue(
+                    user_id, email, hardware_id, member_info[0] if member_info else 0
+                )
+                data['token'] = token
+                data['token_expires'] = rules.format_time(datetime.fromtimestamp(token_expires))
+
+                return ServiceResult.ok('登录成功', **data)
+
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 登录失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return ServiceResult.fail(f'登录失败: {str(e)}')
+
+
+class VIPService:
+    """VIP服务 - 卡密生成/激活、会员查询、使用次数"""
+
+    def __init__(self, database: Database):
+        self.db = database
+        # 用户ID → 最后检查时间，等待 flush_last_checks 批量写回
+        self._pending_checks = {}
+
+    def generate_card_keys(self, vip_level: int = 2, quantity: int = 1,
+                           batch_id: Optional[str] = None) -> ServiceResult:
+        """
+        批量生成VIP卡密
+
+        卡密格式：VIP-XXXX-XXXX-XXXX-XXXX
+        卡密由cardkey.py从加密随机数批量生成，写库用一条多行INSERT，
+        重复的卡密（概率极低，见cardkey.py）由UNIQUE约束挡住后只重新生成那几张。
+        配置了CARD_KEY_SECRET时最后一段是签名段，输错、乱猜的卡密激活时在本地就能挡掉。
+        同一次生成的卡密记同一个批次号（batch_id），之后可以按批次冻结/作废（card_jobs.py）。
+        """
+        # 当前的等级目录快照（内存，不查库）
+        tier = tier_catalog.current.get(vip_level)
+        if tier is None:
+            levels = '、'.join(str(level) for level in tier_catalog.current.tiers)
+            return ServiceResult.fail(f'无效的会员等级：{vip_level}（有效等级：{levels}）')
+
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            return ServiceResult.fail('生成数量必须是正整数')
+
+        # 没指定批次号就按生成时间自动取一个
+        batch_id = batch_id or f"{datetime.now():%Y%m%d%H%M%S}-{secrets.token_hex(2).upper()}"
+        if not isinstance(batch_id, str) or len(batch_id) > 64:
+            return ServiceResult.fail('批次号必须是不超过64个字符的字符串')
+
+        print(f"🎫 开始生成卡密：等级={vip_level}，数量={quantity}，批次={batch_id}")
+
+        created = []
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                current_time = datetime.now()
+                missing = quantity
+
+                while missing > 0:
+                    rows = [
+                        (card_key, vip_level, tier.days, tier.lyrics,
+                         tier.music, '未激活', current_time, batch_id)
+                        for card_key in self._new_card_keys(missing)
+                    ]
+                    inserted = execute_values(cursor, """
+                        INSERT INTO vip_keys
+                        (card_key, vip_level, days, lyrics_limit, music_limit, status, created_at, batch_id)
+                        VALUES %s
+                        ON CONFLICT (card_key) DO NOTHING
+                        RETURNING card_key
+                    """, rows, page_size=1000, fetch=True)
+
+                    created.extend(row[0] for row in inserted)
+                    missing = quantity - len(created)
+                    if missing > 0:
+                        print(f"⚠️  {missing}张卡密重复，重新生成...")
+
+                conn.commit()
+                negative_cache.add_card_keys(created)
+
+            generated_keys = [{
+                'key': card_key,
+                'level': tier.name,
+                'days': tier.days,
+                'lyrics': tier.lyrics,
+                'music': tier.music
+            } for card_key in created]
+
+            print(f"🎉 成功生成 {len(generated_keys)} 张卡密！")
+            return ServiceResult.ok(f'成功生成 {quantity} 张卡密', batch_id=batch_id, keys=generated_keys)
+
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 生成卡密时出错：{e}")
+            return ServiceResult.fail(f'生成卡密失败：{str(e)}')
+
+    @staticmethod
+    def _new_card_keys(quantity):
+        if cardkey.CARD_KEY_SECRET:
+            return cardkey.generate_signed_keys(quantity)
+        return cardkey.generate_keys(quantity)
+
+    def activate_card(self, card_key: str, email: str, hardware_id: str = '') -> ServiceResult:
+        """用卡密开通/续费会员"""
+        if not card_key or not email:
+            return ServiceResult.fail('请提供卡密和邮箱')
+
+        # 本地预检：格式不对、签名不对的卡密不去查数据库
+        card_key = card_key.upper()
+        precheck_error = cardkey.precheck(card_key)
+        if precheck_error:
+            print(f"🚫 卡密预检未通过：{card_key}")
+            return ServiceResult.fail(precheck_error)
+
+        # 布隆过滤器：卡密/用户肯定不存在时不查数据库
+        if negative_cache.card_key_missing(card_key):
+            return ServiceResult.fail(cardkey.NOT_FOUND)
+        if negative_cache.email_missing(email):
+            return ServiceResult.fail('用户不存在，请先注册')
+
+        print(f"🔑 用户 {email} 尝试激活卡密：{card_key}")
+
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                # 1. 查询卡密信息（锁住这一行：同时进行的批量冻结/作废要等激活提交后再判断状态）
+                cursor.execute("""
+                    SELECT id, vip_level, days, lyrics_limit, music_limit, status, activated_by
+                    FROM vip_keys WHERE card_key = %s
+                    FOR UPDATE
+                """, (card_key,))
+                key_info = cursor.fetchone()
+
+                if not key_info:
+                    return ServiceResult.fail(cardkey.NOT_FOUND)
+
+                key_id, vip_level, days, lyrics_limit, music_limit, status, activated_by = key_info
+
+                # 2. 检查卡密状态
+                status_error = rules.card_status_error(status, activated_by)
+                if status_error:
+                    return ServiceResult.fail(status_error)
+
+                # 3. 查询用户是否存在
+                cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+                user = cursor.fetchone()
+                if not user:
+                    return ServiceResult.fail('用户不存在，请先注册')
+
+                user_id = user[0]
+
+                # 4. 检查用户是否已有会员
+                current_time = datetime.now()
+                cursor.execute("""
+                    SELECT id, vip_level, lyrics_used, music_used,
+                           total_lyrics_limit, total_music_limit, expire_time
+                    FROM members WHERE user_id = %s AND is_active AND expire_time > %s
+                    FOR UPDATE
+                """, (user_id, current_time))
+                existing_member = cursor.fetchone()
+
+                # 新的等级/次数/有效期（规则在rules.py，和异步版共用）
+                new_vip_level, new_lyrics_limit, new_music_limit, new_expire = rules.activation_update(
+                    existing_member, vip_level, days, lyrics_limit, music_limit, current_time
+                )
+
+                if existing_member:
+                    # 老会员：叠加次数和延长有效期
+                    cursor.execute("""
+                        UPDATE members SET
+                            vip_level = %s,
+                            total_lyrics_limit = %s,
+                            total_music_limit = %s,
+                            expire_time = %s
+                        WHERE id = %s
+                    """, (new_vip_level, new_lyrics_limit, new_music_limit, new_expire, existing_member[0]))
+                    print(f"👤 老会员续费：新有效期至：{new_expire}")
+
+                else:
+                    # 新会员：创建新的会员记录
+                    cursor.execute("""
+                        INSERT INTO members
+                        (user_id, email, vip_level, total_lyrics_limit, total_music_limit,
+                         lyrics_used, music_used, expire_time, activate_time)
+                        VALUES (%s, %s, %s, %s, %s, 0, 0, %s, %s)
+                    """, (user_id, email, vip_level, lyrics_limit, music_limit, new_expire, current_time))
+                    print(f"👤 新会员激活：有效期{days}天，至{new_expire}")
+
+                # 5. 更新卡密状态
+                cursor.execute("""
+                    UPDATE vip_keys SET
+                        status = '已激活',
+                        activated_by = %s,
+                        activated_time = %s,
+                        expire_time = %s
+                    WHERE id = %s
+                """, (email, current_time, new_expire, key_id))
+
+                conn.commit()
+                self.db.note_write(email)
+
+            print(f"🎉 卡密激活成功！用户：{email}，有效期至：{new_expire}")
+            return ServiceResult.ok('🎉 激活成功！', member={
+                'email': email,
+                'vip_level': vip_level,
+                'vip_name': tier_catalog.current.name(vip_level),
+                'expire_time': rules.format_time(new_expire),
+                'lyrics_added': lyrics_limit,
+                'music_added': music_limit,
+                'days_added': days
+            })
+
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 激活卡密时出错：{e}")
+            return ServiceResult.fail(f'激活失败：{str(e)}')
+
+    def check_membership(self, email: str, consistent: bool = False,
+                         user_id: Optional[int] = None) -> ServiceResult:
+        """
+        查询会员状态（只读，走从库）
+
+        consistent=True：强制走主库，保证读到刚激活/刚扣的次数
+        user_id：会话令牌里已经校验过的用户ID，省掉按邮箱查用户
+        """
+        if not email:
+            return ServiceResult.fail('请提供邮箱地址')
+
+        print(f"🔍 检查用户会员状态：{email}")
+
+        if user_id is None and negative_cache.email_missing(email):
+            return ServiceResult.fail('用户不存在')
+
+        try:
+            # 1. 查询用户ID（和同时到达的登录/查询请求共用一次查询）
+            if user_id is None:
+                user = find_user(self.db, email, consistent)
+                if not user:
+                    return ServiceResult.fail('用户不存在')
+
+                user_id = user[0]
+
+            # 2. 查询会员信息
+            current_time = datetime.now()
+            member = find_active_member(self.db, user_id, email, consistent)
+
+            if not member:
+                print(f"❌ 用户 {email} 不是会员或会员已过期")
+                return ServiceResult.ok('您不是会员或会员已过期', is_member=False)
+
+            vip_level, expire_time = member[0], member[1]
+
+            # 3. 检查会员是否已过期（再次确认）
+            if isinstance(expire_time, str):
+                expire_time = datetime.fromisoformat(expire_time.replace(' ', 'T'))
+                member = (vip_level, expire_time) + tuple(member[2:])
+
+            if expire_time < current_time:
+                print(f"⚠️  用户 {email} 的会员已过期")
+                return ServiceResult.ok('您的会员已过期', is_member=False)
+
+            # 4. 记下最后检查时间，由后台任务批量写回主库（查询本身不再写库）
+            self.note_check(user_id, current_time)
+
+            print(f"✅ 用户 {email} 是会员，等级：{vip_level}，过期时间：{expire_time}")
+            return ServiceResult.ok(is_member=True, member=rules.membership_info(
+                email, member, tier_catalog.current.name(vip_level), current_time
+            ))
+
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 检查会员状态时出错：{e}")
+            import traceback
+            traceback.print_exc()
+            return ServiceResult.fail(f'查询失败：{str(e)}')
+
+    def record_usage(self, email: str, usage_type: str = 'lyrics',
+                     user_id: Optional[int] = None) -> ServiceResult:
+        """
+        记录一次歌词/音乐生成，扣除一次次数
+
+        user_id：会话令牌里已经校验过的用户ID，直接查会员表，不再关联users表
+        """
+        if not email:
+            return ServiceResult.fail('请提供邮箱地址')
+
+        type_error = rules.usage_type_error(usage_type)
+        if type_error:
+            return ServiceResult.fail(type_error)
+
+        print(f"📝 记录使用：用户={email}，类型={usage_type}")
+
+        if user_id is None and negative_cache.email_missing(email):
+            return ServiceResult.fail('用户不存在')
+
+        try:
+            with self.db.connection() as conn, conn.cursor() as cursor:
+                # 1. 查询用户和会员信息
+                current_time = datetime.now()
+                if user_id is None:
+                    cursor.execute("""
+                        SELECT u.id,
+                               m.id AS member_id,
+                               m.lyrics_used, m.total_lyrics_limit,
+                               m.music_used, m.total_music_limit,
+                               COALESCE(m.lyrics_reserved, 0), COALESCE(m.music_reserved, 0)
+                        FROM users u
+                        LEFT JOIN members m ON u.id = m.user_id
+                            AND m.is_active AND m.expire_time > %s
+                        WHERE u.email = %s
+                    """, (current_time, email))
+                    result = cursor.fetchone()
+
+                    if not result:
+                        return ServiceResult.fail('用户不存在')
+                else:
+                    cursor.execute("""
+                        SELECT m.user_id,
+                               m.id AS member_id,
+                               m.lyrics_used, m.total_lyrics_limit,
+                               m.music_used, m.total_music_limit,
+                               COALESCE(m.lyrics_reserved, 0), COALESCE(m.music_reserved, 0)
+                        FROM members m
+                        WHERE m.user_id = %s
+                          AND m.is_active AND m.expire_time > %s
+                        ORDER BY m.expire_time DESC
+                        LIMIT 1
+                    """, (user_id, current_time))
+                    # 没有有效会员时按"不是会员"处理
+                    result = cursor.fetchone() or (user_id, None, 0, 0, 0, 0, 0, 0)
+
+                (user_id, member_id, lyrics_used, total_lyrics_limit,
+                 music_used, total_music_limit, lyrics_reserved, music_reserved) = result
+
+                # 2. 检查是否是会员
+                if not member_id:
+                    return ServiceResult.fail('您不是会员，请先激活会员')
+
+                # 3. 检查次数是否用完（已被预留的次数也不能再用）
+                if usage_type == 'lyrics':
+                    used, limit, reserved = lyrics_used, total_lyrics_limit, lyrics_reserved
+                else:
+                    used, limit, reserved = music_used, total_music_limit, music_reserved
+
+                quota_message = rules.quota_error(usage_type, used + reserved, limit)
+                if quota_message:
+                    return ServiceResult.fail(quota_message)
+
+                # 4. 增加已用次数：一条带条件的原子UPDATE，在数据库里 +1 并检查次数，
+                #    和同时进行的单条/批量记录、预留结算不会互相覆盖
+                #    （列名来自固定白名单USAGE_TYPES，可以安全拼接）
+                cursor.execute(rules.USAGE_INCREMENT_SQL.format(type=usage_type), (member_id,))
+                updated = cursor.fetchone()
+                if not updated:
+                    # 上面检查之后，次数被并发的请求用完了
+                    conn.rollback()
+                    return ServiceResult.fail(rules.quota_error(usage_type, limit, limit))
+                used, limit, reserved = updated
+
+                # 5. 记录使用日志
+                cursor.execute("""
+                    INSERT INTO usage_logs
+                    (user_id, email, action_type, action_time)
+                    VALUES (%s, %s, %s, %s)
+                """, (user_id, email, usage_type, current_time))
+
+                conn.commit()
+                self.db.note_write(email)
+
+            remaining = limit - used - reserved
+            print(f"✅ 使用记录成功！剩余次数：{remaining}")
+            return ServiceResult.ok('使用记录成功', remaining=remaining, usage_type=usage_type)
+
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 记录使用次数时出错：{e}")
+            return ServiceResult.fail(f'记录失败：{str(e)}')
+
+    # 批量记录最多允许的条目数（防止一个请求锁住太多会员行）
+    MAX_BATCH_SIZE = 1000
+
+    def record_usage_batch(self, entries: List[Dict[str, Any]]) -> ServiceResult:
+        """
+        批量记录使用次数 - 给生成worker一次结算一整批任务
+
+        entries: [{'email': ..., 'type': 'lyrics'/'music', 'count': 1}, ...]
+
+        整批在一个事务里完成：
+        1. 一次查询锁住涉及的会员行（FOR UPDATE，防止并发超扣）
+        2. 在内存里按顺序逐条检查次数（同一个用户的多条会累加）
+        3. 一条UPDATE ... FROM (VALUES ...) 批量更新已用次数
+        4. 一条多行INSERT写入使用日志
+
+        每条的结果单独返回，次数不够的条目不扣次数，也不影响其他条目。
+        """
+        if not entries:
+            return ServiceResult.fail('请提供要记录的使用条目')
+
+        if len(entries) > self.MAX_BATCH_SIZE:
+            return ServiceResult.fail(f'一次最多记录{self.MAX_BATCH_SIZE}条')
+
+        # 1. 先做不需要数据库的检查
+        results = []
+        valid = []
+        for index, entry in enumerate(entries):
+            if not isinstance(entry, dict):
+                entry = {}
+            email = str(entry.get('email', '')).strip()
+            usage_type = entry.get('type', 'lyrics')
+            count = entry.get('count', 1)
+
+            item = {'index': index, 'email': email, 'type': usage_type, 'count': count}
+            results.append(item)
+
+            if not email:
+                item.update(success=False, message='请提供邮箱地址')
+                continue
+
+            type_error = rules.usage_type_error(usage_type)
+            if type_error:
+                item.update(success=False, message=type_error)
+                continue
+
+            if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+                item.update(success=False, message='count必须是正整数')
+                continue
+
+            if negative_cache.email_missing(email):
+                item.update(success=False, message='用户不存在')
+                continue
+
+            valid.append(item)
+
+        print(f"📝 批量记录使用：共{len(entries)}条，格式有效{len(valid)}条")
+
+        if valid:
+            try:
+                with self.db.connection() as conn, conn.cursor() as cursor:
+                    current_time = datetime.now()
+                    emails = list({item['email'] for item in valid})
+
+                    # 2. 查询用户ID
+                    cursor.execute(
+                        "SELECT email, id FROM users WHERE email = ANY(%s)", (emails,)
+                    )
+                    user_ids = dict(cursor.fetchall())
+
+                    # 3. 每个用户取过期时间最晚的一条有效会员，按id顺序加锁：
+                    #    两批同时处理有重叠的用户时，加锁顺序一致，不会互相死锁
+                    members = {}
+                    if user_ids:
+                        cursor.execute("""
+                            SELECT user_id, id, lyrics_used, total_lyrics_limit,
+                                   music_used, total_music_limit,
+                                   COALESCE(lyrics_reserved, 0), COALESCE(music_reserved, 0)
+                            FROM members
+                            WHERE id IN (
+                                SELECT DISTINCT ON (user_id) id FROM members
+                                WHERE user_id = ANY(%s) AND is_active AND expire_time > %s
+                                ORDER BY user_id, expire_time DESC
+                            )
+                            ORDER BY id
+                            FOR UPDATE
+                        """, (list(user_ids.values()), current_time))
+                        for (user_id, member_id, lyrics_used, lyrics_limit, music_used, music_limit,
+                             lyrics_reserved, music_reserved) in cursor.fetchall():
+                            # 已被预留的次数算作已用，防止和预留接口一起超扣
+                            members[user_id] = {
+                                'id': member_id,
+                                'lyrics_used': lyrics_used + lyrics_reserved, 'lyrics_limit': lyrics_limit,
+                                'music_used': music_used + music_reserved, 'music_limit': music_limit,
+                                'lyrics_added': 0, 'music_added': 0
+                            }
+
+                    # 4. 按顺序逐条扣次数（只在内存里算）
+                    log_rows = []
+                    for item in valid:
+                        user_id = user_ids.get(item['email'])
+                        if user_id is None:
+                            item.update(success=False, message='用户不存在')
+                            continue
+
+                        member = members.get(user_id)
+                        if member is None:
+                            item.update(success=False, message='您不是会员，请先激活会员')
+                            continue
+
+                        usage_type, count = item['type'], item['count']
+                        used = member[f'{usage_type}_used'] + member[f'{usage_type}_added']
+                        limit = member[f'{usage_type}_limit']
+
+                        quota_message = rules.quota_error(usage_type, used, limit, count)
+                        if quota_message:
+                            item.update(success=False, message=quota_message)
+                            continue
+
+                        member[f'{usage_type}_added'] += count
+                        item.update(success=True, message='使用记录成功',
+                                    remaining=limit - (used + count))
+
+                        # 每次使用一条日志，和单条接口保持一致
+                        log_rows.extend(
+                            [(user_id, item['email'], usage_type, current_time)] * count
+                        )
+
+                    # 5. 一条UPDATE批量更新所有会员的已用次数
+                    changed = [
+                        (m['id'], m['lyrics_added'], m['music_added'])
+                        for m in members.values()
+                        if m['lyrics_added'] or m['music_added']
+                    ]
+                    if changed:
+                        execute_values(cursor, """
+                            UPDATE members AS m SET
+                                lyrics_used = m.lyrics_used + v.lyrics_added,
+                                music_used = m.music_used + v.music_added
+                            FROM (VALUES %s) AS v(id, lyrics_added, music_added)
+                            WHERE m.id = v.id
+                        """, changed, page_size=len(changed))
+
+                    # 6. 一条多行INSERT写入使用日志
+                    if log_rows:
+                        execute_values(cursor, """
+                            INSERT INTO usage_logs
+                            (user_id, email, action_type, action_time)
+                            VALUES %s
+                        """, log_rows, page_size=len(log_rows))
+
+                    conn.commit()
+                    for item in results:
+                        if item.get('success'):
+                            self.db.note_write(item['email'])
+
+            except Overloaded:
+                raise
+
+            except Exception as e:
+                print(f"❌ 批量记录使用次数时出错：{e}")
+                return ServiceResult.fail(f'批量记录失败：{str(e)}')
+
+        succeeded = sum(1 for item in results if item.get('success'))
+        print(f"✅ 批量记录完成：成功{succeeded}条，失败{len(results) - succeeded}条")
+
+        return ServiceResult.ok(
+            f'批量记录完成：成功{succeeded}条，失败{len(results) - succeeded}条',
+            succeeded=succeeded,
+            failed=len(results) - succeeded,
+            results=results
+        )
+
+    # 使用记录每页默认/最多条数
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 200
+
+    def usage_history(self, email: str, usage_type: Optional[str] = None,
+                      limit: Optional[int] = None, cursor: Optional[str] = None,
+                      user_id: Optional[int] = None, consistent: bool = False) -> ServiceResult:
+        """
+        用户的使用记录（最新的在前，只读，走从库）
+
+        游标分页：cursor 是上一页最后一条的 (时间, id)，下一页直接从索引
+        (user_id, action_time DESC, id DESC) 的那个位置往后读，
+        不管用户有多少条记录、翻到第几页，每页都只读 limit+1 行
+        """
+        if not email:
+            return ServiceResult.fail('请提供邮箱地址')
+
+        if usage_type:
+            type_error = rules.usage_type_error(usage_type)
+            if type_error:
+                return ServiceResult.fail(type_error)
+
+        if limit is None:
+            limit = self.HISTORY_PAGE_SIZE
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            return ServiceResult.fail('limit必须是正整数')
+        limit = min(limit, self.HISTORY_MAX_PAGE_SIZE)
+
+        try:
+            after = rules.decode_time_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return ServiceResult.fail(str(e))
+
+        if user_id is None and negative_cache.email_missing(email):
+            return ServiceResult.fail('用户不存在')
+
+        try:
+            if user_id is None:
+                user = find_user(self.db, email, consistent)
+                if not user:
+                    return ServiceResult.fail('用户不存在')
+                user_id = user[0]
+
+            conditions, params = ["user_id = %s"], [user_id]
+            if usage_type:
+                conditions.append("action_type = %s")
+                params.append(usage_type)
+            if after:
+                # 行比较：比上一页最后一条更早的（同一时刻的按id往前）
+                conditions.append("(action_time, id) < (%s, %s)")
+                params.extend(after)
+            params.append(limit + 1)
+
+            with self.db.read_connection(email, primary=consistent) as conn, conn.cursor() as db_cursor:
+                db_cursor.execute(f"""
+                    SELECT id, action_type, action_time, details
+                    FROM usage_logs
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY action_time DESC, id DESC
+                    LIMIT %s
+                """, params)
+                rows = db_cursor.fetchall()
+
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            return ServiceResult.ok(
+                email=email,
+                items=[{
+                    'id': log_id,
+                    'type': action_type,
+                    'time': rules.format_time(action_time),
+                    'details': details
+                } for log_id, action_type, action_time, details in rows],
+                count=len(rows),
+                next_cursor=rules.encode_cursor([rows[-1][2], rows[-1][0]]) if has_more else None
+            )
+
+        except Overloaded:
+            raise
+
+        except Exception as e:
+            print(f"❌ 查询使用记录时出错：{e}")
+            return ServiceResult.fail(f'查询失败：{str(e)}')
+
+    def expire_members(self, batch_size: int = 500) -> List[str]:
+        """
+        把已过期的会员标记为无效（后台清理任务调用），返回本次处理的会员的邮箱
+
+        查询时仍然带着 expire_time > 当前时间，两次清理之间刚过期的会员也不会被当成有效；
+        这里只是把过期行移出部分索引，让热点查询不用再扫过期历史。
+        返回的邮箱用来作废会员状态查询的ETag（httpcache.py）。
+        """
+        with self.db.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE members AS m SET is_active = FALSE
+                FROM users AS u
+                WHERE u.id = m.user_id
+                  AND m.id IN (
+                    SELECT id FROM members
+                    WHERE is_active AND expire_time <= %s
+                    ORDER BY expire_time
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING u.email
+            """, (datetime.now(), batch_size))
+            emails = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+
+        return emails
+
+    def note_check(self, user_id: int, check_time: datetime):
+        """记下会员的最后检查时间，等 flush_last_checks 批量写回（异步版也用这个缓冲）"""
+        self._pending_checks[user_id] = check_time
+
+    def flush_last_checks(self) -> int:
+        """
+        把攒下来的会员最后检查时间一次写回主库（后台任务调用），返回更新的用户数
+
+        换字典和写入之间极少数的检查时间可能丢一次，下一次检查会补上
+        """
+        pending, self._pending_checks = self._pending_checks, {}
+        if not pending:
+            return 0
+
+        with self.db.connection() as conn, conn.cursor() as cursor:
+            execute_values(cursor, """
+                UPDATE members AS m SET last_check = v.last_check
+                FROM (VALUES %s) AS v(user_id, last_check)
+                WHERE m.user_id = v.user_id
+            """, list(pending.items()), page_size=len(pending))
+            conn.commit()
+
+        return len(pending)
+
+
+# 默认的服务实例（共用一个数据库连接池）
+db = Database()
+db.on_write(forget_lookups)
+auth_service = AuthService(db)
+vip_service = VIPService(db)
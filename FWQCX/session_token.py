@@ -0,0 +1,92 @@
+"""
+会话令牌 - 登录时签发，之后的VIP接口凭令牌识别用户，不用再按邮箱查users表
+文件名：session_token.py
+
+令牌格式：base64url(内容).base64url(签名)
+    内容：{"u": 用户ID, "e": 邮箱, "d": 设备指纹, "t": 会员等级, "x": 过期时间戳}
+    签名：HMAC-SHA256(SESSION_SECRET, 内容) 的前16个字节
+
+- 无状态：校验只做一次HMAC和一次JSON解析，不访问数据库（python benchmark.py token 实测）
+- 设备指纹：登录时硬件ID的SHA-256前16位，请求时带的 hardware_id 对不上就拒绝，
+  令牌被拷到别的机器上也用不了
+- 会员等级只是签发时的快照（客户端显示用），次数和有效期仍以数据库为准
+- 无状态令牌不能单独吊销：换绑设备、会员变化要等令牌过期（SESSION_TTL）
+
+配置（环境变量）：
+    SESSION_SECRET   签名密钥；没配置时每个进程随机生成一个（重启或多worker时令牌会失效）
+    SESSION_TTL      令牌有效秒数，默认86400（1天）
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+SESSION_SECRET = os.getenv('SESSION_SECRET', '').encode('utf-8')
+if not SESSION_SECRET:
+    SESSION_SECRET = secrets.token_bytes(32)
+    print("⚠️ 没有配置SESSION_SECRET，使用临时密钥（重启后已签发的令牌全部失效）")
+
+SESSION_TTL = int(os.getenv('SESSION_TTL', '86400'))
+
+# 签名取前16个字节（128位）
+SIGNATURE_BYTES = 16
+
+INVALID_TOKEN = '登录已失效，请重新登录'
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(body, secret=None):
+    digest = hmac.new(secret or SESSION_SECRET, body.encode('ascii'), hashlib.sha256).digest()
+    return _b64encode(digest[:SIGNATURE_BYTES])
+
+
+def device_hash(hardware_id):
+    """硬件ID → 设备指纹（不把原始硬件ID放进令牌）"""
+    if not hardware_id:
+        return ''
+    return hashlib.sha256(hardware_id.encode('utf-8')).hexdigest()[:16]
+
+
+def issue(user_id, email, hardware_id='', tier=0, now=None, secret=None):
+    """签发令牌，返回 (令牌, 过期时间戳)"""
+    expires_at = int(now if now is not None else time.time()) + SESSION_TTL
+    payload = {'u': user_id, 'e': email, 'd': device_hash(hardware_id), 't': tier, 'x': expires_at}
+    body = _b64encode(json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    return f'{body}.{_sign(body, secret)}', expires_at
+
+
+def verify(token, hardware_id='', now=None, secret=None):
+    """
+    校验令牌（纯CPU，不访问数据库）
+
+    返回 (内容, 错误描述)：通过时错误描述为None；不通过时内容为None
+    """
+    if not isinstance(token, str) or token.count('.') != 1:
+        return None, INVALID_TOKEN
+
+    body, signature = token.split('.')
+    try:
+        if not hmac.compare_digest(signature, _sign(body, secret)):
+            return None, INVALID_TOKEN
+        claims = json.loads(_b64decode(body))
+    except (ValueError, TypeError):
+        return None, INVALID_TOKEN
+
+    if claims['x'] <= (now if now is not None else time.time()):
+        return None, INVALID_TOKEN
+
+    if claims['d'] and claims['d'] != device_hash(hardware_id):
+        return None, '登录令牌与当前设备不匹配，请重新登录'
+
+    return claims, None
@@ -0,0 +1,94 @@
+"""
+请求合并（single-flight）- 同一时刻的相同查询只查一次数据库
+文件名：singleflight.py
+
+桌面客户端经常同时发 login 和 check_membership，重试逻辑还会把同一个请求发两遍，
+这些请求查的是同一个用户、同一行数据。single-flight 的做法：
+- 第一个请求（leader）真正去查数据库
+- 查询进行中又来了相同key的请求，不再自己查，等leader的结果，拿到后直接用
+- 查完立即忘掉，不是缓存：查询结束以后来的请求会重新查
+
+合并意味着跟随者拿到的是 leader 开始查询那一刻的数据：leader 开始查以后才提交的写，
+跟随者看不到。所以写完以后要调用 forget(key)（services.py 里由 db.note_write 触发）：
+进行中的那次查询作废，之后来的请求自己重新查，读得到刚写的数据。
+剩下的窗口：写已经提交、还没调用 forget 的那一瞬间加入的请求，以及不经过 note_write 的写
+（管理员直接改库），仍然可能拿到写之前的结果
+
+用法：
+    user_lookups = SingleFlight('用户查询')
+    row = user_lookups.do(email, lambda: 查数据库(email))
+
+/api/status 里可以看到每种查询一共调用多少次、实际查了多少次、合并掉多少次。
+"""
+
+import threading
+
+
+class _Call:
+    """一次进行中的查询"""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """同一个key同一时刻只执行一次，其他并发调用共享结果（或共享异常）"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats_counter = {'calls': 0, 'executed': 0, 'shared': 0}
+        FLIGHTS.append(self)
+
+    def do(self, key, func):
+        with self._lock:
+            self.stats_counter['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats_counter['shared'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.stats_counter['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            # 先移除再通知：通知之后才来的请求会自己重新查
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    def forget(self, key):
+        """这个key刚写过数据：之后来的调用不再加入进行中的查询，自己重新查"""
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counter, in_flight=len(self._calls))
+
+
+# 所有single-flight实例（/api/status 汇总用）
+FLIGHTS = []
+
+
+def flight_stats():
+    return {flight.name: flight.stats() for flight in FLIGHTS}
@@ -0,0 +1,281 @@
+"""
+SQL分析 - 每个请求执行了哪些SQL、各花了多少时间，找出N+1查询
+文件名：sqlprofile.py
+
+打开方式：环境变量 SQL_PROFILE=1（默认关闭，关闭时连游标都不换，没有任何开销）
+
+1. 数据库连接池建连接时换成 ProfilingCursor（database.py），
+   每条SQL记下：语句（数字/字符串常量换成?，多行VALUES折叠）、参数类型、返回行数、耗时
+2. 每个请求一份记录（contextvars，线程之间互不干扰），请求结束时：
+   - 响应头 Server-Timing: db;dur=12.3;desc="5 queries"，浏览器开发者工具里能直接看到
+   - 响应头 X-SQL-Profile: queries=5; ms=12.3; repeated=1
+   - 同一个请求里同一条语句执行了 SQL_N_PLUS_ONE_THRESHOLD 次以上（N+1），
+     或者参数完全相同的语句执行了不止一次（重复查询），打印明细
+3. 所有请求汇总到 sql_profiler.report()：每个接口 × 每条语句的次数、总耗时、最大耗时，
+   /api/status 和 python benchmark.py sqlprofile 里可以看到
+
+不在请求里的查询（后台任务）不记录；只记录参数的类型，不记录参数的值（不会把密码写进日志）。
+
+用法：
+    sql_profiler.init_app(app)               # Flask：每个请求自动开始/结束
+
+    with sql_profiler.scope('check_membership'):   # 不经过Flask（性能测试）
+        vip_service.check_membership(email)
+"""
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from psycopg2.extensions import cursor as _cursor
+
+SQL_PROFILE = os.getenv('SQL_PROFILE', '0') == '1'
+# 同一个请求里同一条语句执行几次算N+1
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', '3'))
+
+# 当前请求的记录（没有在记录时为None）
+_current = ContextVar('sql_profile', default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUES_LIST = re.compile(r"\((?:\s*\?\s*,)*\s*\?\s*\)(?:\s*,\s*\((?:\s*\?\s*,)*\s*\?\s*\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(query):
+    """
+    语句 → 模板：常量换成?，execute_values 展开的多行VALUES折叠成一个
+
+    %s 占位符原样保留，所以同一处代码执行的SQL得到同一个模板
+    """
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    text = _STRING_LITERAL.sub('?', query)
+    text = _NUMBER_LITERAL.sub('?', text)
+    text = _VALUES_LIST.sub('(?...)', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def param_shape(params):
+    """参数只记类型，例如 'str,int'；字典参数记成 'name:str,...'"""
+    if params is None:
+        return ''
+    if isinstance(params, dict):
+        return ','.join(f'{key}:{type(value).__name__}' for key, value in params.items())
+    if isinstance(params, (list, tuple)):
+        return ','.join(type(value).__name__ for value in params)
+    return type(params).__name__
+
+
+class RequestProfile:
+    """一个请求里执行的所有SQL"""
+
+    __slots__ = ('name', 'statements', 'problems')
+
+    def __init__(self, name):
+        self.name = name
+        self.statements = []    # (模板, 参数类型, 参数的哈希, 行数, 耗时秒)
+        self.problems = []      # 请求结束时由 repeated() 算出
+
+    def record(self, query, params, rows, elapsed):
+        try:
+            params_key = hash(repr(params))
+        except Exception:
+            params_key = None
+        self.statements.append((normalize(query), param_shape(params), params_key, rows, elapsed))
+
+    @property
+    def total_ms(self):
+        return sum(statement[4] for statement in self.statements) * 1000
+
+    def repeated(self):
+        """
+        找出问题语句，返回 [(模板, 次数, 类型)]
+
+        类型：'N+1'（同一条语句参数不同，执行了很多次）或 '重复'（参数也完全相同）
+        """
+        by_template = {}
+        for template, _, params_key, _, _ in self.statements:
+            entry = by_template.setdefault(template, [0, {}])
+            entry[0] += 1
+            entry[1][params_key] = entry[1].get(params_key, 0) + 1
+
+        problems = []
+        for template, (count, by_params) in by_template.items():
+            duplicates = max(by_params.values())
+            if duplicates > 1:
+                problems.append((template, duplicates, '重复'))
+            elif count >= SQL_N_PLUS_ONE_THRESHOLD:
+                problems.append((template, count, 'N+1'))
+        return problems
+
+
+class ProfilingCursor(_cursor):
+    """记录每条SQL的游标；当前没有在记录时和普通游标一样"""
+
+    def execute(self, query, vars=None):
+        profile = _current.get()
+        if profile is None:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            profile.record(query, vars, self.rowcount, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        profile = _current.get()
+        if profile is None:
+            return super().executemany(query, vars_list)
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            profile.record(query, None, self.rowcount, time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        profile = _current.get()
+        if profile is None:
+            return super().copy_expert(sql, file, size)
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            profile.record(sql, None, self.rowcount, time.perf_counter() - start)
+
+
+class SQLProfiler:
+    """开关 + 请求级记录 + 全局汇总"""
+
+    # 汇总里最多保留的 (接口, 语句) 条数，超过后新语句不再单独统计
+    MAX_AGGREGATE_ENTRIES = 2000
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def connect_kwargs(self):
+        """建连接时的额外参数（database.py 传给连接池）"""
+        return {'cursor_factory': ProfilingCursor} if self.enabled else {}
+
+    def reset(self):
+        with self._lock:
+            # (接口, 模板) → {'calls', 'total_ms', 'max_ms', 'rows', 'params'}
+            self.aggregate = {}
+            # 接口 → {'requests', 'queries', 'db_ms', 'n_plus_one', 'duplicate'}
+            self.endpoints = {}
+
+    # ---------- 请求级 ----------
+
+    def start(self, name):
+        if not self.enabled:
+            return None
+        profile = RequestProfile(name)
+        _current.set(profile)
+        return profile
+
+    def finish(self):
+        """结束当前请求的记录，汇总并返回它（没有在记录时返回None）"""
+        profile = _current.get()
+        if profile is None:
+            return None
+        _current.set(None)
+
+        profile.problems = profile.repeated()
+        self._aggregate(profile)
+        if profile.problems:
+            print(f"🐢 SQL分析 {profile.name}：{len(profile.statements)}条SQL，{profile.total_ms:.1f}ms")
+            for template, count, kind in profile.problems:
+                print(f"    [{kind}] {count}次：{template[:200]}")
+        return profile
+
+    @contextmanager
+    def scope(self, name):
+        """不经过Flask时手动划定一个"请求"（性能测试、脚本）"""
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.finish()
+
+    def _aggregate(self, profile):
+        with self._lock:
+            endpoint = self.endpoints.setdefault(profile.name, {
+                'requests': 0, 'queries': 0, 'db_ms': 0.0, 'n_plus_one': 0, 'duplicate': 0
+            })
+            endpoint['requests'] += 1
+            endpoint['queries'] += len(profile.statements)
+            endpoint['db_ms'] += profile.total_ms
+            endpoint['n_plus_one'] += sum(1 for _, _, kind in profile.problems if kind == 'N+1')
+            endpoint['duplicate'] += sum(1 for _, _, kind in profile.problems if kind == '重复')
+
+            for template, shape, _, rows, elapsed in profile.statements:
+                key = (profile.name, template)
+                entry = self.aggregate.get(key)
+                if entry is None:
+                    if len(self.aggregate) >= self.MAX_AGGREGATE_ENTRIES:
+                        continue
+                    entry = self.aggregate[key] = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'params': shape}
+                elapsed_ms = elapsed * 1000
+                entry['calls'] += 1
+                entry['total_ms'] += elapsed_ms
+                entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+                entry['rows'] += max(rows, 0)
+
+    # ---------- Flask ----------
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        print("🔬 SQL分析已开启（SQL_PROFILE=1）")
+
+    def _before_request(self):
+        from flask import request
+        self.start(request.endpoint or request.path)
+
+    def _after_request(self, response):
+        profile = self.finish()
+        if profile is not None:
+            response.headers.add('Server-Timing',
+                                 f'db;dur={profile.total_ms:.1f};desc="{len(profile.statements)} queries"')
+            response.headers['X-SQL-Profile'] = (
+                f'queries={len(profile.statements)}; ms={profile.total_ms:.1f}; repeated={len(profile.problems)}'
+            )
+        return response
+
+    # ---------- 报告 ----------
+
+    def report(self, top=20):
+        """汇总报告：每个接口的平均SQL条数/耗时，总耗时最多的语句"""
+        with self._lock:
+            endpoints = {
+                name: dict(stats,
+                           db_ms=round(stats['db_ms'], 1),
+                           queries_per_request=round(stats['queries'] / stats['requests'], 1),
+                           db_ms_per_request=round(stats['db_ms'] / stats['requests'], 2))
+                for name, stats in self.endpoints.items()
+            }
+            statements = sorted(self.aggregate.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:top]
+
+        return {
+            'enabled': self.enabled,
+            'endpoints': endpoints,
+            'top_statements': [
+                {'endpoint': name, 'statement': template[:300], 'calls': entry['calls'],
+                 'total_ms': round(entry['total_ms'], 1),
+                 'avg_ms': round(entry['total_ms'] / entry['calls'], 2),
+                 'max_ms': round(entry['max_ms'], 1), 'rows': entry['rows'], 'params': entry['params']}
+                for (name, template), entry in statements
+            ]
+        }
+
+
+sql_profiler = SQLProfiler(SQL_PROFILE)
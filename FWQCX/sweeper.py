@@ -0,0 +1,178 @@
+"""
+后台定时任务
+文件名：sweeper.py
+
+在服务器进程里开一个后台线程，按固定间隔执行清理任务：
+- 释放过期的次数预留（reservations.py）
+- 把过期会员标记为无效（services.py），热点查询只走有效会员的部分索引
+- 重建邮箱/卡密布隆过滤器（bloom.py），启动时立即建一次
+- 把会员状态查询攒下的最后检查时间批量写回（services.py）
+- 检查只读从库，摘掉连不上/延迟太大的，恢复的重新加入（database.py）
+- 会员等级目录（vip_tiers表）有变化时重新加载，启动时立即加载一次（tiers.py）
+- 分块执行卡密批量冻结/作废任务，重启后从记录的进度接着做（card_jobs.py）
+
+每个任务记录最近一次处理了多少行、耗时多少，/api/status 里可以看到。
+
+用法（app.py启动时）：
+    from sweeper import start_background_tasks
+    start_background_tasks()
+"""
+
+import threading
+import time
+
+# 每批处理的条数：批次小一点，单个事务锁住的行就少
+SWEEP_BATCH_SIZE = 500
+
+
+class PeriodicTask:
+    """按固定间隔重复执行一个函数的后台线程"""
+
+    def __init__(self, name, func, interval, run_at_start=False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.run_at_start = run_at_start
+        self._stop_event = threading.Event()
+        self._thread = None
+        # 运行统计
+        self.stats = {
+            'runs': 0,
+            'last_run': None,
+            'last_processed': 0,
+            'last_elapsed_ms': 0,
+            'total_processed': 0,
+            'errors': 0
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        # daemon线程：主进程退出时不需要等它
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        print(f"⏱️ 后台任务已启动：{self.name}（每{self.interval}秒）")
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run_once(self):
+        """执行一次，返回处理的条数；出错只打印，不让线程退出"""
+        start = time.perf_counter()
+        self.stats['runs'] += 1
+        self.stats['last_run'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            processed = self.func()
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"❌ 后台任务 {self.name} 执行失败：{e}")
+            return 0
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stats['last_processed'] = processed
+        self.stats['last_elapsed_ms'] = round(elapsed, 1)
+        self.stats['total_processed'] += processed
+
+        if processed:
+            print(f"🧹 {self.name}：处理{processed}条，耗时{elapsed:.1f}ms")
+        return processed
+
+    def _run(self):
+        if self.run_at_start:
+            self.run_once()
+        while not self._stop_event.wait(self.interval):
+            self.run_once()
+
+
+def expire_reservations():
+    """释放过期预留，一次处理不完就继续下一批"""
+    from reservations import reservation_service
+
+    total = 0
+    while True:
+        processed = reservation_service.expire_reservations(SWEEP_BATCH_SIZE)
+        total += processed
+        if processed < SWEEP_BATCH_SIZE:
+            return total
+
+
+def expire_members():
+    """把过期会员标记为无效、作废他们会员状态查询的ETag，一次处理不完就继续下一批"""
+    from httpcache import http_cache
+    from services import vip_service
+
+    total = 0
+    while True:
+        emails = vip_service.expire_members(SWEEP_BATCH_SIZE)
+        for email in emails:
+            http_cache.invalidate(email)
+        total += len(emails)
+        if len(emails) < SWEEP_BATCH_SIZE:
+            return total
+
+
+def flush_last_checks():
+    """把会员状态查询攒下的最后检查时间批量写回主库"""
+    from services import vip_service
+
+    return vip_service.flush_last_checks()
+
+
+def check_replicas():
+    """检查只读从库的连通性和复制延迟，恢复的从库重新加入；返回不可用的从库个数"""
+    from services import db
+
+    return len(db.replicas) - db.check_replicas()
+
+
+def rebuild_negative_cache():
+    """重建布隆过滤器（流式扫描，建好后原子替换）"""
+    from bloom import negative_cache
+    from services import db
+
+    return negative_cache.rebuild(db)
+
+
+def run_card_key_jobs():
+    """分块执行卡密批量冻结/作废任务，返回这一轮改了几张卡密"""
+    from card_jobs import card_key_jobs
+
+    return card_key_jobs.run_pending()
+
+
+def reload_tier_catalog():
+    """会员等级目录有变化时换成新快照；返回1表示换了，0表示没变"""
+    from services import db
+    from tiers import tier_catalog
+
+    return tier_catalog.reload(db)
+
+
+# 所有后台任务
+TASKS = [
+    PeriodicTask('过期预留清理', expire_reservations, interval=30),
+    PeriodicTask('过期会员清理', expire_members, interval=300),
+    PeriodicTask('布隆过滤器重建', rebuild_negative_cache, interval=600, run_at_start=True),
+    PeriodicTask('最后检查时间写回', flush_last_checks, interval=30),
+    PeriodicTask('从库健康检查', check_replicas, interval=10, run_at_start=True),
+    PeriodicTask('会员等级目录刷新', reload_tier_catalog, interval=30, run_at_start=True),
+    PeriodicTask('卡密批量操作', run_card_key_jobs, interval=5, run_at_start=True),
+]
+
+
+def start_background_tasks():
+    for task in TASKS:
+        task.start()
+
+
+def stop_background_tasks(timeout=None):
+    for task in TASKS:
+        task.stop(timeout)
+
+
+def task_stats():
+    """所有后台任务的运行统计"""
+    return {task.name: dict(task.stats) for task in TASKS}
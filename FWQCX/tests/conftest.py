@@ -0,0 +1,11 @@
+"""
+测试配置：服务端模块都是平铺在 FWQCX/ 下直接 import 的（import rules / import cardkey），
+把上一级目录加到 sys.path
+
+运行：在 FWQCX/ 目录下 python -m pytest -q
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,141 @@
+"""
+cache_backend.py 的本地后端（memory:// 和 sqlite://）和 RateLimiter
+"""
+
+import multiprocessing
+import sqlite3
+import time
+
+import pytest
+
+from cache_backend import MemoryBackend, RateLimiter, SQLiteBackend, create_backend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'cache.db'))
+
+
+def test_get_set_delete(backend):
+    assert backend.get('a') is None
+    backend.set('a', 'x', 30)
+    assert backend.get('a') == 'x'
+    backend.set('a', 123, 30)
+    assert backend.get('a') == '123'    # 值一律是字符串
+    backend.delete('a')
+    assert backend.get('a') is None
+    backend.delete('a')                 # 删不存在的键不报错
+
+
+def test_ttl_expiry(backend):
+    backend.set('a', 'x', 0.05)
+    assert backend.get('a') == 'x'
+    time.sleep(0.1)
+    assert backend.get('a') is None
+
+
+def test_incr_window(backend):
+    assert backend.incr('n', 0.1) == 1
+    assert backend.incr('n', 0.1) == 2
+    assert backend.get('n') == '2'
+    # 过期时间从第一次计数开始算，后面的计数不延长窗口
+    time.sleep(0.15)
+    assert backend.incr('n', 0.1) == 1
+
+
+def test_memory_eviction():
+    backend = MemoryBackend(max_entries=3)
+    for i in range(5):
+        backend.set(f'k{i}', i, 30)
+    assert backend.get('k0') is None and backend.get('k1') is None
+    assert backend.get('k4') == '4'
+
+
+def test_create_backend(tmp_path):
+    assert create_backend('memory://').name == 'memory'
+    assert create_backend(f'sqlite://{tmp_path}/c.db').name == 'sqlite'
+    with pytest.raises(ValueError):
+        create_backend('memcached://localhost')
+
+
+def test_sqlite_shared_between_connections(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    first.set('etag:check:a@qq.com', 'abc', 30)
+    assert second.get('etag:check:a@qq.com') == 'abc'
+    second.delete('etag:check:a@qq.com')
+    assert first.get('etag:check:a@qq.com') is None
+    first.incr('n', 30)
+    assert second.incr('n', 30) == 2
+
+
+def _count_in_child(path, times):
+    backend = SQLiteBackend(path)
+    for _ in range(times):
+        backend.incr('shared', 30)
+
+
+def test_sqlite_shared_between_processes(tmp_path):
+    """两个进程同时计数，一次都不丢"""
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        pytest.skip('需要fork')
+    path = str(tmp_path / 'cache.db')
+    SQLiteBackend(path)
+    children = [context.Process(target=_count_in_child, args=(path, 50)) for _ in range(2)]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join(30)
+        assert child.exitcode == 0
+    assert SQLiteBackend(path).get('shared') == '100'
+
+
+def test_sqlite_errors_degrade(tmp_path):
+    """文件被锁住时和Redis后端一样降级：get返回None、incr返回0，不抛异常"""
+    path = str(tmp_path / 'cache.db')
+    backend = SQLiteBackend(path)
+    backend.set('a', 'x', 30)
+
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN EXCLUSIVE")
+    backend._connect = lambda: sqlite3.connect(path, timeout=0.05, isolation_level=None)
+    backend._local = type(backend._local)()     # 换成短超时的新连接
+    try:
+        backend.set('a', 'y', 30)
+        assert backend.incr('n', 30) == 0
+        backend.delete('a')
+        assert backend.errors == 3
+        assert backend.get('a') == 'x'      # WAL模式下读不受写锁影响
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+    assert backend.incr('n', 30) == 1
+
+
+def test_sqlite_read_error_returns_none(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.db'))
+    backend.set('a', 'x', 30)
+    backend._conn.close()       # 之后的查询抛 sqlite3.ProgrammingError
+    assert backend.get('a') is None
+    assert backend.stats()['errors'] == 2
+
+
+def test_rate_limiter(backend):
+    limiter = RateLimiter(backend, 'login', limit=3, window=0.1)
+    key = '1.2.3.4:a@qq.com'
+    assert not limiter.blocked(key)
+    for _ in range(3):
+        limiter.hit(key)
+    assert limiter.blocked(key)
+    assert not limiter.blocked('5.6.7.8:a@qq.com')     # 别的IP不受影响
+    limiter.reset(key)
+    assert not limiter.blocked(key)
+
+    for _ in range(3):
+        limiter.hit(key)
+    time.sleep(0.15)
+    assert not limiter.blocked(key)                     # 窗口过了自动清零
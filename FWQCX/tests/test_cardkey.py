@@ -0,0 +1,80 @@
+"""
+cardkey.py：卡密空间、碰撞概率、格式和签名段
+"""
+
+import pytest
+
+import cardkey
+
+SECRET = b'test-secret'
+
+
+def test_alphabet_and_key_space():
+    assert len(cardkey.ALPHABET) == 32
+    assert len(set(cardkey.ALPHABET)) == 32
+    assert not set('ILOU') & set(cardkey.ALPHABET)   # 去掉了容易看错的字母
+    assert cardkey.KEY_SPACE == 32 ** 16 == 2 ** 80
+    assert cardkey.SIGNED_KEY_SPACE == 32 ** 12 == 2 ** 60
+    # 10个随机字节正好编码成16个字符，没有浪费的位
+    assert cardkey.KEY_BYTES * 8 == cardkey.KEY_CHARS * 5
+
+
+@pytest.mark.parametrize('quantity, space, expected', [
+    (10 ** 6, cardkey.KEY_SPACE, 4.1e-13),           # 一次生成100万张
+    (10 ** 9, cardkey.KEY_SPACE, 4.1e-7),            # 累计10亿张
+    (10 ** 6, cardkey.SIGNED_KEY_SPACE, 4.3e-7),     # 签名卡密100万张
+])
+def test_birthday_bound(quantity, space, expected):
+    probability = cardkey.collision_probability(quantity, space)
+    assert probability == pytest.approx(expected, rel=0.05)
+    # 概率很小时和 n²/2N 的近似一致（模块文档里用的公式）
+    assert probability == pytest.approx(quantity ** 2 / (2 * space), rel=1e-3)
+
+
+def test_birthday_bound_grows_with_batch():
+    assert cardkey.collision_probability(0) == 0
+    assert cardkey.collision_probability(1) == 0
+    # 2^40 张时约 39%（生日界在空间大小的平方根附近）
+    assert cardkey.collision_probability(2 ** 40) == pytest.approx(0.393, abs=0.001)
+
+
+def test_generated_keys_format():
+    keys = cardkey.generate_keys(1000)
+    assert len(set(keys)) == 1000
+    for key in keys:
+        assert cardkey.KEY_PATTERN.fullmatch(key)
+        assert key.startswith(cardkey.PREFIX)
+        assert set(key[4:].replace('-', '')) <= set(cardkey.ALPHABET)
+        assert cardkey.precheck(key) is None
+
+
+def test_format_key_round_trip():
+    body = cardkey.random_bodies(1)[0]
+    key = cardkey.format_key(body)
+    assert key == f'VIP-{body[:4]}-{body[4:8]}-{body[8:12]}-{body[12:]}'
+    assert key[4:].replace('-', '') == body
+
+
+def test_signed_keys():
+    for key in cardkey.generate_signed_keys(200, SECRET):
+        assert cardkey.KEY_PATTERN.fullmatch(key)
+        assert cardkey.is_signed(key, SECRET)
+        assert not cardkey.is_signed(key, b'other-secret')
+
+
+def test_signature_catches_typos():
+    key = cardkey.generate_signed_keys(1, SECRET)[0]
+    position = 5        # 第二段的第一个字符
+    replacement = '0' if key[position] != '0' else '1'
+    mistyped = key[:position] + replacement + key[position + 1:]
+    assert not cardkey.is_signed(mistyped, SECRET)
+
+
+def test_precheck(monkeypatch):
+    assert cardkey.precheck('VIP-1234') is not None
+    assert cardkey.precheck('vip-aaaa-aaaa-aaaa-aaaa') is not None
+
+    monkeypatch.setattr(cardkey, 'CARD_KEY_SECRET', SECRET)
+    monkeypatch.setattr(cardkey, 'ALLOW_UNSIGNED', False)
+    assert cardkey.precheck(cardkey.generate_signed_keys(1)[0]) is None
+    assert cardkey.precheck('VIP-AAAA-AAAA-AAAA-AAAA') == cardkey.NOT_FOUND
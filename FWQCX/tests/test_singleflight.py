@@ -0,0 +1,83 @@
+"""
+singleflight.py：并发的相同查询合并成一次，forget 之后来的调用重新查
+"""
+
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+def _start_leader(flight, key, result):
+    """启动一个卡在查询里的 leader，返回 (放行用的Event, 线程, 结果列表)"""
+    entered = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def query():
+        entered.set()
+        release.wait(5)
+        return result
+
+    thread = threading.Thread(target=lambda: results.append(flight.do(key, query)))
+    thread.start()
+    assert entered.wait(5)
+    return release, thread, results
+
+
+def _wait_shared(flight, count):
+    """等跟随者真正加入进行中的查询"""
+    deadline = time.monotonic() + 5
+    while flight.stats()['shared'] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_query():
+    flight = SingleFlight('测试')
+    release, leader, results = _start_leader(flight, 'k', 'old')
+
+    follower = threading.Thread(target=lambda: results.append(flight.do('k', lambda: 'unused')))
+    follower.start()
+    _wait_shared(flight, 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert results == ['old', 'old']
+    assert flight.stats()['executed'] == 1
+    assert flight.stats()['shared'] == 1
+
+
+def test_forget_makes_later_calls_query_again():
+    flight = SingleFlight('测试')
+    release, leader, results = _start_leader(flight, 'k', 'old')
+
+    # 写已经提交：之后来的调用不能再拿 leader 那次（写之前开始的）查询结果
+    flight.forget('k')
+    assert flight.do('k', lambda: 'new') == 'new'
+
+    release.set()
+    leader.join(5)
+    assert results == ['old']
+    assert flight.stats() == {'calls': 2, 'executed': 2, 'shared': 0, 'in_flight': 0}
+
+
+def test_old_leader_does_not_remove_newer_call():
+    flight = SingleFlight('测试')
+    release_old, old_leader, _ = _start_leader(flight, 'k', 'old')
+    flight.forget('k')
+    release_new, new_leader, new_results = _start_leader(flight, 'k', 'new')
+
+    release_old.set()
+    old_leader.join(5)
+    # 旧 leader 结束时不能把新的查询从表里删掉，后来的调用仍然合并到新查询上
+    assert flight.stats()['in_flight'] == 1
+
+    follower = threading.Thread(target=lambda: new_results.append(flight.do('k', lambda: 'unused')))
+    follower.start()
+    _wait_shared(flight, 1)
+    release_new.set()
+    new_leader.join(5)
+    follower.join(5)
+    assert new_results == ['new', 'new']
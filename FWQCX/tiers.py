@@ -0,0 +1,114 @@
+"""
+会员等级目录 - 存在数据库里，内存里放一份只读快照
+文件名：tiers.py
+
+1. 等级配置（名称、天数、次数、价格）存在 vip_tiers 表里，改价格/改次数直接改表，不用重新部署
+2. 进程内只读快照（TierSnapshot），请求只读内存，任何请求都不查 vip_tiers 表
+3. 后台任务（sweeper.py）定期比较版本号（整张表内容的md5），
+   变了才重新读取，建好新快照后整体替换，正在处理的请求看到的始终是完整的一份
+4. 启动时先用 rules.VIP_BENEFITS 里的默认值，数据库读到之后再替换；
+   vip_tiers 表为空时写入默认值（database.py 初始化时）
+
+用法：
+    from tiers import tier_catalog
+
+    tier = tier_catalog.current.get(2)      # Tier(level=2, name='月度会员', days=30, ...)
+    name = tier_catalog.current.name(2)     # '月度会员'
+"""
+
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import rules
+
+
+@dataclass(frozen=True)
+class Tier:
+    """一个会员等级（不可修改）"""
+    level: int
+    name: str
+    days: int
+    lyrics: int
+    music: int
+    price: float
+    description: str
+
+
+class TierSnapshot:
+    """某一时刻的完整等级目录（只读）"""
+
+    def __init__(self, tiers, version):
+        self.tiers = MappingProxyType({tier.level: tier for tier in tiers})
+        self.version = version
+
+    def get(self, level):
+        return self.tiers.get(level)
+
+    def name(self, level):
+        tier = self.tiers.get(level)
+        return tier.name if tier else '会员'
+
+    def __len__(self):
+        return len(self.tiers)
+
+    def to_list(self):
+        return [
+            {'level': t.level, 'name': t.name, 'days': t.days, 'lyrics': t.lyrics,
+             'music': t.music, 'price': t.price, 'description': t.description}
+            for t in self.tiers.values()
+        ]
+
+
+def default_snapshot():
+    """rules.VIP_BENEFITS 里的默认等级（数据库还没读到时用）"""
+    return TierSnapshot(
+        [Tier(level, b['name'], b['days'], b['lyrics'], b['music'], b['price'], b['description'])
+         for level, b in sorted(rules.VIP_BENEFITS.items())],
+        version='default'
+    )
+
+
+class TierCatalog:
+    """持有当前快照；reload() 发现数据库里的等级变了就整体换成新快照"""
+
+    def __init__(self):
+        self.current = default_snapshot()
+        self.reloads = 0
+
+    def reload(self, database):
+        """检查版本号，变了就重新加载；返回1表示换了新快照，0表示没变"""
+        with database.read_connection() as conn, conn.cursor() as cursor:
+            # 整张表的内容算一个md5当版本号，几行数据，开销可以忽略
+            cursor.execute("""
+                SELECT md5(COALESCE(string_agg(t::text, '|' ORDER BY level), ''))
+                FROM vip_tiers t
+            """)
+            version = cursor.fetchone()[0]
+            if version == self.current.version:
+                return 0
+
+            cursor.execute("""
+                SELECT level, name, days, lyrics, music, price, description
+                FROM vip_tiers ORDER BY level
+            """)
+            rows = cursor.fetchall()
+
+        if not rows:
+            print("⚠️ vip_tiers 表是空的，继续使用当前的会员等级")
+            return 0
+
+        tiers = [
+            Tier(level, name, days, lyrics, music, float(price or 0), description or '')
+            for level, name, days, lyrics, music, price, description in rows
+        ]
+        # 一次赋值替换整个快照：请求线程要么看到旧的，要么看到新的，不会看到一半
+        self.current = TierSnapshot(tiers, version)
+        self.reloads += 1
+        print(f"📋 会员等级目录已更新：{len(tiers)}个等级（版本{version[:8]}）")
+        return 1
+
+    def stats(self):
+        return {'version': self.current.version, 'tiers': len(self.current), 'reloads': self.reloads}
+
+
+tier_catalog = TierCatalog()